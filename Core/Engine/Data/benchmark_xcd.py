@@ -0,0 +1,180 @@
+import os
+import sys
+import time
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "io_scene_xcd"))
+
+from writer_xcd import XCDBufferedWriter, DEFAULT_BUFFER_SIZE
+from hierarchy_xcd import BuildHierarchy, WalkHierarchy
+
+# -------------------------------------------------------------------------
+# Benchmarks for the parts of the xcd exporter that run without Blender
+#   python benchmark_xcd.py [elementCount] [hierarchyObjects] [hierarchyDepth]
+# -------------------------------------------------------------------------
+class CountingFile:
+    def __init__(self, file):
+        self._file = file
+        self.writeCalls = 0
+
+    def write(self, data):
+        self.writeCalls = self.writeCalls + 1
+        return self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+BOUNDING_BOX = [(0.0, 0.0, 0.0)] * 8
+LAYERS = [True] + [False] * 19
+
+def WriteElementsUnbuffered(target, count):
+    write = target.write
+    for i in range(count):
+        write('<element id="Bush_%03d"' % i)
+        write(' link="..\\Models\\Foliage\\BushPlaceholder1.dae"')
+        write('>')
+        write('<translation>%.6f %.6f %.6f</translation>' % (i, i, 0.0))
+        write('<rotation>%d %f %f %f %f</rotation>' % (2, 0.0, 0.0, 0.0, 1))
+        write('<scale>%.6f %.6f %.6f</scale>' % (1.0, 1.0, 1.0))
+        write('<boundingBox>')
+        for point in BOUNDING_BOX:
+            write('<point>')
+            needSpace = False
+            for entry in point:
+                if needSpace:
+                    write(' ')
+                write(str(entry))
+                needSpace = True
+            write('</point>')
+        write('</boundingBox>')
+        write('<layers>')
+        needSpace = False
+        for entry in LAYERS:
+            if needSpace:
+                write(' ')
+            write(str(1) if entry else str(0))
+            needSpace = True
+        write('</layers>')
+        write('<customproperties>')
+        write('</customproperties>')
+        write('</element>')
+
+def WriteElementsBuffered(writer, count):
+    for i in range(count):
+        points = ['<point>%s</point>' % ' '.join([str(entry) for entry in point]) for point in BOUNDING_BOX]
+        writer.WriteParts(['<element id="Bush_%03d"' % i,
+                           ' link="..\\Models\\Foliage\\BushPlaceholder1.dae"',
+                           '>',
+                           '<translation>%.6f %.6f %.6f</translation>' % (i, i, 0.0),
+                           '<rotation>%d %f %f %f %f</rotation>' % (2, 0.0, 0.0, 0.0, 1),
+                           '<scale>%.6f %.6f %.6f</scale>' % (1.0, 1.0, 1.0),
+                           '<boundingBox>%s</boundingBox>' % ''.join(points),
+                           '<layers>%s</layers>' % ' '.join(['1' if entry else '0' for entry in LAYERS]),
+                           '<customproperties></customproperties>'])
+        writer.Write('</element>')
+
+def BenchmarkWriter(count, bufferSize=DEFAULT_BUFFER_SIZE):
+    directory = tempfile.mkdtemp()
+    unbufferedPath = os.path.join(directory, "unbuffered.xcd")
+    bufferedPath = os.path.join(directory, "buffered.xcd")
+
+    target = CountingFile(open(unbufferedPath, 'w', encoding='utf-8'))
+    start = time.perf_counter()
+    WriteElementsUnbuffered(target, count)
+    target.close()
+    unbufferedTime = time.perf_counter() - start
+    unbufferedWrites = target.writeCalls
+
+    target = CountingFile(open(bufferedPath, 'w', encoding='utf-8'))
+    start = time.perf_counter()
+    writer = XCDBufferedWriter(target, bufferSize)
+    WriteElementsBuffered(writer, count)
+    writer.Close()
+    bufferedTime = time.perf_counter() - start
+
+    with open(unbufferedPath, 'rb') as file:
+        unbufferedData = file.read()
+    with open(bufferedPath, 'rb') as file:
+        bufferedData = file.read()
+
+    print("Writer, %d elements, buffer %d bytes" % (count, bufferSize))
+    print("  unbuffered: %8d writes %8.3fs" % (unbufferedWrites, unbufferedTime))
+    print("  buffered:   %8d writes %8.3fs" % (target.writeCalls, bufferedTime))
+    print("  identical output: %s" % (unbufferedData == bufferedData))
+
+    os.remove(unbufferedPath)
+    os.remove(bufferedPath)
+    os.rmdir(directory)
+
+class SyntheticObject:
+    def __init__(self, name, parent):
+        self.name = name
+        self.parent = parent
+
+def BuildHierarchyRecursive(objects):
+    # The exporter's previous hierarchy build, walks up the parents for every object
+    objectSet = set(objects)
+    parentLookup = {}
+
+    def testParent(parent):
+        while (parent is not None) and (parent not in objectSet):
+            parent = parent.parent
+        return parent
+
+    for obj in objects:
+        parentLookup.setdefault(testParent(obj.parent), []).append((obj, []))
+
+    for parent, children in parentLookup.items():
+        for obj, subchildren in children:
+            subchildren[:] = parentLookup.get(obj, [])
+
+    return parentLookup.get(None, [])
+
+def WalkHierarchyRecursive(hierarchy, visit):
+    for obj, children in hierarchy:
+        visit(obj)
+        WalkHierarchyRecursive(children, visit)
+
+def RunHierarchy(exported):
+    visited = []
+    start = time.perf_counter()
+    try:
+        WalkHierarchyRecursive(BuildHierarchyRecursive(exported), visited.append)
+        print("  recursive:  %8.3fs" % (time.perf_counter() - start))
+    except RecursionError:
+        print("  recursive:  RecursionError after %d objects, %.3fs" % (len(visited), time.perf_counter() - start))
+
+    visited = []
+    start = time.perf_counter()
+    WalkHierarchy(BuildHierarchy(exported), lambda obj, level: visited.append(obj) or True)
+    print("  iterative:  %8.3fs, visited %d" % (time.perf_counter() - start, len(visited)))
+
+def BenchmarkHierarchy(count, depth):
+    chains = max(count // depth // 2, 1)
+
+    # Deep parenting chains where every object is exported
+    exported = []
+    for chain in range(chains * 2):
+        parent = None
+        for level in range(depth):
+            parent = SyntheticObject("Chain%d_%d" % (chain, level), parent)
+            exported.append(parent)
+    print("Hierarchy, %d exported objects in chains of depth %d" % (len(exported), depth))
+    RunHierarchy(exported)
+
+    # Exported leaves hanging off chains of objects that are not exported
+    exported = []
+    for chain in range(chains):
+        parent = None
+        for level in range(depth):
+            parent = SyntheticObject("Chain%d_%d" % (chain, level), parent)
+            exported.append(SyntheticObject("Leaf%d_%d" % (chain, level), parent))
+    print("Hierarchy, %d exported leaves under hidden chains of depth %d" % (len(exported), depth))
+    RunHierarchy(exported)
+
+if __name__ == "__main__":
+    elementCount = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    hierarchyObjects = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+    hierarchyDepth = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+    BenchmarkWriter(elementCount)
+    BenchmarkHierarchy(hierarchyObjects, hierarchyDepth)
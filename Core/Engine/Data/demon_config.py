@@ -0,0 +1,83 @@
+import os
+import re
+
+from xml.etree import ElementTree
+
+# -------------------------------------------------------------------------
+# Reads the stage export rules of a DataDemon config (demon.conf)
+#
+#   <IncludeSource Path="..."/>         source roots, matched by index to
+#   <IncludeIntermediate Path="..."/>   the intermediate roots
+#   <StageExport Pattern="^(Stages\\.*\\.*?)\.blend$" Target="{0}\.xcd"/>
+#
+# Patterns are matched against the source path relative to its root with
+# windows separators, the target is formatted with the pattern groups.
+# -------------------------------------------------------------------------
+class DemonConfig:
+    sourceRoots = None
+    intermediateRoots = None
+    stageExports = None
+    refreshInterval = 5000
+
+    def __init__(self, filePath):
+        root = ElementTree.parse(filePath).getroot()
+
+        self.refreshInterval = int(root.get('RefreshInterval', 5000))
+        self.sourceRoots = [node.get('Path') for node in root.findall('IncludeSource')]
+        self.intermediateRoots = [node.get('Path') for node in root.findall('IncludeIntermediate')]
+        self.stageExports = [(re.compile(node.get('Pattern'), re.IGNORECASE), node.get('Target').replace('\\.', '.'))
+                             for node in root.findall('StageExport')]
+
+    def ResolveStage(self, sourcePath):
+        """Returns the target of a source file or None if no StageExport rule matches it"""
+        sourcePath = os.path.abspath(sourcePath)
+        for index, sourceRoot in enumerate(self.sourceRoots):
+            sourceRoot = os.path.abspath(sourceRoot)
+            if not sourcePath.lower().startswith(sourceRoot.lower() + os.sep):
+                continue
+
+            relativePath = os.path.relpath(sourcePath, sourceRoot).replace(os.sep, '\\')
+            for pattern, target in self.stageExports:
+                match = pattern.match(relativePath)
+                if match is None:
+                    continue
+
+                relativeTarget = target.format(*match.groups()).replace('\\', os.sep)
+                return os.path.join(self._IntermediateRoot(index), relativeTarget)
+
+        return None
+
+    def FindStages(self):
+        """Returns (source, target) for every file under the source roots matched by a StageExport rule"""
+        stages = []
+        for sourceRoot in self.sourceRoots:
+            for directory, directories, files in os.walk(sourceRoot):
+                directories.sort()
+                for fileName in sorted(files):
+                    sourcePath = os.path.join(directory, fileName)
+                    target = self.ResolveStage(sourcePath)
+                    if target:
+                        stages.append((sourcePath, target))
+        return stages
+
+    def _IntermediateRoot(self, index):
+        if index < len(self.intermediateRoots):
+            return self.intermediateRoots[index]
+        return self.intermediateRoots[0]
+
+def ReadManifest(filePath):
+    """Reads 'source.blend -> target.xcd' lines, empty lines and lines starting with # are skipped"""
+    stages = []
+    baseDirectory = os.path.dirname(os.path.abspath(filePath))
+    with open(filePath, 'r', encoding='utf-8') as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+
+            if ' -> ' not in line:
+                raise ValueError("Invalid manifest line, expected 'source -> target': %s" % line)
+
+            source, target = [os.path.join(baseDirectory, part.strip()) for part in line.split(' -> ', 1)]
+            stages.append((source, target))
+    return stages
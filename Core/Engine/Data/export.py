@@ -1,8 +1,246 @@
 import bpy
+import os
 import sys
+import json
+import time
+import argparse
 
-outFile = sys.argv[-1:][0]
-print("Exporting XCD to %s" % outFile)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-bpy.ops.export_scene.xcd(filepath=outFile, check_existing=False)
-sys.exit(0)
+from demon_config import DemonConfig, ReadManifest
+from source_watch import SourceWatcher
+
+# Arguments after -- belong to the script:
+#   [options] outFile                  export the opened .blend
+#   [options] --pair source target     export each pair in this session, repeatable
+#   [options] --manifest FILE          'source -> target' lines
+#   [options] --config demon.conf      every stage matched by the StageExport rules
+#   [options] --watch [--status FILE]  after the first export keep running and re-export the
+#                                      stages whose .blend or linked libraries change
+arguments = sys.argv[sys.argv.index("--") + 1:] if "--" in sys.argv else sys.argv[-1:]
+
+parser = argparse.ArgumentParser(prog="export.py")
+parser.add_argument("--compress", action="store_true",
+                    help="write a gzip compressed stage (.xcd.gz)")
+parser.add_argument("--compression-level", type=int, choices=range(1, 10), default=6, metavar="LEVEL",
+                    help="with --compress, gzip level 1-9, defaults to 6")
+parser.add_argument("--log-level", default="WARNING", choices=["ERROR", "WARNING", "INFO", "DEBUG"],
+                    help="exporter console output, defaults to WARNING")
+parser.add_argument("--trace", action="store_true",
+                    help="write a per object trace (json lines) next to each stage as <target>.trace")
+parser.add_argument("--rotation", default="MODE", choices=["MODE", "QUATERNION", "MATRIX"],
+                    help="rotation encoding, MODE keeps the values of the object rotation mode")
+parser.add_argument("--flatten", action="store_true",
+                    help="bake world transforms into static elements and collapse placement-only empties")
+parser.add_argument("--link-rules", metavar="RULES",
+                    help="'from=to' replacements separated by ';' turning library paths into links")
+parser.add_argument("--link-table", action="store_true",
+                    help="write links once into a table referenced by index")
+parser.add_argument("--integer-ids", action="store_true",
+                    help="write a dense integer uid next to every element, light and camera name")
+parser.add_argument("--world-bounds", action="store_true",
+                    help="write world space bounds (box and sphere) for every element")
+parser.add_argument("--bvh", action="store_true",
+                    help="write elements in spatial order followed by a bvh over their world bounds")
+parser.add_argument("--tile-size", type=float, default=0.0, metavar="SIZE",
+                    help="write one stage per grid cell of SIZE plus a .xcdt index instead of a single stage")
+parser.add_argument("--meshes", action="store_true",
+                    help="write mesh objects as binary .xcdm models next to the stage")
+parser.add_argument("--mesh-optimize", default="CACHE", choices=["NONE", "CACHE", "OVERDRAW"],
+                    help="reordering of exported mesh buffers, defaults to CACHE")
+parser.add_argument("--quantize", action="store_true",
+                    help="quantize exported mesh attributes within the default error bounds")
+parser.add_argument("--lods", default="", metavar="RATIOS",
+                    help="generate levels of detail for exported meshes, e.g. '0.5 0.25 0.125'")
+parser.add_argument("--batch-size", type=float, default=0.0, metavar="SIZE",
+                    help="merge small static meshes per material within grid cells of SIZE")
+parser.add_argument("--pair", nargs=2, action="append", default=[], metavar=("SOURCE", "TARGET"),
+                    help="export the SOURCE .blend to TARGET, can be given multiple times")
+parser.add_argument("--manifest", help="file listing 'source.blend -> target.xcd' lines")
+parser.add_argument("--config", help="demon.conf whose StageExport rules select the stages")
+parser.add_argument("--watch", action="store_true",
+                    help="keep this session running and re-export stages when their .blend or a linked library changes")
+parser.add_argument("--status", metavar="FILE",
+                    help="with --watch, json file rewritten with the state and the last result of every stage")
+parser.add_argument("--poll-interval", type=float, default=1.0, metavar="SECONDS",
+                    help="with --watch, interval of the polling fallback when inotify is not available")
+parser.add_argument("--polling", action="store_true",
+                    help="with --watch, poll modification times even where inotify is available")
+parser.add_argument("outFile", nargs="?")
+args = parser.parse_args(arguments)
+
+def ExportStage(source, target):
+    if source:
+        bpy.ops.wm.open_mainfile(filepath=source)
+
+    directory = os.path.dirname(os.path.abspath(target))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    options = {'log_level': args.log_level}
+    if args.compress:
+        options['use_compression'] = True
+        options['compression_level'] = args.compression_level
+    if args.rotation != 'MODE':
+        options['rotation_encoding'] = args.rotation
+    if args.flatten:
+        options['use_flatten'] = True
+    if args.link_rules is not None:
+        options['link_rules'] = args.link_rules
+    if args.link_table:
+        options['use_link_table'] = True
+    if args.integer_ids:
+        options['use_integer_ids'] = True
+    if args.world_bounds:
+        options['use_world_bounds'] = True
+    if args.bvh:
+        options['use_bvh'] = True
+    if args.tile_size:
+        options['tile_size'] = args.tile_size
+    if args.meshes:
+        options['use_meshes'] = True
+        options['mesh_optimize'] = args.mesh_optimize
+        options['use_quantize'] = args.quantize
+        options['lod_ratios'] = args.lods
+        options['batch_size'] = args.batch_size
+    if args.trace:
+        options['trace_path'] = target + '.trace'
+
+    print("Exporting XCD to %s" % target)
+    bpy.ops.export_scene.xcd(filepath=target, check_existing=False, **options)
+
+def RunStage(source, target):
+    """Returns (source, target, succeeded, duration, error), errors are reported and not raised"""
+    start = time.time()
+    error = None
+    try:
+        ExportStage(source, target)
+    except Exception as e:
+        print("Error: exporting %s failed: %s" % (source or target, e))
+        error = str(e)
+    return (source or bpy.data.filepath, target, error is None, time.time() - start, error)
+
+def NormalizePath(path):
+    return os.path.normcase(os.path.abspath(path))
+
+def LinkedLibraries():
+    """Paths of every library the open file links, indirect ones included"""
+    return set([NormalizePath(bpy.path.abspath(library.filepath)) for library in bpy.data.libraries])
+
+def WriteStatus(path, state, watcher, records):
+    status = {'state': state,
+              'backend': watcher.backend if watcher else None,
+              'updated': time.time(),
+              'stages': [records[key] for key in sorted(records)]}
+
+    # Written aside and renamed, a reader never sees half a file
+    temporaryPath = path + '.tmp'
+    with open(temporaryPath, 'w', encoding='utf-8') as file:
+        json.dump(status, file, indent=1, sort_keys=True)
+    os.replace(temporaryPath, path)
+
+def StageRecord(result):
+    source, target, succeeded, duration, error = result
+    return {'source': source,
+            'target': target,
+            'succeeded': succeeded,
+            'seconds': round(duration, 3),
+            'exported': time.time(),
+            'error': error}
+
+def Watch(config, stages, results, dependencies):
+    """Re-exports the stages touched by each change until interrupted, a .blend matching a
+       StageExport rule that shows up later becomes a stage of its own"""
+    roots = list(config.sourceRoots) if config else []
+    roots.extend([os.path.dirname(source) for source, target in stages])
+    roots = sorted(set([NormalizePath(root) for root in roots]))
+    # Nested roots would be watched twice
+    roots = [root for root in roots if not any([root.startswith(other + os.sep) for other in roots])]
+
+    watcher = SourceWatcher(roots, pollInterval=args.poll_interval, usePolling=args.polling)
+    records = dict([((NormalizePath(result[0]), result[1]), StageRecord(result)) for result in results])
+    if args.status:
+        WriteStatus(args.status, 'watching', watcher, records)
+
+    print("Watching %d root(s) for %d stage(s) (%s), Ctrl+C stops" % (len(roots), len(stages), watcher.backend))
+    try:
+        while True:
+            changed = watcher.Wait()
+
+            affected = []
+            for source, target in stages:
+                key = (NormalizePath(source), target)
+                if key[0] in changed or dependencies.get(key, set()) & changed:
+                    affected.append((source, target))
+
+            if config:
+                known = set([NormalizePath(source) for source, target in stages])
+                for path in sorted(changed - known):
+                    target = config.ResolveStage(path)
+                    if target:
+                        stages.append((path, target))
+                        affected.append((path, target))
+
+            affected = [(source, target) for source, target in affected if os.path.isfile(source)]
+            if not affected:
+                continue
+
+            if args.status:
+                WriteStatus(args.status, 'exporting', watcher, records)
+
+            start = time.time()
+            for source, target in affected:
+                result = RunStage(source, target)
+                key = (NormalizePath(source), target)
+                records[key] = StageRecord(result)
+                if result[2]:
+                    dependencies[key] = LinkedLibraries()
+
+            print("Re-exported %d stage(s) in %.2fs" % (len(affected), time.time() - start))
+            if args.status:
+                WriteStatus(args.status, 'watching', watcher, records)
+    except KeyboardInterrupt:
+        print("Stopped watching")
+    finally:
+        watcher.Close()
+        if args.status:
+            WriteStatus(args.status, 'stopped', None, records)
+
+config = DemonConfig(args.config) if args.config else None
+
+stages = [(source, target) for source, target in args.pair]
+if args.manifest:
+    stages.extend(ReadManifest(args.manifest))
+if config:
+    stages.extend(config.FindStages())
+if args.outFile:
+    stages.append((None, args.outFile))
+
+if not stages and not (args.watch and config):
+    parser.error("nothing to export, give outFile, --pair, --manifest or --config")
+
+if args.watch:
+    if not bpy.data.filepath and any([source is None for source, target in stages]):
+        parser.error("--watch needs a saved .blend to reload for outFile")
+    # The opened file has to be reloaded as well once it changes
+    stages = [(source or bpy.data.filepath, target) for source, target in stages]
+
+results = []
+dependencies = {}
+for source, target in stages:
+    result = RunStage(source, target)
+    results.append(result)
+    if args.watch and result[2]:
+        dependencies[(NormalizePath(result[0]), target)] = LinkedLibraries()
+
+print("")
+print("Exported %d stage(s):" % len(results))
+for source, target, succeeded, duration, error in results:
+    print("  %-6s %7.2fs  %s -> %s" % ("OK" if succeeded else "FAILED", duration, source, target))
+print("  total  %7.2fs" % sum([duration for source, target, succeeded, duration, error in results]))
+
+if args.watch:
+    Watch(config, stages, results, dependencies)
+    sys.exit(0)
+
+sys.exit(0 if all([succeeded for source, target, succeeded, duration, error in results]) else 1)
@@ -0,0 +1,178 @@
+import os
+import sys
+import time
+import shlex
+import argparse
+import threading
+import subprocess
+
+from demon_config import DemonConfig, ReadManifest
+
+# -------------------------------------------------------------------------
+# Runs the stage exports of a demon.conf or manifest on a pool of worker
+# processes, one Blender per job, largest source first
+#   python export_parallel.py --config demon.conf --blender blender.exe --jobs 16
+#   python export_parallel.py --config demon.conf --stub   (no Blender, for testing the scheduler)
+# Export options after -- are handed to every export.py run unchanged
+#   python export_parallel.py --config demon.conf -- --meshes --lods "0.5 0.25" --link-table
+# -------------------------------------------------------------------------
+EXPORT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "export.py")
+
+# export.py arguments selecting what to export, the scheduler hands out the stages itself
+STAGE_ARGUMENTS = ["--pair", "--manifest", "--config", "--watch", "--status"]
+
+class ExportJob:
+    source = None
+    target = None
+    cost = 0
+    command = None
+    logPath = None
+    exitCode = None
+    duration = 0.0
+
+    def __init__(self, source, target):
+        self.source = source
+        self.target = target
+        self.cost = os.path.getsize(source) if os.path.isfile(source) else 0
+
+class ExportScheduler:
+    """Hands out jobs longest first to a fixed number of worker threads, each driving one process"""
+
+    _jobs = None
+    _pending = None
+    _lock = None
+    _workerCount = 1
+    _logDirectory = None
+
+    def __init__(self, jobs, workerCount, logDirectory):
+        self._jobs = jobs
+        # Longest job first keeps the large stages from being the tail of the build
+        self._pending = sorted(jobs, key=lambda job: job.cost)
+        self._lock = threading.Lock()
+        self._workerCount = max(1, workerCount)
+        self._logDirectory = logDirectory
+
+    def Run(self):
+        if not os.path.isdir(self._logDirectory):
+            os.makedirs(self._logDirectory)
+
+        workers = [threading.Thread(target=self._Work) for i in range(min(self._workerCount, len(self._jobs)))]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        return self._jobs
+
+    def _Next(self):
+        with self._lock:
+            if not self._pending:
+                return None
+            return self._pending.pop()
+
+    def _Work(self):
+        while True:
+            job = self._Next()
+            if job is None:
+                return
+
+            name = os.path.splitext(os.path.basename(job.target))[0]
+            job.logPath = os.path.join(self._logDirectory, "%s_%d.log" % (name, self._jobs.index(job)))
+
+            start = time.time()
+            with open(job.logPath, 'w', encoding='utf-8') as log:
+                log.write("%s\n\n" % subprocess.list2cmdline(job.command))
+                log.flush()
+                try:
+                    job.exitCode = subprocess.call(job.command, stdout=log, stderr=subprocess.STDOUT)
+                except OSError as e:
+                    log.write("Error: could not start worker: %s\n" % e)
+                    job.exitCode = -1
+            job.duration = time.time() - start
+
+            print("  %-6s %7.2fs  %s" % ("OK" if job.exitCode == 0 else "FAILED", job.duration, job.source))
+            sys.stdout.flush()
+
+def BlenderCommand(blender, source, target, extraArguments):
+    return [blender, "--background", source, "--python", EXPORT_SCRIPT, "--"] + extraArguments + [target]
+
+def StubCommand(source, target, extraArguments):
+    """Stands in for Blender, takes time proportional to the source size and writes the target"""
+    script = ("import sys, os, time\n"
+              "time.sleep(min(os.path.getsize(sys.argv[1]) / 50000000.0, 5.0))\n"
+              "open(sys.argv[2], 'w').write('<xcd/>')\n"
+              "print('stub exported %s' % sys.argv[2])\n")
+    return [sys.executable, "-c", script, source, target]
+
+def TemplateCommand(template, source, target, extraArguments):
+    command = template.format(source=source, target=target, script=EXPORT_SCRIPT)
+    return shlex.split(command, posix=os.name != 'nt') + extraArguments
+
+def main(arguments=None):
+    arguments = sys.argv[1:] if arguments is None else arguments
+    exportArguments = []
+    if "--" in arguments:
+        exportArguments = arguments[arguments.index("--") + 1:]
+        arguments = arguments[:arguments.index("--")]
+
+    parser = argparse.ArgumentParser(prog="export_parallel.py")
+    parser.add_argument("--config", help="demon.conf whose StageExport rules select the stages")
+    parser.add_argument("--manifest", help="file listing 'source.blend -> target.xcd' lines")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="number of worker processes")
+    parser.add_argument("--blender", default="blender", help="blender executable")
+    parser.add_argument("--worker", help="worker command template with {source}, {target} and {script}")
+    parser.add_argument("--stub", action="store_true", help="use a stub worker instead of Blender")
+    parser.add_argument("--logs", default="exportlogs", help="directory for the per job logs")
+    parser.add_argument("--compress", action="store_true", help="pass --compress to export.py")
+    parser.add_argument("--compression-level", type=int, choices=range(1, 10), default=6, metavar="LEVEL",
+                        help="pass --compression-level to export.py, 1-9, defaults to 6")
+    args = parser.parse_args(arguments)
+
+    for argument in exportArguments:
+        if argument.split("=", 1)[0] in STAGE_ARGUMENTS:
+            parser.error("%s selects stages, it can not be passed to export.py" % argument)
+
+    stages = []
+    if args.manifest:
+        stages.extend(ReadManifest(args.manifest))
+    if args.config:
+        stages.extend(DemonConfig(args.config).FindStages())
+    if not stages:
+        parser.error("nothing to export, give --config or --manifest")
+
+    extraArguments = []
+    if args.compress:
+        extraArguments = ["--compress", "--compression-level", str(args.compression_level)]
+    extraArguments.extend(exportArguments)
+
+    jobs = []
+    for source, target in stages:
+        job = ExportJob(source, target)
+        if args.stub:
+            job.command = StubCommand(source, target, extraArguments)
+        elif args.worker:
+            job.command = TemplateCommand(args.worker, source, target, extraArguments)
+        else:
+            job.command = BlenderCommand(args.blender, source, target, extraArguments)
+
+        directory = os.path.dirname(os.path.abspath(target))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        jobs.append(job)
+
+    print("Exporting %d stage(s) on %d worker(s)" % (len(jobs), args.jobs))
+    start = time.time()
+    ExportScheduler(jobs, args.jobs, args.logs).Run()
+    elapsed = time.time() - start
+
+    failed = [job for job in jobs if job.exitCode != 0]
+    busy = sum([job.duration for job in jobs])
+    print("")
+    print("Finished in %.2fs, %.2fs of work (%.1fx)" % (elapsed, busy, busy / elapsed if elapsed > 0 else 0.0))
+    for job in failed:
+        print("  FAILED (exit %s) %s, see %s" % (job.exitCode, job.source, job.logPath))
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -20,11 +20,39 @@ bl_info = {
 
 if "bpy" in locals():
     import imp
+    if "writer_xcd" in locals():
+        imp.reload(writer_xcd)
+    if "binary_xcd" in locals():
+        imp.reload(binary_xcd)
+    if "cache_xcd" in locals():
+        imp.reload(cache_xcd)
+    if "log_xcd" in locals():
+        imp.reload(log_xcd)
+    if "hierarchy_xcd" in locals():
+        imp.reload(hierarchy_xcd)
+    if "bounds_xcd" in locals():
+        imp.reload(bounds_xcd)
+    if "bvh_xcd" in locals():
+        imp.reload(bvh_xcd)
+    if "mesh_xcd" in locals():
+        imp.reload(mesh_xcd)
+    if "optimize_xcd" in locals():
+        imp.reload(optimize_xcd)
+    if "lod_xcd" in locals():
+        imp.reload(lod_xcd)
+    if "batch_xcd" in locals():
+        imp.reload(batch_xcd)
+    if "names_xcd" in locals():
+        imp.reload(names_xcd)
+    if "link_xcd" in locals():
+        imp.reload(link_xcd)
+    if "transform_xcd" in locals():
+        imp.reload(transform_xcd)
     if "export_xcd" in locals():
         imp.reload(export_xcd)
 
 import bpy
-from bpy.props import StringProperty, BoolProperty, EnumProperty
+from bpy.props import StringProperty, BoolProperty, EnumProperty, IntProperty, FloatProperty
 from bpy_extras.io_utils import (ExportHelper,
                                  axis_conversion,
                                  path_reference_mode,
@@ -37,7 +65,7 @@ class ExportXCD(bpy.types.Operator, ExportHelper):
     bl_options = {'PRESET'}
 
     filename_ext = ".xcd"
-    filter_glob = StringProperty(default="*.xcd", options={'HIDDEN'})
+    filter_glob = StringProperty(default="*.xcd;*.xcd.gz", options={'HIDDEN'})
     
     use_selection = BoolProperty(
             name="Selection Only",
@@ -45,6 +73,191 @@ class ExportXCD(bpy.types.Operator, ExportHelper):
             default=False,
             )
 
+    buffer_size = IntProperty(
+            name="Buffer Size",
+            description="Size in bytes of the output buffer flushed to disk in one write",
+            default=256 * 1024,
+            min=1,
+            )
+
+    use_compression = BoolProperty(
+            name="Compress",
+            description="Write the stage gzip compressed (.xcd.gz)",
+            default=False,
+            )
+
+    compression_level = IntProperty(
+            name="Compression Level",
+            description="Gzip compression level, 1 is fastest and 9 is smallest",
+            default=6,
+            min=1,
+            max=9,
+            )
+
+    use_binary = BoolProperty(
+            name="Binary Stage",
+            description="Also write the stage as binary .xcdb next to the xml",
+            default=False,
+            )
+
+    binary_sections = EnumProperty(
+            name="Binary Sections",
+            description="Data blocks written into the binary stage",
+            items=(('TRANSFORMS', "Transforms", "Element translation, rotation and scale"),
+                   ('BOUNDS', "Bounds", "Element bounding boxes"),
+                   ('LIGHTS', "Lights", "Light parameters"),
+                   ('CAMERAS', "Cameras", "Camera parameters"),
+                   ),
+            options={'ENUM_FLAG'},
+            default={'TRANSFORMS', 'BOUNDS', 'LIGHTS', 'CAMERAS'},
+            )
+
+    use_cache = BoolProperty(
+            name="Incremental",
+            description="Keep a cache next to the stage and only re-export objects that changed",
+            default=False,
+            )
+
+    log_level = EnumProperty(
+            name="Log Level",
+            description="Amount of exporter output printed to the console",
+            items=(('ERROR', "Error", "Only errors"),
+                   ('WARNING', "Warning", "Errors and warnings"),
+                   ('INFO', "Info", "Export progress"),
+                   ('DEBUG', "Debug", "Everything the exporter does per object"),
+                   ),
+            default='WARNING',
+            )
+
+    trace_path = StringProperty(
+            name="Trace File",
+            description="Optional file receiving one json line per exported object",
+            default="",
+            subtype='FILE_PATH',
+            )
+
+    use_instancing = BoolProperty(
+            name="Instancing",
+            description="Write every linked asset once as prototype and reference it from its instances",
+            default=False,
+            )
+
+    use_compact = BoolProperty(
+            name="Compact",
+            description="Write layers as bitmask and leave out default valued blocks (xcd version 1.1)",
+            default=False,
+            )
+
+    rotation_encoding = EnumProperty(
+            name="Rotation",
+            description="Encoding of element and camera rotations",
+            items=(('MODE', "Rotation Mode", "Values of the object rotation mode, tagged by mode"),
+                   ('QUATERNION', "Quaternion", "Normalized quaternion of the local matrix"),
+                   ('MATRIX', "Matrix", "Local matrix as 3x4 rows"),
+                   ),
+            default='MODE',
+            )
+
+    use_flatten = BoolProperty(
+            name="Flatten",
+            description="Write static elements with world transforms and drop empties that only place a group, "
+                        "objects with a 'Dynamic' property stay as they are",
+            default=False,
+            )
+
+    link_rules = StringProperty(
+            name="Link Rules",
+            description="Replacements turning library paths into asset links, 'from=to' pairs separated by ';'",
+            default="//=;.blend=.dae;General.Source=General.Intermediate",
+            )
+
+    use_link_table = BoolProperty(
+            name="Link Table",
+            description="Write every link once into a table and reference it by index from elements and prototypes",
+            default=False,
+            )
+
+    use_integer_ids = BoolProperty(
+            name="Integer IDs",
+            description="Write a dense integer uid next to the name of every element, light and camera",
+            default=False,
+            )
+
+    use_world_bounds = BoolProperty(
+            name="World Bounds",
+            description="Write world space box and sphere of every element, covering its linked meshes and children",
+            default=False,
+            )
+
+    use_bvh = BoolProperty(
+            name="Spatial Tree",
+            description="Write elements in spatial order followed by a bvh over their world bounds (implies World Bounds)",
+            default=False,
+            )
+
+    tile_size = FloatProperty(
+            name="Tile Size",
+            description="Split the stage into one file per grid cell of this size plus an index (.xcdt), 0 writes a single stage",
+            default=0.0,
+            min=0.0,
+            )
+
+    use_meshes = BoolProperty(
+            name="Meshes",
+            description="Write mesh objects as binary .xcdm models next to the stage instead of skipping them",
+            default=False,
+            )
+
+    mesh_optimize = EnumProperty(
+            name="Mesh Optimization",
+            description="Reordering of the exported mesh index and vertex buffers",
+            items=(('NONE', "None", "Keep the triangle order of the mesh"),
+                   ('CACHE', "Vertex Cache", "Triangle order for the post transform cache, vertex order for fetch"),
+                   ('OVERDRAW', "Overdraw", "Vertex cache order, then clusters sorted to reduce overdraw"),
+                   ),
+            default='CACHE',
+            )
+
+    use_quantize = BoolProperty(
+            name="Quantize Vertices",
+            description="Store mesh positions as 16 bit, normals octahedral and uvs as half floats where the error allows",
+            default=False,
+            )
+
+    max_position_error = FloatProperty(
+            name="Position Error",
+            description="Largest position error of 16 bit positions, in scene units",
+            default=0.001,
+            min=0.0,
+            )
+
+    max_normal_error = FloatProperty(
+            name="Normal Error",
+            description="Largest normal error in degrees, picks 8 bit octahedral normals below and 16 bit above",
+            default=1.0,
+            min=0.0,
+            )
+
+    max_uv_error = FloatProperty(
+            name="UV Error",
+            description="Largest uv error of half float uvs",
+            default=0.001,
+            min=0.0,
+            )
+
+    lod_ratios = StringProperty(
+            name="LOD Ratios",
+            description="Triangle ratios of the generated levels of detail, e.g. '0.5 0.25 0.125', empty for none",
+            default="",
+            )
+
+    batch_size = FloatProperty(
+            name="Batch Cell Size",
+            description="Merge small static meshes sharing a material within grid cells of this size, 0 disables batching",
+            default=0.0,
+            min=0.0,
+            )
+
     def execute(self, context):
         from . import export_xcd
 
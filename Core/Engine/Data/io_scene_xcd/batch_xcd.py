@@ -0,0 +1,145 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import math
+import sys
+
+# -------------------------------------------------------------------------
+# Static batching of mesh models built by mesh_xcd.BuildMesh. The submeshes
+# of static elements sharing a material within a cell are transformed into
+# world space and merged into one model. Every merged element keeps its own
+# submesh, in the order of the batch ranges, so the element drawn by an
+# index range can still be picked.
+#
+#   batch      {'key', 'material', 'elements', 'model'}, elements[i] owns
+#              model['submeshes'][i]
+# -------------------------------------------------------------------------
+MAX_VERTICES = 4096
+
+def _NormalMatrix(matrix):
+    """Cofactors of the upper 3x3 of matrix, the inverse transpose up to the determinant"""
+    m = [list(row[:3]) for row in matrix[:3]]
+    cofactors = []
+    for row in range(3):
+        r1, r2 = (row + 1) % 3, (row + 2) % 3
+        values = []
+        for column in range(3):
+            c1, c2 = (column + 1) % 3, (column + 2) % 3
+            values.append(m[r1][c1] * m[r2][c2] - m[r1][c2] * m[r2][c1])
+        cofactors.append(values)
+    determinant = sum([m[0][column] * cofactors[0][column] for column in range(3)])
+    return cofactors, determinant
+
+def TransformMesh(mesh, matrix):
+    """Returns (positions, normals, mirrored) of mesh transformed by the 4x4 matrix (rows),
+       mirrored is True if the matrix flips the triangle winding"""
+    positions = [tuple([row[0] * x + row[1] * y + row[2] * z + row[3] for row in matrix[:3]])
+                 for x, y, z in mesh['positions']]
+
+    normalMatrix, determinant = _NormalMatrix(matrix)
+    sign = -1.0 if determinant < 0.0 else 1.0
+    normals = []
+    for x, y, z in mesh['normals']:
+        normal = [sign * (row[0] * x + row[1] * y + row[2] * z) for row in normalMatrix]
+        length = math.sqrt(sum([value * value for value in normal]))
+        normals.append(tuple([value / length for value in normal]) if length > 0.0 else (0.0, 0.0, 1.0))
+    return positions, normals, determinant < 0.0
+
+def CellOf(point, cellSize):
+    """Grid cell on the x / y plane"""
+    return int(math.floor(point[0] / cellSize)), int(math.floor(point[1] / cellSize))
+
+class BatchBuilder:
+    _batches = None
+    _maxVertices = MAX_VERTICES
+
+    def __init__(self, maxVertices=MAX_VERTICES):
+        self._batches = {}
+        self._maxVertices = maxVertices
+
+    def IsSmall(self, mesh):
+        return len(mesh['positions']) <= self._maxVertices
+
+    def Add(self, key, element, mesh, matrix):
+        """Adds every submesh of mesh to the batch of its material within key, returns the number of submeshes"""
+        positions, normals, mirrored = TransformMesh(mesh, matrix)
+        for submesh in mesh['submeshes']:
+            # Models with and without uvs have different vertex layouts, they do not share a batch
+            batchKey = (key, submesh['material'], mesh['uvs'] is not None)
+            batch = self._batches.get(batchKey)
+            if batch is None:
+                batch = {'key': key, 'material': submesh['material'], 'elements': [],
+                         'model': {'positions': [], 'normals': [], 'uvs': [] if mesh['uvs'] is not None else None,
+                                   'submeshes': [], 'bounds': None}}
+                self._batches[batchKey] = batch
+
+            # Only the vertices referenced by the submesh are copied
+            model = batch['model']
+            remap = {}
+            indices = []
+            for index in submesh['indices']:
+                target = remap.get(index)
+                if target is None:
+                    target = len(model['positions'])
+                    remap[index] = target
+                    model['positions'].append(positions[index])
+                    model['normals'].append(normals[index])
+                    if model['uvs'] is not None:
+                        model['uvs'].append(mesh['uvs'][index])
+                indices.append(target)
+
+            if mirrored:
+                for i in range(0, len(indices) - 2, 3):
+                    indices[i + 1], indices[i + 2] = indices[i + 2], indices[i + 1]
+
+            model['submeshes'].append({'material': submesh['material'], 'indices': indices})
+            batch['elements'].append(element)
+        return len(mesh['submeshes'])
+
+    def Build(self):
+        """Batches in a stable order, their model bounds filled in"""
+        batches = []
+        for batchKey in sorted(self._batches.keys(), key=lambda entry: (str(entry[0]), entry[1] or '', entry[2])):
+            batch = self._batches[batchKey]
+            positions = batch['model']['positions']
+            batch['model']['bounds'] = (tuple([min([position[i] for position in positions]) for i in range(3)]),
+                                        tuple([max([position[i] for position in positions]) for i in range(3)]))
+            batches.append(batch)
+        return batches
+
+def Ranges(batch):
+    """(element, first index, index count) of every element in the batch, in index buffer order"""
+    ranges = []
+    first = 0
+    for element, submesh in zip(batch['elements'], batch['model']['submeshes']):
+        ranges.append((element, first, len(submesh['indices'])))
+        first += len(submesh['indices'])
+    return ranges
+
+if __name__ == "__main__":
+    # python batch_xcd.py model.xcdm count cellSize, scatters copies of the model and batches them
+    from mesh_xcd import ReadMesh
+
+    mesh = ReadMesh(sys.argv[1])
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    cellSize = float(sys.argv[3]) if len(sys.argv) > 3 else 10.0
+
+    builder = BatchBuilder()
+    drawCalls = 0
+    side = int(math.ceil(math.sqrt(count)))
+    for i in range(count):
+        offset = (float(i % side) * 2.0, float(i // side) * 2.0, 0.0)
+        matrix = [(1.0, 0.0, 0.0, offset[0]), (0.0, 1.0, 0.0, offset[1]), (0.0, 0.0, 1.0, offset[2]), (0.0, 0.0, 0.0, 1.0)]
+        drawCalls += builder.Add(CellOf(offset, cellSize), 'element%d' % i, mesh, matrix)
+
+    batches = builder.Build()
+    print("%d draw calls -> %d batches" % (drawCalls, len(batches)))
+    for batch in batches:
+        print("cell %r material %r: %d elements, %d vertices" % (batch['key'], batch['material'], len(batch['elements']),
+                                                                len(batch['model']['positions'])))
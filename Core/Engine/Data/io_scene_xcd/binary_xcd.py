@@ -0,0 +1,894 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import gzip
+import math
+import struct
+import sys
+
+from array import array
+from xml.etree import ElementTree
+from xml.sax.saxutils import quoteattr, escape
+
+# -------------------------------------------------------------------------
+# Format
+#
+#   header        magic, version, sections, string / element / light / camera / property counts
+#   strings       u32 length + utf-8 bytes each, referenced by index (-1 = none)
+#   fog           present flag, type, depth, color
+#   elements      id, link, parent, rotation mode, layers, property start / count
+#   properties    name, type, int value or string index, float value
+#   lights        id, type, layers, property start / count
+#   cameras       id, rotation mode, layers, property start / count
+#   float arrays  little-endian float32 blocks per selected section
+# -------------------------------------------------------------------------
+MAGIC = b'XCDB'
+VERSION = 1
+
+SECTION_TRANSFORMS = 0x1
+SECTION_BOUNDS = 0x2
+SECTION_LIGHTS = 0x4
+SECTION_CAMERAS = 0x8
+SECTION_ALL = SECTION_TRANSFORMS | SECTION_BOUNDS | SECTION_LIGHTS | SECTION_CAMERAS
+
+SECTION_NAMES = {'TRANSFORMS': SECTION_TRANSFORMS,
+                 'BOUNDS': SECTION_BOUNDS,
+                 'LIGHTS': SECTION_LIGHTS,
+                 'CAMERAS': SECTION_CAMERAS}
+
+LIGHT_TYPES = ['Point', 'Spot', 'Directional']
+FOG_TYPES = ['LINEAR', 'EXPONENTIAL']
+
+_header = struct.Struct('<4sHHIIIII')
+_string = struct.Struct('<I')
+_fog = struct.Struct('<Bi4f')
+_element = struct.Struct('<iiiiIII')
+_property = struct.Struct('<iiqd')
+_light = struct.Struct('<iiIII')
+_camera = struct.Struct('<iiIII')
+
+# Floats per record in the float array blocks
+ELEMENT_TRANSFORM_FLOATS = 10   # translation 3, rotation 4, scale 3
+ELEMENT_BOUNDS_FLOATS = 24      # 8 corner points
+LIGHT_FLOATS = 13               # color 3, intensity, radius, spotsize, angle, direction 3, location 3
+CAMERA_FLOATS = 8               # fov, position 3, rotation 4
+
+def SectionsFromNames(names):
+    sections = 0
+    for name in names:
+        sections = sections | SECTION_NAMES[name]
+    return sections
+
+def LayersToMask(layers):
+    mask = 0
+    for i, layer in enumerate(layers):
+        if layer:
+            mask = mask | (1 << i)
+    return mask
+
+def _FloatArray(values):
+    data = array('f', values)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tobytes()
+
+def _ReadFloatArray(buffer, offset, count):
+    data = array('f')
+    data.frombytes(buffer[offset:offset + count * 4])
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data.tolist(), offset + count * 4
+
+def _Chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+class XCDBinaryWriter:
+    """Collects the stage model while the xml is written and stores it as xcdb"""
+
+    _sections = SECTION_ALL
+    _strings = None
+    _stringLookup = None
+    _fog = None
+    _elements = None
+    _properties = None
+    _lights = None
+    _cameras = None
+
+    _elementFloats = None
+    _boundFloats = None
+    _lightFloats = None
+    _cameraFloats = None
+
+    # -------------------------------------------------------------------------
+    # Constructor
+    # -------------------------------------------------------------------------
+    def __init__(self, sections=SECTION_ALL):
+        self._sections = sections
+        self._strings = []
+        self._stringLookup = {}
+        self._elements = []
+        self._properties = []
+        self._lights = []
+        self._cameras = []
+        self._elementFloats = []
+        self._boundFloats = []
+        self._lightFloats = []
+        self._cameraFloats = []
+
+    # -------------------------------------------------------------------------
+    # Public
+    # -------------------------------------------------------------------------
+    def SetFog(self, type, depth, color):
+        self._fog = (FOG_TYPES.index(type), depth, color)
+
+    def AddElement(self, id, link, parent, rotationMode, translation, rotation, scale, bounds, layers, properties):
+        """Returns the index of the element, used as parent for nested elements"""
+        start, count = self._AddProperties(properties)
+        self._elements.append((self._String(id), self._String(link), parent, rotationMode,
+                               LayersToMask(layers), start, count))
+        if self._sections & SECTION_TRANSFORMS:
+            self._elementFloats.extend(translation)
+            self._elementFloats.extend(rotation)
+            self._elementFloats.extend(scale)
+        if self._sections & SECTION_BOUNDS:
+            for point in bounds:
+                self._boundFloats.extend(point)
+        return len(self._elements) - 1
+
+    def AddLight(self, id, type, color, intensity, radius, spotSize, angle, direction, location, layers, properties):
+        if not self._sections & SECTION_LIGHTS:
+            return
+        start, count = self._AddProperties(properties)
+        self._lights.append((self._String(id), LIGHT_TYPES.index(type), LayersToMask(layers), start, count))
+        self._lightFloats.extend(color)
+        self._lightFloats.extend((intensity, radius, spotSize, angle))
+        self._lightFloats.extend(direction)
+        self._lightFloats.extend(location)
+
+    def AddCamera(self, id, fov, position, rotationMode, rotation, layers, properties):
+        if not self._sections & SECTION_CAMERAS:
+            return
+        start, count = self._AddProperties(properties)
+        self._cameras.append((self._String(id), rotationMode, LayersToMask(layers), start, count))
+        self._cameraFloats.append(fov)
+        self._cameraFloats.extend(position)
+        self._cameraFloats.extend(rotation)
+
+    def Save(self, filePath):
+        parts = [_header.pack(MAGIC, VERSION, self._sections, len(self._strings), len(self._elements),
+                              len(self._lights), len(self._cameras), len(self._properties))]
+
+        for text in self._strings:
+            data = text.encode('utf-8')
+            parts.append(_string.pack(len(data)))
+            parts.append(data)
+
+        if self._fog:
+            type, depth, color = self._fog
+            parts.append(_fog.pack(1, type, depth, color[0], color[1], color[2]))
+        else:
+            parts.append(_fog.pack(0, 0, 0.0, 0.0, 0.0, 0.0))
+
+        parts.extend([_element.pack(*entry) for entry in self._elements])
+        parts.extend([_property.pack(*entry) for entry in self._properties])
+        parts.extend([_light.pack(*entry) for entry in self._lights])
+        parts.extend([_camera.pack(*entry) for entry in self._cameras])
+
+        parts.append(_FloatArray(self._elementFloats))
+        parts.append(_FloatArray(self._boundFloats))
+        parts.append(_FloatArray(self._lightFloats))
+        parts.append(_FloatArray(self._cameraFloats))
+
+        with open(filePath, 'wb') as file:
+            file.write(b''.join(parts))
+
+    # -------------------------------------------------------------------------
+    # Private
+    # -------------------------------------------------------------------------
+    def _String(self, text):
+        if text is None:
+            return -1
+
+        index = self._stringLookup.get(text)
+        if index is None:
+            index = len(self._strings)
+            self._strings.append(text)
+            self._stringLookup[text] = index
+        return index
+
+    def _AddProperties(self, properties):
+        start = len(self._properties)
+        for name, value in properties:
+            if isinstance(value, float):
+                self._properties.append((self._String(name), 0, 0, value))
+            elif isinstance(value, int):
+                self._properties.append((self._String(name), 1, value, 0.0))
+            elif isinstance(value, str):
+                self._properties.append((self._String(name), 2, self._String(value), 0.0))
+        return start, len(self._properties) - start
+
+# -------------------------------------------------------------------------
+# Stage writing, every element, light and camera goes through one call that
+# formats its xml and adds the same values to the binary model
+# -------------------------------------------------------------------------
+
+# Blocks holding these values are left out in compact mode, readers of version 1.1 fill in the defaults
+COMPACT_DEFAULTS = frozenset(['<customproperties></customproperties>',
+                              '<boundingBox>%s</boundingBox>' % ('<point>0.0 0.0 0.0</point>' * 8),
+                              '<layers>1</layers>',
+                              '<scale>1.000000 1.000000 1.000000</scale>',
+                              '<static>0</static>'])
+
+class XCDStageWriter:
+    """Writes the xml stage into an XCDBufferedWriter and, given one, the binary model.
+       writer and linkTable are replaced for every tile. cacheNames, while set, collects the
+       prototypes and table links a cached fragment has to register again"""
+
+    writer = None
+    binary = None
+    linkTable = None
+    cacheNames = None
+
+    _log = None
+    _instancing = False
+    _compact = False
+    _flatten = False
+    _rotationEncoding = 'MODE'
+    _prototypes = None
+    _prototypeLookup = None
+    _endTags = None
+    _elementStack = None
+
+    # -------------------------------------------------------------------------
+    # Constructor
+    # -------------------------------------------------------------------------
+    def __init__(self, writer, binary=None, log=None, instancing=False, compact=False, flatten=False,
+                 linkTable=None, rotationEncoding='MODE'):
+        self.writer = writer
+        self.binary = binary
+        self.linkTable = linkTable
+        self._log = log
+        self._instancing = instancing
+        self._compact = compact
+        self._flatten = flatten
+        self._rotationEncoding = rotationEncoding
+        self._prototypes = []
+        self._prototypeLookup = {}
+        self._endTags = []
+        self._elementStack = []
+
+    # -------------------------------------------------------------------------
+    # Public
+    # -------------------------------------------------------------------------
+    def WriteHeader(self, fileName, generator):
+        parts = ['<?xml version="1.0" encoding="UTF-8"?><xcd version="%s">' % ('1.1' if self._compact else '1.0'),
+                 '<head>',
+                 '<meta name="filename" content=%s />' % quoteattr(fileName),
+                 '<meta name="generator" content=%s />' % quoteattr(generator)]
+        if self._instancing:
+            parts.append('<meta name="instancing" content="1" />')
+        if self._rotationEncoding != 'MODE':
+            parts.append('<meta name="rotation" content="%s" />' % self._rotationEncoding)
+        parts.append('</head><scene>')
+        self.writer.WriteParts(parts)
+
+    def WriteFog(self, type, depth, color):
+        self.writer.WriteParts(['<fog type="%s"' % type,
+                                ' depth="%.3f"' % depth,
+                                '>',
+                                '<color>%.3f %.3f %.3f</color>' % color,
+                                '</fog>'])
+
+        if self.binary:
+            self.binary.SetFog(type, depth, color)
+
+    def BeginElement(self, id, link, translation, rotation, scale, boundingBox, layers, properties,
+                     worldBounds=None, lods=None, static=False, uid=None, quaternion=None):
+        """rotation holds the values with the mode tag first, quaternion is the (w, x, y, z)
+           rotation the binary stores for the matrix rows of tag 4"""
+        quotedId = quoteattr(id)
+        fields = ['<translation>%.6f %.6f %.6f</translation>' % tuple(translation),
+                  '<rotation>%s</rotation>' % self._FormatRotation(rotation),
+                  '<scale>%.6f %.6f %.6f</scale>' % tuple(scale),
+                  self._FormatBoundingBox(boundingBox),
+                  self._FormatLayers(layers),
+                  self._FormatCustomProperties(properties),
+                  self._FormatWorldBounds(worldBounds),
+                  self._FormatLODs(lods),
+                  self._FormatStatic(static)]
+
+        if link and self._instancing:
+            self._WriteInstance(quotedId, link, fields, self._FormatUid(uid))
+            self._endTags.append(None)
+        else:
+            parts = ['<element id=%s%s' % (quotedId, self._FormatUid(uid))]
+            if link:
+                parts.append(self._FormatLink(link))
+            parts.append('>')
+            parts.extend([self._Compact(field) for field in fields])
+            self.writer.WriteParts(parts)
+            self._endTags.append('</element>')
+
+        if self.binary:
+            parent = self._elementStack[-1] if self._elementStack else -1
+            rotationMode, rotationData = self._BinaryRotation(rotation, quaternion)
+            index = self.binary.AddElement(id, link, parent, rotationMode, translation, rotationData, scale,
+                                           boundingBox, layers, properties)
+            self._elementStack.append(index)
+
+    def EndElement(self):
+        endTag = self._endTags.pop()
+        if endTag:
+            self.writer.Write(endTag)
+
+        if self.binary:
+            self._elementStack.pop()
+
+    def WriteLight(self, type, id, color, intensity, radius, spotSize, angle, direction, location, layers, properties,
+                   uid=None):
+        """Directional lights leave out radius, cone and location, point lights the cone and direction"""
+        parts = ['<light type="%s" id=%s%s' % (type, quoteattr(id), self._FormatUid(uid))]
+        if type == 'Spot':
+            parts.append(' radius="%.4f"' % radius)
+        parts.append(' intensity="%.4f"' % intensity)
+        if type == 'Spot':
+            parts.extend([' spotsize="%.4f"' % spotSize,
+                          ' angle="%.4f"' % angle])
+        elif type == 'Point':
+            parts.append(' radius="%.4f"' % radius)
+        parts.extend(['>',
+                      '<color>%.4f %.4f %.4f</color>' % tuple(color)])
+        if type != 'Point':
+            parts.append('<direction>%.4f %.4f %.4f</direction>' % tuple(direction))
+        if type != 'Directional':
+            parts.append('<location>%.4f %.4f %.4f</location>' % tuple(location))
+        parts.extend([self._Compact(self._FormatLayers(layers)),
+                      self._Compact(self._FormatCustomProperties(properties)),
+                      '</light>'])
+        self.writer.WriteParts(parts)
+
+        if self.binary:
+            self.binary.AddLight(id, type, color, intensity, radius, spotSize, angle, direction, location,
+                                 layers, properties)
+
+    def WriteCamera(self, id, fov, position, rotation, layers, properties, uid=None, quaternion=None):
+        self.writer.WriteParts(['<camera id=%s%s' % (quoteattr(id), self._FormatUid(uid)),
+                                ' fov="%.3f"' % fov,
+                                '>',
+                                '<position>%3.2f %3.2f %3.2f</position>' % tuple(position),
+                                '<rotation>%s</rotation>' % self._FormatRotation(rotation),
+                                self._Compact(self._FormatLayers(layers)),
+                                self._Compact(self._FormatCustomProperties(properties)),
+                                '</camera>'])
+
+        if self.binary:
+            rotationMode, rotationData = self._BinaryRotation(rotation, quaternion)
+            self.binary.AddCamera(id, fov, position, rotationMode, rotationData, layers, properties)
+
+    def WriteFooter(self, batches=None, bvhNodes=None):
+        """batches are (link, cell, material, ranges) of the batches in this stage, ranges are
+           (element, first, count). The link table comes last, the prototypes add links of their own"""
+        if batches:
+            self._WriteBatches(batches)
+        if bvhNodes:
+            self._WriteBVH(bvhNodes)
+        if self._instancing:
+            self._WritePrototypes()
+        if self.linkTable:
+            self._WriteLinkTable()
+        self.writer.Write('</scene></xcd>')
+
+    def PrototypeCount(self):
+        return len(self._prototypes)
+
+    def RegisterPrototype(self, link, prototype):
+        """Adds the (index, id, fields) prototype recorded with a cached fragment, fails if it differs now"""
+        index, id, fields = prototype
+        existing = self._prototypeLookup.get(link)
+        if existing is None:
+            return self._AddPrototype(id, link, fields) == index
+
+        # Overrides in the fragment were computed against the prototype recorded with it
+        return existing == index and self._prototypes[index][0] == id and self._prototypes[index][2] == fields
+
+    def TruncatePrototypes(self, count):
+        for id, link, fields in self._prototypes[count:]:
+            del self._prototypeLookup[link]
+        del self._prototypes[count:]
+
+    # -------------------------------------------------------------------------
+    # Instancing, every distinct link is written once into the prototype table
+    # at the end of the scene. Instances reference it by index and only carry
+    # the fields that differ from their prototype.
+    # -------------------------------------------------------------------------
+    def _WriteInstance(self, id, link, fields, uid=''):
+        index = self._prototypeLookup.get(link)
+        if index is None:
+            index = self._AddPrototype(id, link, fields)
+            overrides = []
+        else:
+            prototypeId, prototypeLink, prototypeFields = self._prototypes[index]
+            overrides = [field for field, prototypeField in zip(fields, prototypeFields) if field != prototypeField]
+            if id != prototypeId:
+                overrides.insert(0, None)
+
+        if self.cacheNames is not None:
+            prototypeId, prototypeLink, prototypeFields = self._prototypes[index]
+            self.cacheNames.append(['prototypes', link, [index, prototypeId, prototypeFields]])
+
+        parts = ['<instance prototype="%d"%s' % (index, uid)]
+        if overrides and overrides[0] is None:
+            parts.append(' id=%s' % id)
+            overrides = overrides[1:]
+
+        if overrides:
+            parts.append('>')
+            parts.extend(overrides)
+            parts.append('</instance>')
+        else:
+            parts.append('/>')
+        self.writer.WriteParts(parts)
+
+    def _AddPrototype(self, id, link, fields):
+        index = len(self._prototypes)
+        self._prototypes.append((id, link, fields))
+        self._prototypeLookup[link] = index
+        return index
+
+    def _WritePrototypes(self):
+        self.writer.Write('<prototypes>')
+        for index, (id, link, fields) in enumerate(self._prototypes):
+            self.writer.WriteParts(['<prototype index="%d" id=%s%s>' % (index, id, self._FormatLink(link))] +
+                                   [self._Compact(field) for field in fields] + ['</prototype>'])
+        self.writer.Write('</prototypes>')
+
+    def _WriteLinkTable(self):
+        parts = ['<links>']
+        parts.extend(['<link index="%d">%s</link>' % (index, escape(link)) for index, link in enumerate(self.linkTable.links)])
+        parts.append('</links>')
+        self.writer.WriteParts(parts)
+
+    def _WriteBatches(self, batches):
+        parts = ['<batches>']
+        for link, cell, material, ranges in batches:
+            parts.append('<batch link="%s" cell="%d %d"' % ((link,) + tuple(cell)))
+            if material is not None:
+                parts.append(' material=%s' % quoteattr(material))
+            parts.append('>')
+            parts.extend(['<range element=%s first="%d" count="%d"/>' % (quoteattr(element), first, count)
+                          for element, first, count in ranges])
+            parts.append('</batch>')
+        parts.append('</batches>')
+        self.writer.WriteParts(parts)
+
+    def _WriteBVH(self, nodes):
+        parts = ['<bvh>']
+        for minimum, maximum, first, count in nodes:
+            parts.append('<node>%.6f %.6f %.6f %.6f %.6f %.6f %d %d</node>' % (tuple(minimum) + tuple(maximum) + (first, count)))
+        parts.append('</bvh>')
+        self.writer.WriteParts(parts)
+
+    # -------------------------------------------------------------------------
+    # Formatting
+    # -------------------------------------------------------------------------
+    def _FormatUid(self, uid):
+        if uid is None:
+            return ''
+        return ' uid="%d"' % uid
+
+    def _FormatRotation(self, values):
+        if values is None:
+            return None
+        return "%d %s" % (values[0], ' '.join(['%f' % value for value in values[1:]]))
+
+    def _BinaryRotation(self, values, quaternion):
+        if values is None:
+            return 0, (0.0, 0.0, 0.0, 0.0)
+        if values[0] == 4:
+            # The binary rotation block holds four floats, next to translation and scale the quaternion is enough.
+            # Compare rebuilds the rows from the three when checking against the xml
+            return 3, quaternion
+        return values[0], values[1:]
+
+    def _FormatValueArray(self, values):
+        return ' '.join([str(entry) for entry in values])
+
+    def _FormatBoolValueArray(self, values):
+        return ' '.join(['1' if entry else '0' for entry in values])
+
+    def _FormatBoundingBox(self, boundingBox):
+        points = ['<point>%s</point>' % self._FormatValueArray(element) for element in boundingBox]
+        return '<boundingBox>%s</boundingBox>' % ''.join(points)
+
+    def _FormatWorldBounds(self, bounds):
+        if bounds is None:
+            return ''
+
+        minimum, maximum, center, radius = bounds
+        return ('<worldBounds><min>%.6f %.6f %.6f</min><max>%.6f %.6f %.6f</max>'
+                '<center>%.6f %.6f %.6f</center><radius>%.6f</radius></worldBounds>') % (tuple(minimum) + tuple(maximum) +
+                                                                                       tuple(center) + (radius,))
+
+    def _FormatLink(self, link):
+        if self.linkTable is None:
+            return ' link="%s"' % link
+
+        index = self.linkTable.Index(link)
+        if self.cacheNames is not None:
+            self.cacheNames.append(['linktable', link, index])
+        return ' linkIndex="%d"' % index
+
+    def _FormatLODs(self, lods):
+        if not lods:
+            return ''
+
+        entries = ['<lod screenSize="%f" link="%s"/>' % (screenSize, link) for screenSize, link in lods]
+        return '<lods>%s</lods>' % ''.join(entries)
+
+    def _FormatStatic(self, static):
+        if not self._flatten:
+            return ''
+        return '<static>%d</static>' % (1 if static else 0)
+
+    def _FormatLayers(self, layers):
+        if self._compact:
+            return '<layers>%d</layers>' % LayersToMask(layers)
+        return '<layers>%s</layers>' % self._FormatBoolValueArray(layers)
+
+    def _Compact(self, field):
+        """Drops blocks that only hold default values in compact mode"""
+        if self._compact and field in COMPACT_DEFAULTS:
+            return ''
+        return field
+
+    def _FormatCustomProperty(self, name, property):
+        if isinstance(property, float):
+            value = ' type="Float" Value="%s"' % property.real
+        elif isinstance(property, int):
+            value = ' type="Int" Value="%s"' % property
+        elif isinstance(property, str):
+            value = ' type="String" Value="%s"' % property
+        else:
+            if self._log:
+                self._log.Warning("Unknown type for custom property %s", name)
+            value = ''
+        return '<property id="%s"%s/>' % (name, value)
+
+    def _FormatCustomProperties(self, properties):
+        parts = ['<customproperties>']
+        for key, value in properties:
+            parts.append(self._FormatCustomProperty(key, value))
+        parts.append('</customproperties>')
+        return ''.join(parts)
+
+# -------------------------------------------------------------------------
+# Reading, returns the same model for xcdb and xcd files
+# -------------------------------------------------------------------------
+def ReadBinary(filePath):
+    with open(filePath, 'rb') as file:
+        buffer = file.read()
+
+    magic, version, sections, stringCount, elementCount, lightCount, cameraCount, propertyCount = _header.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("%s is not a xcdb file" % filePath)
+    if version != VERSION:
+        raise ValueError("Unsupported xcdb version %d" % version)
+    offset = _header.size
+
+    strings = []
+    for i in range(stringCount):
+        length, = _string.unpack_from(buffer, offset)
+        offset += _string.size
+        strings.append(buffer[offset:offset + length].decode('utf-8'))
+        offset += length
+
+    def string(index):
+        return strings[index] if index >= 0 else None
+
+    hasFog, fogType, depth, r, g, b = _fog.unpack_from(buffer, offset)
+    offset += _fog.size
+    fog = None
+    if hasFog:
+        fog = {'type': FOG_TYPES[fogType], 'depth': depth, 'color': [r, g, b]}
+
+    def records(layout, count):
+        nonlocal offset
+        result = [layout.unpack_from(buffer, offset + i * layout.size) for i in range(count)]
+        offset += layout.size * count
+        return result
+
+    elementRecords = records(_element, elementCount)
+    propertyRecords = records(_property, propertyCount)
+    lightRecords = records(_light, lightCount)
+    cameraRecords = records(_camera, cameraCount)
+
+    properties = []
+    for name, type, intValue, floatValue in propertyRecords:
+        if type == 0:
+            value = floatValue
+        elif type == 1:
+            value = intValue
+        else:
+            value = string(intValue)
+        properties.append((string(name), value))
+
+    transformFloats, offset = _ReadFloatArray(buffer, offset, elementCount * ELEMENT_TRANSFORM_FLOATS if sections & SECTION_TRANSFORMS else 0)
+    boundFloats, offset = _ReadFloatArray(buffer, offset, elementCount * ELEMENT_BOUNDS_FLOATS if sections & SECTION_BOUNDS else 0)
+    lightFloats, offset = _ReadFloatArray(buffer, offset, lightCount * LIGHT_FLOATS)
+    cameraFloats, offset = _ReadFloatArray(buffer, offset, cameraCount * CAMERA_FLOATS)
+
+    elements = []
+    transforms = _Chunks(transformFloats, ELEMENT_TRANSFORM_FLOATS)
+    bounds = _Chunks(boundFloats, ELEMENT_BOUNDS_FLOATS)
+    for i, (id, link, parent, rotationMode, layers, start, count) in enumerate(elementRecords):
+        element = {'id': string(id), 'link': string(link), 'parent': parent, 'layers': layers,
+                   'properties': properties[start:start + count]}
+        if transforms:
+            element['translation'] = transforms[i][0:3]
+            element['rotation'] = [rotationMode] + transforms[i][3:7]
+            element['scale'] = transforms[i][7:10]
+        if bounds:
+            element['bounds'] = _Chunks(bounds[i], 3)
+        elements.append(element)
+
+    lights = []
+    for (id, type, layers, start, count), values in zip(lightRecords, _Chunks(lightFloats, LIGHT_FLOATS)):
+        lights.append({'id': string(id), 'type': LIGHT_TYPES[type], 'layers': layers,
+                       'properties': properties[start:start + count],
+                       'color': values[0:3], 'intensity': values[3], 'radius': values[4],
+                       'spotsize': values[5], 'angle': values[6],
+                       'direction': values[7:10], 'location': values[10:13]})
+
+    cameras = []
+    for (id, rotationMode, layers, start, count), values in zip(cameraRecords, _Chunks(cameraFloats, CAMERA_FLOATS)):
+        cameras.append({'id': string(id), 'layers': layers, 'properties': properties[start:start + count],
+                        'fov': values[0], 'position': values[1:4], 'rotation': [rotationMode] + values[4:8]})
+
+    return {'sections': sections, 'fog': fog, 'elements': elements, 'lights': lights, 'cameras': cameras}
+
+def _Floats(text):
+    return [float(value) for value in text.split()]
+
+def _ReadRotation(node):
+    text = node.find('rotation').text
+    if text == 'None':
+        return [0, 0.0, 0.0, 0.0, 0.0]
+    rotation = _Floats(text)
+    return [int(rotation[0])] + rotation[1:]
+
+def _ReadLayers(node):
+    # Version 1.1 writes a single bitmask and leaves out the default first layer
+    layers = node.find('layers')
+    if layers is None:
+        return 1
+    values = layers.text.split()
+    if len(values) == 1:
+        return int(values[0])
+    return LayersToMask([value == '1' for value in values])
+
+def _ReadBounds(node):
+    bounds = node.find('boundingBox')
+    if bounds is None:
+        return [[0.0, 0.0, 0.0]] * 8
+    return [_Floats(point.text) for point in bounds]
+
+def _ReadWorldBounds(node):
+    bounds = node.find('worldBounds')
+    if bounds is None:
+        return None
+    return {'min': _Floats(bounds.find('min').text), 'max': _Floats(bounds.find('max').text),
+            'center': _Floats(bounds.find('center').text), 'radius': float(bounds.find('radius').text)}
+
+def _ReadBVHNode(node):
+    values = node.text.split()
+    return [tuple([float(value) for value in values[0:3]]), tuple([float(value) for value in values[3:6]]),
+            int(values[6]), int(values[7])]
+
+def _ReadLODs(node):
+    lods = node.find('lods')
+    if lods is None:
+        return []
+    return [(float(lod.get('screenSize')), lod.get('link')) for lod in lods]
+
+def _ReadBatch(node):
+    return {'link': node.get('link'), 'material': node.get('material'),
+            'cell': [int(value) for value in node.get('cell').split()],
+            'ranges': [(entry.get('element'), int(entry.get('first')), int(entry.get('count'))) for entry in node]}
+
+def _ReadScale(node):
+    scale = node.find('scale')
+    if scale is None:
+        return [1.0, 1.0, 1.0]
+    return _Floats(scale.text)
+
+def _ReadProperties(node):
+    properties = []
+    entries = node.find('customproperties')
+    for entry in entries if entries is not None else []:
+        type = entry.get('type')
+        value = entry.get('Value')
+        if type == 'Float':
+            value = float(value)
+        elif type == 'Int':
+            value = int(value)
+        properties.append((entry.get('id'), value))
+    return properties
+
+def _ReadLink(node, links):
+    """Link of an element or prototype, written inline or as index into the link table"""
+    index = node.get('linkIndex')
+    if index is None:
+        return node.get('link')
+    return links[int(index)]
+
+def _ResolveInstance(node, prototypes, links):
+    """Builds the full element of an instance from its prototype and the overridden fields"""
+    prototype = prototypes[int(node.get('prototype'))]
+    element = ElementTree.Element('element', {'id': node.get('id', prototype.get('id'))})
+    if node.get('uid') is not None:
+        element.set('uid', node.get('uid'))
+    link = _ReadLink(prototype, links)
+    if link is not None:
+        element.set('link', link)
+    for field in prototype:
+        if node.find(field.tag) is None:
+            element.append(field)
+    for override in node:
+        element.append(override)
+    return element
+
+def ReadXml(filePath):
+    opener = gzip.open if filePath.lower().endswith('.gz') else open
+    with opener(filePath, 'rb') as file:
+        root = ElementTree.parse(file).getroot()
+
+    scene = root.find('scene')
+    model = {'sections': SECTION_ALL, 'fog': None, 'elements': [], 'lights': [], 'cameras': [], 'bvh': None, 'batches': []}
+
+    def readElement(node, parent):
+        model['elements'].append({'id': node.get('id'), 'link': _ReadLink(node, links), 'parent': parent,
+                                  'layers': _ReadLayers(node), 'properties': _ReadProperties(node),
+                                  'translation': _Floats(node.find('translation').text),
+                                  'rotation': _ReadRotation(node),
+                                  'scale': _ReadScale(node),
+                                  'bounds': _ReadBounds(node),
+                                  'worldBounds': _ReadWorldBounds(node),
+                                  'lods': _ReadLODs(node),
+                                  'uid': int(node.get('uid')) if node.get('uid') is not None else None})
+        index = len(model['elements']) - 1
+        for child in node:
+            if child.tag == 'element':
+                readElement(child, index)
+            elif child.tag == 'instance':
+                readElement(_ResolveInstance(child, prototypes, links), index)
+
+    prototypes = scene.find('prototypes')
+    prototypes = list(prototypes) if prototypes is not None else []
+    links = scene.find('links')
+    links = [entry.text for entry in links] if links is not None else []
+
+    for node in scene:
+        if node.tag == 'fog':
+            model['fog'] = {'type': node.get('type'), 'depth': float(node.get('depth')),
+                            'color': _Floats(node.find('color').text)}
+        elif node.tag == 'element':
+            readElement(node, -1)
+        elif node.tag == 'instance':
+            readElement(_ResolveInstance(node, prototypes, links), -1)
+        elif node.tag == 'bvh':
+            model['bvh'] = [_ReadBVHNode(entry) for entry in node]
+        elif node.tag == 'batches':
+            model['batches'] = [_ReadBatch(entry) for entry in node]
+        elif node.tag == 'light':
+            type = node.get('type')
+            direction = node.find('direction')
+            location = node.find('location')
+            model['lights'].append({'id': node.get('id'), 'type': type, 'layers': _ReadLayers(node),
+                                    'properties': _ReadProperties(node),
+                                    'color': _Floats(node.find('color').text),
+                                    'intensity': float(node.get('intensity')),
+                                    'radius': float(node.get('radius', 0.0)),
+                                    'spotsize': float(node.get('spotsize', 0.0)),
+                                    'angle': float(node.get('angle', 0.0)),
+                                    'direction': _Floats(direction.text) if direction is not None else [0.0, 0.0, 0.0],
+                                    'location': _Floats(location.text) if location is not None else [0.0, 0.0, 0.0]})
+        elif node.tag == 'camera':
+            model['cameras'].append({'id': node.get('id'), 'layers': _ReadLayers(node),
+                                     'properties': _ReadProperties(node),
+                                     'fov': float(node.get('fov')),
+                                     'position': _Floats(node.find('position').text),
+                                     'rotation': _ReadRotation(node)})
+
+    return model
+
+# -------------------------------------------------------------------------
+# Comparison, the xml is written with limited precision so floats are
+# compared with a tolerance
+# -------------------------------------------------------------------------
+def _Equal(left, right, tolerance):
+    if isinstance(left, float) or isinstance(right, float):
+        return math.fabs(left - right) <= tolerance + tolerance * math.fabs(right)
+    if isinstance(left, (list, tuple)):
+        if len(left) != len(right):
+            return False
+        return all(_Equal(a, b, tolerance) for a, b in zip(left, right))
+    if isinstance(left, dict):
+        return left.keys() == right.keys() and all(_Equal(left[key], right[key], tolerance) for key in left)
+    return left == right
+
+def _QuaternionRows(translation, rotation, scale):
+    """3x4 rows of the matrix built from translation, (w, x, y, z) rotation and scale"""
+    w, x, y, z = rotation
+    axes = [(1.0 - 2.0 * (y * y + z * z), 2.0 * (x * y - w * z), 2.0 * (x * z + w * y)),
+            (2.0 * (x * y + w * z), 1.0 - 2.0 * (x * x + z * z), 2.0 * (y * z - w * x)),
+            (2.0 * (x * z - w * y), 2.0 * (y * z + w * x), 1.0 - 2.0 * (x * x + y * y))]
+    rows = []
+    for row, axis in enumerate(axes):
+        rows.extend([axis[i] * scale[i] for i in range(3)] + [translation[row]])
+    return rows
+
+def _BinaryRotation(binaryEntry, xmlEntry):
+    """Rotation of the binary entry in the encoding of the xml one. The binary stores the matrix
+       rows of tag 4 as quaternion next to translation and scale, cameras have no scale"""
+    rotation = binaryEntry['rotation']
+    xmlRotation = xmlEntry.get('rotation')
+    if rotation[0] != 3 or not xmlRotation or xmlRotation[0] != 4:
+        return rotation
+    translation = binaryEntry['translation'] if 'translation' in binaryEntry else binaryEntry['position']
+    return [4] + _QuaternionRows(translation, rotation[1:], binaryEntry.get('scale', [1.0, 1.0, 1.0]))
+
+# Keys the binary leaves out when their section is not selected
+_SECTION_KEYS = {SECTION_TRANSFORMS: ('translation', 'rotation', 'scale'),
+                 SECTION_BOUNDS: ('bounds',)}
+
+def Compare(binaryModel, xmlModel, tolerance=0.01):
+    """Returns a list of differences between the two models, limited to the sections in the binary.
+       Values the xml holds and the binary has no key for (world bounds, lods, uids) are reported
+       as differences, the binary drops them"""
+    sections = binaryModel['sections']
+    differences = []
+    skipped = set([key for section, keys in _SECTION_KEYS.items() if not sections & section for key in keys])
+
+    if not _Equal(binaryModel['fog'], xmlModel['fog'], tolerance):
+        differences.append('fog: %r != %r' % (binaryModel['fog'], xmlModel['fog']))
+
+    groups = ['elements']
+    if sections & SECTION_LIGHTS:
+        groups.append('lights')
+    if sections & SECTION_CAMERAS:
+        groups.append('cameras')
+
+    for group in groups:
+        binaryEntries = binaryModel[group]
+        xmlEntries = xmlModel[group]
+        if len(binaryEntries) != len(xmlEntries):
+            differences.append('%s: count %d != %d' % (group, len(binaryEntries), len(xmlEntries)))
+            continue
+
+        for binaryEntry, xmlEntry in zip(binaryEntries, xmlEntries):
+            for key, value in binaryEntry.items():
+                if key == 'rotation':
+                    value = _BinaryRotation(binaryEntry, xmlEntry)
+                if not _Equal(value, xmlEntry.get(key), tolerance):
+                    differences.append('%s %s.%s: %r != %r' % (group, binaryEntry['id'], key, value, xmlEntry.get(key)))
+
+            for key, value in xmlEntry.items():
+                if key in binaryEntry or key in skipped or value is None or value == []:
+                    continue
+                differences.append('%s %s.%s: %r only in the xml' % (group, xmlEntry['id'], key, value))
+
+    return differences
+
+if __name__ == "__main__":
+    # python binary_xcd.py stage.xcdb stage.xcd
+    differences = Compare(ReadBinary(sys.argv[1]), ReadXml(sys.argv[2]))
+    for difference in differences:
+        print(difference)
+    print("%d differences" % len(differences))
+    sys.exit(1 if differences else 0)
@@ -0,0 +1,111 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# -------------------------------------------------------------------------
+# World space bounds, stored as (min, max, center, radius) with min / max /
+# center as 3-tuples. The sphere is centered on the box and encloses every
+# transformed corner that contributed to it.
+# -------------------------------------------------------------------------
+def TransformPoints(matrix, points):
+    """Applies a row major 4x4 matrix to 3d points"""
+    return [(matrix[0][0] * x + matrix[0][1] * y + matrix[0][2] * z + matrix[0][3],
+             matrix[1][0] * x + matrix[1][1] * y + matrix[1][2] * z + matrix[1][3],
+             matrix[2][0] * x + matrix[2][1] * y + matrix[2][2] * z + matrix[2][3]) for x, y, z in points]
+
+def BoundsFromPoints(points):
+    minimum = tuple([min([point[i] for point in points]) for i in range(3)])
+    maximum = tuple([max([point[i] for point in points]) for i in range(3)])
+    center = tuple([(minimum[i] + maximum[i]) * 0.5 for i in range(3)])
+    radius = max([math.sqrt(sum([(point[i] - center[i]) ** 2 for i in range(3)])) for point in points])
+    return minimum, maximum, center, radius
+
+def MergeBounds(bounds, other):
+    """Smallest box around both, with a sphere on its center that encloses both spheres"""
+    if bounds is None:
+        return other
+    if other is None:
+        return bounds
+
+    minimum = tuple([min(bounds[0][i], other[0][i]) for i in range(3)])
+    maximum = tuple([max(bounds[1][i], other[1][i]) for i in range(3)])
+    center = tuple([(minimum[i] + maximum[i]) * 0.5 for i in range(3)])
+    radius = max([math.sqrt(sum([(entry[2][i] - center[i]) ** 2 for i in range(3)])) + entry[3] for entry in (bounds, other)])
+    return minimum, maximum, center, radius
+
+class BoundsBuilder:
+    """Collects the local bounding box corners and world matrices of many meshes and
+       computes the bounds of every owner in one vectorized pass"""
+
+    _owners = None
+    _corners = None
+    _matrices = None
+
+    def __init__(self):
+        self._owners = []
+        self._corners = []
+        self._matrices = []
+
+    def Add(self, owner, corners, matrix):
+        self._owners.append(owner)
+        self._corners.append([tuple(corner) for corner in corners])
+        self._matrices.append([tuple(row) for row in matrix])
+
+    def Build(self):
+        """Returns a dict owner -> bounds"""
+        if not self._owners:
+            return {}
+
+        if numpy is None:
+            return self._BuildPython()
+        return self._BuildNumpy()
+
+    def _BuildPython(self):
+        points = {}
+        for owner, corners, matrix in zip(self._owners, self._corners, self._matrices):
+            points.setdefault(owner, []).extend(TransformPoints(matrix, corners))
+        return dict([(owner, BoundsFromPoints(ownerPoints)) for owner, ownerPoints in points.items()])
+
+    def _BuildNumpy(self):
+        ownerLookup = {}
+        ownerIndices = numpy.array([ownerLookup.setdefault(owner, len(ownerLookup)) for owner in self._owners])
+        order = numpy.argsort(ownerIndices, kind='stable')
+        ownerIndices = ownerIndices[order]
+
+        corners = numpy.array(self._corners, dtype=numpy.float64)[order]
+        matrices = numpy.array(self._matrices, dtype=numpy.float64)[order]
+        points = numpy.einsum('kij,kpj->kpi', matrices[:, :3, :3], corners) + matrices[:, numpy.newaxis, :3, 3]
+
+        # Meshes are grouped by owner now, reduce every group
+        groupStarts = numpy.r_[True, ownerIndices[1:] != ownerIndices[:-1]]
+        groups = numpy.cumsum(groupStarts) - 1
+        starts = numpy.flatnonzero(groupStarts)
+        minimum = numpy.minimum.reduceat(points.min(axis=1), starts)
+        maximum = numpy.maximum.reduceat(points.max(axis=1), starts)
+        center = (minimum + maximum) * 0.5
+
+        offsets = points - center[groups][:, numpy.newaxis, :]
+        distances = numpy.sqrt((offsets * offsets).sum(axis=2))
+        radius = numpy.maximum.reduceat(distances.max(axis=1), starts)
+
+        owners = [None] * len(ownerLookup)
+        for owner, index in ownerLookup.items():
+            owners[index] = owner
+
+        result = {}
+        for group, start in enumerate(starts):
+            result[owners[ownerIndices[start]]] = (tuple(minimum[group].tolist()), tuple(maximum[group].tolist()),
+                                                   tuple(center[group].tolist()), float(radius[group]))
+        return result
@@ -0,0 +1,266 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import random
+import sys
+
+# -------------------------------------------------------------------------
+# Flat bounding volume hierarchy over element boxes, built top down with a
+# binned surface area heuristic.
+#
+#   nodes      [min, max, first, count] in depth first order, the left child
+#              of an inner node is the node following it
+#   inner      count = 0, first = index of the right child
+#   leaf       count > 0, first = position of its first box in spatial order
+# -------------------------------------------------------------------------
+LEAF_SIZE = 4
+BIN_COUNT = 12
+
+def _Union(boxes):
+    minimum = tuple([min([box[0][i] for box in boxes]) for i in range(3)])
+    maximum = tuple([max([box[1][i] for box in boxes]) for i in range(3)])
+    return minimum, maximum
+
+def _Area(box):
+    x, y, z = [box[1][i] - box[0][i] for i in range(3)]
+    return 2.0 * (x * y + y * z + z * x)
+
+def _Bin(center, binning):
+    axis, low, scale = binning
+    return min(int((center[axis] - low) * scale), BIN_COUNT - 1)
+
+def _SplitSAH(boxes, centers, items):
+    """Returns (bin, binning) of the cheapest split, None if the centers do not spread on any axis"""
+    best = None
+    for axis in range(3):
+        low = min([centers[item][axis] for item in items])
+        high = max([centers[item][axis] for item in items])
+        if high - low <= 0.0:
+            continue
+
+        binning = (axis, low, BIN_COUNT / (high - low))
+        bins = [[] for i in range(BIN_COUNT)]
+        for item in items:
+            bins[_Bin(centers[item], binning)].append(boxes[item])
+
+        # Area times count of everything left of bin i, then sweep back from the right
+        leftCosts = [None] * BIN_COUNT
+        box = None
+        count = 0
+        for i in range(BIN_COUNT - 1):
+            if bins[i]:
+                box = _Union(bins[i] + ([box] if box else []))
+                count += len(bins[i])
+            if box:
+                leftCosts[i + 1] = _Area(box) * count
+
+        box = None
+        count = 0
+        for i in range(BIN_COUNT - 1, 0, -1):
+            if bins[i]:
+                box = _Union(bins[i] + ([box] if box else []))
+                count += len(bins[i])
+            if box is None or leftCosts[i] is None:
+                continue
+
+            cost = leftCosts[i] + _Area(box) * count
+            if best is None or cost < best[0]:
+                best = (cost, i, binning)
+
+    if best is None:
+        return None
+    return best[1], best[2]
+
+def BuildBVH(boxes, leafSize=LEAF_SIZE):
+    """boxes is a list of (min, max), returns (nodes, order) with order listing the box indices in spatial order"""
+    if not boxes:
+        return [], []
+
+    centers = [tuple([(box[0][i] + box[1][i]) * 0.5 for i in range(3)]) for box in boxes]
+    order = list(range(len(boxes)))
+    nodes = []
+
+    # start, end and the inner node waiting for the index of its right child
+    stack = [(0, len(order), None)]
+    while stack:
+        start, end, parent = stack.pop()
+        index = len(nodes)
+        if parent is not None:
+            nodes[parent][2] = index
+
+        items = order[start:end]
+        minimum, maximum = _Union([boxes[item] for item in items])
+        node = [minimum, maximum, start, end - start]
+        nodes.append(node)
+        if end - start <= leafSize:
+            continue
+
+        split = _SplitSAH(boxes, centers, items)
+        if split is None:
+            # Every center is the same point, halve the range to keep leaves small
+            middle = start + (end - start) // 2
+        else:
+            splitBin, binning = split
+            left = [item for item in items if _Bin(centers[item], binning) < splitBin]
+            right = [item for item in items if _Bin(centers[item], binning) >= splitBin]
+            order[start:end] = left + right
+            middle = start + len(left)
+
+        # The left range is popped first so it becomes the next node
+        node[3] = 0
+        stack.append((middle, end, index))
+        stack.append((start, middle, None))
+
+    return nodes, order
+
+# -------------------------------------------------------------------------
+# Reference queries, the boxes are given in spatial order
+# -------------------------------------------------------------------------
+def _BoxInFrustum(box, planes):
+    """planes are (a, b, c, d) with a * x + b * y + c * z + d >= 0 on the inside"""
+    minimum, maximum = box
+    for a, b, c, d in planes:
+        x = maximum[0] if a >= 0 else minimum[0]
+        y = maximum[1] if b >= 0 else minimum[1]
+        z = maximum[2] if c >= 0 else minimum[2]
+        if a * x + b * y + c * z + d < 0:
+            return False
+    return True
+
+def _RayBox(box, origin, inverse, maxDistance):
+    """Slab test, returns the entry distance or None"""
+    near = 0.0
+    far = maxDistance
+    for i in range(3):
+        if inverse[i] is None:
+            if origin[i] < box[0][i] or origin[i] > box[1][i]:
+                return None
+            continue
+
+        t0 = (box[0][i] - origin[i]) * inverse[i]
+        t1 = (box[1][i] - origin[i]) * inverse[i]
+        if t0 > t1:
+            t0, t1 = t1, t0
+        near = max(near, t0)
+        far = min(far, t1)
+        if near > far:
+            return None
+    return near
+
+def _Traverse(nodes, test):
+    """Yields the leaves whose box and every ancestor box pass the test"""
+    stack = [0] if nodes else []
+    while stack:
+        index = stack.pop()
+        minimum, maximum, first, count = nodes[index]
+        if not test((minimum, maximum)):
+            continue
+
+        if count:
+            yield first, count
+        else:
+            stack.append(first)
+            stack.append(index + 1)
+
+def QueryFrustum(nodes, boxes, planes):
+    """Returns the spatial positions of the boxes inside or intersecting the frustum"""
+    result = []
+    for first, count in _Traverse(nodes, lambda box: _BoxInFrustum(box, planes)):
+        result.extend([position for position in range(first, first + count) if _BoxInFrustum(boxes[position], planes)])
+    return sorted(result)
+
+def QueryRay(nodes, boxes, origin, direction, maxDistance=float('inf')):
+    """Returns (distance, position) of the boxes hit by the ray, nearest first"""
+    inverse = [1.0 / value if value != 0.0 else None for value in direction]
+    result = []
+    for first, count in _Traverse(nodes, lambda box: _RayBox(box, origin, inverse, maxDistance) is not None):
+        for position in range(first, first + count):
+            distance = _RayBox(boxes[position], origin, inverse, maxDistance)
+            if distance is not None:
+                result.append((distance, position))
+    return sorted(result)
+
+# -------------------------------------------------------------------------
+# Validation
+# -------------------------------------------------------------------------
+def _Contains(outer, inner, tolerance):
+    return all([outer[0][i] - tolerance <= inner[0][i] and inner[1][i] <= outer[1][i] + tolerance for i in range(3)])
+
+def Validate(nodes, boxes, tolerance=1e-4, queries=200, seed=0):
+    """Returns a list of problems of the tree over boxes (in spatial order), checks the structure
+       and compares frustum and ray queries against testing every box"""
+    problems = []
+    covered = [0] * len(boxes)
+    stack = [(0, None)] if nodes else []
+    while stack:
+        index, parent = stack.pop()
+        if index >= len(nodes):
+            problems.append('node %d does not exist' % index)
+            continue
+
+        minimum, maximum, first, count = nodes[index]
+        if parent is not None and not _Contains(nodes[parent][:2], (minimum, maximum), tolerance):
+            problems.append('node %d is not inside its parent %d' % (index, parent))
+        if count:
+            for position in range(first, min(first + count, len(boxes))):
+                covered[position] += 1
+                if not _Contains((minimum, maximum), boxes[position], tolerance):
+                    problems.append('box %d is not inside leaf %d' % (position, index))
+        else:
+            stack.append((first, index))
+            stack.append((index + 1, index))
+
+    problems.extend(['box %d is in %d leaves' % (position, count) for position, count in enumerate(covered) if count != 1])
+    if problems or not boxes:
+        return problems
+
+    # Random queries inside the scene bounds against the brute force answer
+    generator = random.Random(seed)
+    minimum, maximum = _Union(boxes)
+    def point():
+        return [generator.uniform(minimum[i], maximum[i]) for i in range(3)]
+
+    for i in range(queries):
+        origin = point()
+        direction = [generator.uniform(-1.0, 1.0) for axis in range(3)]
+        inverse = [1.0 / value if value != 0.0 else None for value in direction]
+        distances = [(_RayBox(box, origin, inverse, float('inf')), position) for position, box in enumerate(boxes)]
+        expected = sorted([entry for entry in distances if entry[0] is not None])
+        if QueryRay(nodes, boxes, origin, direction) != expected:
+            problems.append('ray %r %r differs from brute force' % (origin, direction))
+
+        center = point()
+        planes = [(1.0, 0.0, 0.0, -center[0]), (0.0, 1.0, 0.0, -center[1]), (-1.0, -1.0, 0.0, center[0] + center[1] + 1.0),
+                  (0.0, 0.0, 1.0, -center[2]), (0.0, 0.0, -1.0, center[2] + 1.0)]
+        expected = [position for position, box in enumerate(boxes) if _BoxInFrustum(box, planes)]
+        if QueryFrustum(nodes, boxes, planes) != expected:
+            problems.append('frustum at %r differs from brute force' % (center,))
+
+    return problems
+
+def StageBoxes(model):
+    """Top level element boxes of a stage read by binary_xcd.ReadXml, in the order they were written"""
+    return [(tuple(element['worldBounds']['min']), tuple(element['worldBounds']['max']))
+            for element in model['elements'] if element['parent'] == -1 and element['worldBounds'] is not None]
+
+if __name__ == "__main__":
+    # python bvh_xcd.py stage.xcd
+    from binary_xcd import ReadXml
+
+    model = ReadXml(sys.argv[1])
+    if model['bvh'] is None:
+        print("stage has no bvh")
+        sys.exit(1)
+
+    boxes = StageBoxes(model)
+    problems = Validate(model['bvh'], boxes)
+    for problem in problems:
+        print(problem)
+    print("%d nodes over %d elements, %d problems" % (len(model['bvh']), len(boxes), len(problems)))
+    sys.exit(1 if problems else 0)
@@ -0,0 +1,87 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import json
+import os
+
+CACHE_VERSION = 1
+
+class XCDExportCache:
+    """Persistent map of object key to content digest and the xml fragment written for it"""
+
+    _filePath = None
+    _settings = None
+    _log = None
+    _entries = None
+    _usedKeys = None
+
+    hits = 0
+    misses = 0
+
+    # -------------------------------------------------------------------------
+    # Constructor
+    # -------------------------------------------------------------------------
+    def __init__(self, filePath, settings, log):
+        self._filePath = filePath
+        self._settings = settings
+        self._log = log
+        self._entries = {}
+        self._usedKeys = set()
+        self.hits = 0
+        self.misses = 0
+
+        self._Load()
+
+    # -------------------------------------------------------------------------
+    # Public
+    # -------------------------------------------------------------------------
+    def Get(self, key, digest):
+        """Returns (fragment, names) if the cached entry is still valid for the digest"""
+        entry = self._entries.get(key)
+        if entry is None or entry['digest'] != digest:
+            self.misses = self.misses + 1
+            return None
+
+        self.hits = self.hits + 1
+        self._usedKeys.add(key)
+        return entry['fragment'], entry['names']
+
+    def Store(self, key, digest, fragment, names):
+        self._entries[key] = {'digest': digest, 'fragment': fragment, 'names': names}
+        self._usedKeys.add(key)
+
+    def Save(self):
+        # Drop entries of objects that are no longer part of the export
+        entries = dict([(key, self._entries[key]) for key in self._usedKeys])
+        data = {'version': CACHE_VERSION, 'settings': self._settings, 'objects': entries}
+
+        temporaryPath = self._filePath + '.tmp'
+        with open(temporaryPath, 'w', encoding='utf-8') as file:
+            json.dump(data, file, separators=(',', ':'))
+        os.replace(temporaryPath, self._filePath)
+
+    # -------------------------------------------------------------------------
+    # Private
+    # -------------------------------------------------------------------------
+    def _Load(self):
+        if not os.path.isfile(self._filePath):
+            return
+
+        try:
+            with open(self._filePath, 'r', encoding='utf-8') as file:
+                data = json.load(file)
+        except ValueError:
+            self._log.Warning('discarding unreadable export cache %s', self._filePath)
+            return
+
+        if data.get('version') != CACHE_VERSION or data.get('settings') != self._settings:
+            self._log.Info('export cache %s was written with other settings, exporting everything', self._filePath)
+            return
+
+        self._entries = data.get('objects', {})
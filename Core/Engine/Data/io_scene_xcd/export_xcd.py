@@ -10,42 +10,218 @@
 import math
 import os
 import bpy
+import bmesh
 import mathutils
 import gzip
+import hashlib
+import time
 import bpy_extras
 
-from bpy_extras.io_utils import unique_name, create_derived_objects, free_derived_objects
+from array import array
+
+from bpy_extras.io_utils import create_derived_objects, free_derived_objects
 from xml.sax.saxutils import quoteattr, escape
+from .writer_xcd import XCDBufferedWriter, DEFAULT_BUFFER_SIZE
+from .binary_xcd import XCDBinaryWriter, XCDStageWriter, SectionsFromNames
+from .cache_xcd import XCDExportCache
+from .log_xcd import XCDLog, DEFAULT_LOG_LEVEL
+from .hierarchy_xcd import BuildHierarchy, WalkHierarchy
+from .bounds_xcd import BoundsBuilder, MergeBounds
+from .bvh_xcd import BuildBVH
+from .mesh_xcd import BuildMesh, SaveMesh, IndexCount, QuantizeFormat, VertexSize, FORMAT_UV
+from .optimize_xcd import OptimizeMesh
+from .lod_xcd import BuildLODChain, ParseRatios
+from .batch_xcd import BatchBuilder, CellOf, Ranges
+from .names_xcd import IdAllocator
+from .link_xcd import LinkResolver, LinkTable, ParseLinkRules, DEFAULT_LINK_RULES
+from .transform_xcd import DecomposeMatrices, MatricesFromColumns, HAS_NUMPY
+
+VERSION = "0.1"
 
-print("Version 0.1")
+# Elements with this custom property set (and everything below them) are moved at
+# runtime, they are never batched or flattened
+DYNAMIC_PROPERTY = 'Dynamic'
 
 class XCDExporter:
     # -------------------------------------------------------------------------
     # Globals
     # -------------------------------------------------------------------------
-    _uuidCacheObjects = {}
-    _uuidCacheLights = {}
-    _uuidCacheView = {}
-    _uuidCacheWorld = {}
+    _ids = None
+    _integerIds = False
     
     _file = None
     _filePath = None
     _fileName = None
-    _fileWriter = None
+    _stage = None
+    _binary = None
+    _binaryPath = None
+    _cache = None
+    _cacheNames = None
+    _libraryTimes = None
+    _finished = False
+    _log = None
+    _lastCached = False
+    _instancing = False
+    _compact = False
+    _worldBounds = False
+    _bounds = None
+    _ownBounds = None
+    _derivedLists = None
+    _groupTemplates = None
+    _derivedPlans = None
+    _groupHits = 0
+    _bvh = False
+    _bvhNodes = None
+    _tileSize = 0
+    _tiles = None
+    _tile = None
+    _tileStem = None
+    _tileExtension = None
+    _compressionLevel = None
+    _bufferSize = DEFAULT_BUFFER_SIZE
+    _world = None
+    _meshes = False
+    _meshFiles = None
+    _meshDirectory = None
+    _meshOptimize = 'CACHE'
+    _quantization = None
+    _lodRatios = None
+    _meshLODs = None
+    _meshDrawCalls = None
+    _batchSize = 0
+    _batches = None
+    _batchList = None
+    _drawCalls = 0
+    _batchedDrawCalls = 0
+    _transforms = None
+    _rotationEncoding = 'MODE'
+    _flatten = False
+    _worldTransforms = None
+    _dynamic = None
+    _linkResolver = None
+    _useLinkTable = False
+    _linkRules = DEFAULT_LINK_RULES
     _globalMatrix = None
-
-    _debugIndent = 0
     
     # -------------------------------------------------------------------------
     # Constructor
     # -------------------------------------------------------------------------
-    def __init__(self, filePath, globalMatrix):
-        self._file = open(filePath, 'w', encoding='utf-8')
-        self._fileName = self._file.name
-        self._filePath = quoteattr(os.path.basename(self._fileName));        
-        self._fileWriter = self._file.write
+    def __init__(self, filePath, globalMatrix, bufferSize=DEFAULT_BUFFER_SIZE, compressionLevel=None,
+                 binaryPath=None, binarySections=0, cachePath=None, logLevel=DEFAULT_LOG_LEVEL, tracePath=None,
+                 instancing=False, compact=False, worldBounds=False, bvh=False, tileSize=0,
+                 meshes=False, meshOptimize='CACHE', quantization=None, lodRatios=(),
+                 batchSize=0, rotationEncoding='MODE', flatten=False,
+                 linkRules=DEFAULT_LINK_RULES, linkTable=False,
+                 integerIds=False):
+        self._log = XCDLog(logLevel, tracePath)
+        # Names are unique per export, a batch or a long session does not accumulate them
+        self._ids = {'objects': IdAllocator(), 'lights': IdAllocator(), 'view': IdAllocator()}
+        self._integerIds = integerIds
+        self._instancing = instancing
+        self._compact = compact
+        if bvh and tileSize:
+            self._log.Warning('bvh is not written for tiled stages')
+            bvh = False
+        if bvh and flatten:
+            # Collapsed empties turn into any number of top level elements, the leaves would not match them
+            self._log.Warning('bvh is not written for flattened stages')
+            bvh = False
+        
+        if batchSize and not meshes:
+            self._log.Warning('batching needs mesh export, batches are not written')
+            batchSize = 0
+        
+        # The bvh, the tiles and the batch cells are built from the element world bounds, so they are written as well
+        self._worldBounds = worldBounds or bvh or bool(tileSize) or bool(batchSize)
+        self._bvh = bvh
+        self._tileSize = tileSize
+        self._meshes = meshes
+        self._meshFiles = IdAllocator(bpy.path.clean_name)
+        self._meshOptimize = meshOptimize
+        # Maximum (position, normal degrees, uv) error of quantized attributes, None writes floats
+        self._quantization = quantization
+        self._lodRatios = lodRatios
+        self._meshLODs = {}
+        self._meshDrawCalls = {}
+        self._batchSize = batchSize
+        if batchSize:
+            self._batches = BatchBuilder()
+        self._bounds = {}
+        self._ownBounds = {}
+        self._derivedLists = {}
+        self._groupTemplates = {}
+        self._derivedPlans = {}
+        self._transforms = {}
+        self._rotationEncoding = rotationEncoding
+        self._flatten = flatten
+        self._worldTransforms = {}
+        self._dynamic = {}
+        self._linkResolver = LinkResolver(ParseLinkRules(linkRules))
+        self._linkRules = linkRules
+        self._useLinkTable = linkTable
+        
+        self._compressionLevel = compressionLevel
+        self._bufferSize = bufferSize
+        stem = os.path.splitext(filePath[:-3] if filePath.lower().endswith('.gz') else filePath)[0]
+        self._meshDirectory = stem + '_models'
+        if tileSize:
+            # stage.xcd becomes the index stage.xcdt and one stage.<x>_<y>.xcd per tile
+            self._tiles = {}
+            self._tileStem = stem
+            self._tileExtension = '.xcd.gz' if compressionLevel else '.xcd'
+            self._fileName = self._tileStem + '.xcdt'
+            writer = None
+        else:
+            self._file = self._OpenStage(filePath)
+            self._fileName = self._file.name
+            self._filePath = os.path.basename(self._fileName)
+            writer = XCDBufferedWriter(self._file, bufferSize)
         self._globalMatrix = globalMatrix
         
+        if binaryPath:
+            self._binary = XCDBinaryWriter(binarySections)
+            self._binaryPath = binaryPath
+        
+        # Tiles bring their own writer and link table, they are set when a tile is selected
+        self._stage = XCDStageWriter(writer, self._binary, self._log, instancing, compact, flatten,
+                                     LinkTable() if linkTable and not tileSize else None, rotationEncoding)
+        
+        if cachePath:
+            if self._binary:
+                # The binary model is built from the live objects, cached fragments can not feed it
+                self._log.Warning('export cache is not used together with binary output')
+            else:
+                self._cache = XCDExportCache(cachePath, self._CacheSettings(), self._log)
+                self._libraryTimes = {}
+        
+    def Close(self):
+        if self._tiles is not None:
+            for tile in self._tiles.values():
+                tile['writer'].Close()
+            if self._finished:
+                self._WriteTileIndex()
+            self._log.Info('wrote %d tiles', len(self._tiles))
+        else:
+            self._stage.writer.Close()
+            self._log.Info('flushed output in %d writes', self._stage.writer.writeCalls)
+        
+        if self._binary:
+            self._binary.Save(self._binaryPath)
+            self._log.Info('wrote binary stage to %r', self._binaryPath)
+        
+        if self._meshFiles:
+            self._log.Info('wrote %d meshes to %r', len(self._meshFiles), self._meshDirectory)
+        
+        if self._batchList is not None:
+            self._log.Info('batched %d draw calls into %d batches, %d draw calls -> %d', self._batchedDrawCalls, len(self._batchList),
+                           self._drawCalls, self._drawCalls - self._batchedDrawCalls + len(self._batchList))
+        
+        if self._cache and self._finished:
+            self._cache.Save()
+            self._log.Info('export cache %d reused, %d exported', self._cache.hits, self._cache.misses)
+        
+        self._log.Close()
+        
     # -----------------------------------------------------------------------------
     # Main export function
     # -----------------------------------------------------------------------------
@@ -55,9 +231,11 @@ class XCDExporter:
         bpy.data.materials.tag(False)
         bpy.data.images.tag(False)
     
-        self._p('Info: starting XCD export to %r...' % self._fileName)
-        self._WriteHeader()
-        self._WriteFog(scene.world)
+        self._log.Info('starting XCD %s export to %r...', VERSION, self._fileName)
+        self._world = scene.world
+        if not self._tileSize:
+            self._WriteHeader()
+            self._WriteFog(self._world)
     
         if useSelection:
             objects = [obj for obj in scene.objects if obj.is_visible(scene) and obj.select]
@@ -65,12 +243,30 @@ class XCDExporter:
             objects = [obj for obj in scene.objects if obj.is_visible(scene)]
     
         hierarchy = self._BuildHierarchy(objects)
-        self._p(hierarchy)
-        for object, children in hierarchy:
-            self._ExportObject(scene, object, children)
+        self._log.Debug('%s', hierarchy)
+        if HAS_NUMPY:
+            self._transforms = self._GatherTransforms(scene, objects, 'matrix_local')
+            if self._flatten:
+                self._worldTransforms = self._GatherTransforms(scene, objects, 'matrix_world')
+        if self._worldBounds:
+            self._ComputeWorldBounds(scene, hierarchy)
+        if self._bvh:
+            self._ExportSpatial(scene, hierarchy)
+        else:
+            WalkHierarchy(hierarchy, lambda object, depth: self._ExportObject(scene, object, depth))
+        if self._batches is not None:
+            self._SaveBatches()
     
-        self._WriteFooter()
-        self._p('Info: finished XCD export')
+        if self._tileSize:
+            for key in sorted(self._tiles.keys()):
+                self._SelectTile(key)
+                self._WriteFooter()
+        else:
+            self._WriteFooter()
+        self._finished = True
+        if self._groupTemplates:
+            self._log.Info('%d group instances reused the derived objects of %d groups', self._groupHits, len(self._groupTemplates))
+        self._log.Info('finished XCD export')
         
     # -------------------------------------------------------------------------
     # Misc helper functions
@@ -81,11 +277,39 @@ class XCDExporter:
     def _MatrixNegateZ(self, matrix):
         return (matrix.to_3x3() * mathutils.Vector((0.0, 0.0, -1.0))).normalized()[:]
     
-    def _GzipOpenUtf8(self, filePath, mode):
+    def _LocalTransform(self, obj):
+        """(translation, rotation, scale, direction, 3x4 rows) of the local matrix, from the bulk pre-pass if it covered obj"""
+        transform = self._transforms.get(obj)
+        if transform is None:
+            transform = self._DecomposeMatrix(obj.matrix_local)
+        return transform
+    
+    def _WorldTransform(self, obj, matrix=None):
+        """Same as _LocalTransform for the world matrix of obj, matrix replaces it for derived objects"""
+        if matrix is None:
+            transform = self._worldTransforms.get(obj)
+            if transform is not None:
+                return transform
+            matrix = obj.matrix_world
+        return self._DecomposeMatrix(matrix)
+    
+    def _DecomposeMatrix(self, matrix):
+        location, rotation, scale = matrix.decompose()
+        rotation.normalize()
+        if rotation.w < 0.0:
+            rotation.negate()
+        return (location[:], rotation[:], scale[:], self._MatrixNegateZ(matrix), sum([row[:] for row in matrix[:3]], ()))
+    
+    def _OpenStage(self, filePath):
+        if self._compressionLevel:
+            return self._GzipOpenUtf8(filePath, 'wb', self._compressionLevel)
+        return open(filePath, 'w', encoding='utf-8')
+    
+    def _GzipOpenUtf8(self, filePath, mode, compressionLevel=9):
         """Workaround for py3k only allowing binary gzip writing"""
         
         # need to investigate encoding
-        file = gzip.open(filePath, mode)
+        file = gzip.open(filePath, mode, compressionLevel)
         write_real = file.write
     
         def write_wrap(data):
@@ -97,173 +321,113 @@ class XCDExporter:
     
     def _BuildHierarchy(self, objects):
         """ returns parent child relationships, skipping """
-        objectSet = set(objects)
-        parentLookup = {}
-    
-        def testParent(parent):
-            while (parent is not None) and (parent not in objectSet):
-                parent = parent.parent
-            return parent
-    
-        for obj in objects:
-            self._p('Info: TestParent: %s' % obj.name)
-            parentLookup.setdefault(testParent(obj.parent), []).append((obj, []))
+        if self._log.debugEnabled:
+            for obj in objects:
+                self._log.Debug('Info: TestParent: %s', obj.name)
+                
+        return BuildHierarchy(objects)
     
-        for parent, children in parentLookup.items():
-            for obj, subchildren in children:
-                subchildren[:] = parentLookup.get(obj, [])
+    def _ObjectKey(self, obj):
+        return (obj.library.filepath if obj.library else '', obj.name)
     
-        return parentLookup.get(None, [])
+    def _UniqueName(self, obj, cacheName):
+        key = self._ObjectKey(obj)
+        name = self._ids[cacheName].Allocate(key, obj.name)
+        if self._cacheNames is not None:
+            self._cacheNames.append([cacheName, list(key), name])
+            if self._integerIds:
+                self._cacheNames.append(['uid', [cacheName] + list(key), self._ids[cacheName].Index(key)])
+        return name
     
-    def _Clean(self, text):
-        if not text:
-            text = "None"
-            
-        # no digit start
-        if text[0] in "1234567890+-":
-            text = "_" + text
-            
-        return text.translate({  # control characters 0x0-0x1f
-                            # 0x00: "_",
-                              0x01: "_",
-                              0x02: "_",
-                              0x03: "_",
-                              0x04: "_",
-                              0x05: "_",
-                              0x06: "_",
-                              0x07: "_",
-                              0x08: "_",
-                              0x09: "_",
-                              0x0a: "_",
-                              0x0b: "_",
-                              0x0c: "_",
-                              0x0d: "_",
-                              0x0e: "_",
-                              0x0f: "_",
-                              0x10: "_",
-                              0x11: "_",
-                              0x12: "_",
-                              0x13: "_",
-                              0x14: "_",
-                              0x15: "_",
-                              0x16: "_",
-                              0x17: "_",
-                              0x18: "_",
-                              0x19: "_",
-                              0x1a: "_",
-                              0x1b: "_",
-                              0x1c: "_",
-                              0x1d: "_",
-                              0x1e: "_",
-                              0x1f: "_",
-    
-                              0x7f: "_",  # 127
-    
-                              0x20: "_",  # space
-                              0x22: "_",  # "
-                              0x27: "_",  # '
-                              0x23: "_",  # #
-                              0x2c: "_",  # ,
-                              0x2e: "_",  # .
-                              0x5b: "_",  # [
-                              0x5d: "_",  # ]
-                              0x5c: "_",  # \
-                              0x7b: "_",  # {
-                              0x7d: "_",  # }
-                              })
-
-    def _GetDebugIndent(self):
-        indent = ""
-        for i in range(0, self._debugIndent):
-            indent = indent + " -- "
-        return indent
+    def _Uid(self, obj, cacheName):
+        """Integer id of an object named by _UniqueName before, None without integer ids"""
+        if not self._integerIds:
+            return None
+        return self._ids[cacheName].Index(self._ObjectKey(obj))
 
     def _dump(self, obj):
         for attr in dir(obj):
             try:
-                self._p("obj.%s = %s" % (attr, getattr(obj, attr)))
+                self._log.Debug("obj.%s = %s", attr, getattr(obj, attr))
             except:
-                self._p("Could not get attribute for %s " % attr)
-    
-    def _p(self, m):
-        print("%s %s" % (self._GetDebugIndent(), m))
+                self._log.Debug("Could not get attribute for %s ", attr)
     
     # -------------------------------------------------------------------------
     # File Writing Functions
     # -------------------------------------------------------------------------
-    def _RotationToData(self, source, mode):
+    def _RotationToValues(self, source, mode):
         if mode == "AXIS_ANGLE":
-            self._p("Rot: Axis Angle ")
-            return "%d %f %f %f %f" % (1, source.rotation_axis_angle[0], source.rotation_axis_angle[1], source.rotation_axis_angle[2], source.rotation_axis_angle[3])
+            self._log.Debug("Rot: Axis Angle ")
+            return (1, source.rotation_axis_angle[0], source.rotation_axis_angle[1], source.rotation_axis_angle[2], source.rotation_axis_angle[3])
         
         if mode == "XYZ":
-            self._p("Rot: XYZ ")
-            return "%d %f %f %f %f" % (2, source.rotation_euler.x, source.rotation_euler.y, source.rotation_euler.z, 1)
+            self._log.Debug("Rot: XYZ ")
+            return (2, source.rotation_euler.x, source.rotation_euler.y, source.rotation_euler.z, 1)
         
         if mode == "QUATERNION":
-            self._p("Rot: Quaternion")
-            return "%d %f %f %f %f" % (3, source.rotation_quaternion[0], source.rotation_quaternion[1], source.rotation_quaternion[2], source.rotation_quaternion[3])
+            self._log.Debug("Rot: Quaternion")
+            return (3, source.rotation_quaternion[0], source.rotation_quaternion[1], source.rotation_quaternion[2], source.rotation_quaternion[3])
+        
+        if mode in ("XZY", "YXZ", "YZX", "ZXY", "ZYX"):
+            # Only XYZ has a tag of its own, the euler carries its order into the conversion
+            self._log.Debug("Rot: %s as Quaternion", mode)
+            return (3,) + source.rotation_euler.to_quaternion()[:]
             
-        self._p("ERROR: Rotation mode unknown " + mode)
+        self._log.Error("Rotation mode unknown %s", mode)
         return None
-
-    def _WriteHeader(self):
-        blenderVersion = quoteattr('Blender %s' % bpy.app.version_string)
     
-        self._fileWriter('<?xml version="1.0" encoding="UTF-8"?><xcd version="1.0">')
-        self._fileWriter('<head>')
-        self._fileWriter('<meta name="filename" content=%s />' % self._filePath)
-        self._fileWriter('<meta name="generator" content=%s />' % blenderVersion)
-        self._fileWriter('</head><scene>')
+    def _Rotation(self, obj, transform):
+        """Rotation values of obj in the configured encoding, the mode tag first.
+           Baked transforms have no rotation mode, they are written as quaternion in MODE"""
+        if self._rotationEncoding == 'MATRIX':
+            # Tag 4 holds the 3x4 matrix rows, translation and scale included
+            return (4,) + transform[4]
+        if self._rotationEncoding == 'QUATERNION' or obj is None:
+            return (3,) + transform[1]
+        return self._RotationToValues(obj, obj.rotation_mode)
+    
+    def _WriteHeader(self):
+        self._stage.WriteHeader(self._filePath, 'Blender %s' % bpy.app.version_string)
     
     def _WriteFooter(self):
-        self._fileWriter('</scene></xcd>')
+        batches = self._TileBatches() if self._batchList else None
+        self._stage.WriteFooter(batches, self._bvhNodes)
     
     def _WriteCamera(self, obj):
-        self._p("Writing camera %s" % obj.name)
-        
-        id = quoteattr(unique_name(obj, obj.name, self._uuidCacheView, clean_func=self._Clean, sep="_"))
-        location, rotation, scale = obj.matrix_local.decompose()
-        self._p(rotation)
-        self._fileWriter('<camera id=%s' % id)
-        self._fileWriter(' fov="%.3f"' % obj.data.angle)
-        self._fileWriter('>')
-        
-        self._fileWriter('<position>%3.2f %3.2f %3.2f</position>' % location[:])
-        self._fileWriter('<rotation>%s</rotation>' % self._RotationToData(obj, obj.rotation_mode))
-        
-        self._WriteLayers(obj.layers)
-        self._WriteCustomProperties(obj)
+        self._log.Debug("Writing camera %s", obj.name)
         
-        self._fileWriter('</camera>')
+        name = self._UniqueName(obj, 'view')
+        transform = self._LocalTransform(obj)
+        rotationValues = self._Rotation(obj, transform)
+        self._log.Debug("%s", rotationValues)
+        self._stage.WriteCamera(name, obj.data.angle, transform[0], rotationValues, obj.layers,
+                                self._GetCustomProperties(obj), self._Uid(obj, 'view'), transform[1])
                 
-    def _BeginStageElement(self, obj, link = None):
-        id = quoteattr(unique_name(obj, obj.name, self._uuidCacheObjects, clean_func=self._Clean, sep="_"))
-        self._p("Writing stage element %s as %s" % (obj.name, id))
+    def _BeginStageElement(self, obj, link = None, worldBounds = None, lods = None, world = None, static = None):
+        """world is the decomposed world transform to write instead of the local one. static defaults
+           to obj not being dynamic, derived objects pass the state of the object instancing them"""
+        name = self._UniqueName(obj, 'objects')
+        self._log.Debug("Writing stage element %s as %s", obj.name, name)
         
-        location, rotation, scale = obj.matrix_local.decompose()
+        transform = self._LocalTransform(obj) if world is None else world
+        location, rotation, scale, direction, rows = transform
+        rotationValues = self._Rotation(obj if world is None else None, transform)
                 
-        self._fileWriter('<element id=%s' % id)
         if link:
-            link = link.replace("//", "").replace(".blend", ".dae")
-            # Todo: This is a hack to deal with different source roots, need to refactor
-            link = link.replace("General.Source", "General.Intermediate")
-            self._fileWriter(' link="%s"' % link)
-        self._fileWriter('>')
-        
-        self._fileWriter('<translation>%.6f %.6f %.6f</translation>' % location[:])
-        self._fileWriter('<rotation>%s</rotation>' % self._RotationToData(obj, obj.rotation_mode))
-        self._fileWriter('<scale>%.6f %.6f %.6f</scale>' % scale[:])
-        
-        self._WriteBoundingBox(obj.bound_box)
-        self._WriteLayers(obj.layers)
-        self._WriteCustomProperties(obj)
+            link = self._linkResolver.Resolve(link)
+            if self._tile:
+                self._AddTileLink(link)
+        
+        self._stage.BeginElement(name, link, location, rotationValues, scale, obj.bound_box, obj.layers,
+                                 self._GetCustomProperties(obj), worldBounds, lods,
+                                 not self._IsDynamic(obj) if static is None else static,
+                                 self._Uid(obj, 'objects'), rotation)
 
     def _EndStageElement(self):
-        self._fileWriter('</element>')
+        self._stage.EndElement()
     
     def _WriteFog(self, world):
-        self._p("Writing fog")
+        self._log.Debug("Writing fog")
         
         if world:
             mtype = world.mist_settings.falloff
@@ -272,141 +436,56 @@ class XCDExporter:
             return
     
         if mparam.use_mist:
-            self._fileWriter('<fog type="%s"' % ('LINEAR' if (mtype == 'LINEAR') else 'EXPONENTIAL'))
-            self._fileWriter(' depth="%.3f"' % mparam.depth)
-            self._fileWriter('>')
-            
-            self._fileWriter('<color>%.3f %.3f %.3f</color>' % self._ClampColor(world.horizon_color))
-            
-            self._fileWriter('</fog>')
+            fogType = 'LINEAR' if (mtype == 'LINEAR') else 'EXPONENTIAL'
+            self._stage.WriteFog(fogType, mparam.depth, self._ClampColor(world.horizon_color))
         else:
             return
     
     def _WriteSpotLight(self, obj):
-        self._p("Writing spot light %s" % obj.name)
+        self._log.Debug("Writing spot light %s", obj.name)
         lamp = obj.data
         
-        id = quoteattr(unique_name(obj, obj.name, self._uuidCacheLights, clean_func=self._Clean, sep="_"))
+        name = self._UniqueName(obj, 'lights')
         
         # compute cutoff and beam width
         intensity = min(lamp.energy / 1.75, 1.0)
         spotSize = lamp.spot_size * 0.37
         angle = spotSize * 1.3
-        orientation = self._MatrixNegateZ(obj.matrix_local)
-        location = obj.matrix_local.to_translation()[:]
+        location, rotation, scale, orientation, rows = self._LocalTransform(obj)
         radius = lamp.distance * math.cos(spotSize)
     
-        self._fileWriter('<light type="Spot" id=%s' % id)
-        self._fileWriter(' radius="%.4f"' % radius)
-        self._fileWriter(' intensity="%.4f"' % intensity)        
-        self._fileWriter(' spotsize="%.4f"' % spotSize)
-        self._fileWriter(' angle="%.4f"' % angle)        
-        self._fileWriter('>')
-        
-        self._fileWriter('<color>%.4f %.4f %.4f</color>' % self._ClampColor(lamp.color))
-        self._fileWriter('<direction>%.4f %.4f %.4f</direction>' % orientation)
-        self._fileWriter('<location>%.4f %.4f %.4f</location>' % location)
-        
-        self._WriteLayers(obj.layers)
-        self._WriteCustomProperties(obj)
-        
-        self._fileWriter('</light>')
+        self._stage.WriteLight('Spot', name, self._ClampColor(lamp.color), intensity, radius, spotSize, angle,
+                               orientation, location, obj.layers, self._GetCustomProperties(obj), self._Uid(obj, 'lights'))
         
     
     def _WriteDirectionalLight(self, obj):
-        self._p("Writing directional light %s" % obj.name)
+        self._log.Debug("Writing directional light %s", obj.name)
         lamp = obj.data
         
-        id = quoteattr(unique_name(obj, obj.name, self._uuidCacheLights, clean_func=self._Clean, sep="_"))
+        name = self._UniqueName(obj, 'lights')
         
         intensity = min(lamp.energy / 1.75, 1.0)
-        orientation = self._MatrixNegateZ(obj.matrix_local)
+        orientation = self._LocalTransform(obj)[3]
     
-        self._fileWriter('<light type="Directional" id=%s' % id)
-        self._fileWriter(' intensity="%.4f"' % intensity)        
-        self._fileWriter('>')
-        
-        self._fileWriter('<color>%.4f %.4f %.4f</color>' % self._ClampColor(lamp.color))
-        self._fileWriter('<direction>%.4f %.4f %.4f</direction>' % orientation)
-        
-        self._WriteLayers(obj.layers)
-        self._WriteCustomProperties(obj)
-        
-        self._fileWriter('</light>')
+        self._stage.WriteLight('Directional', name, self._ClampColor(lamp.color), intensity, 0.0, 0.0, 0.0,
+                               orientation, (0.0, 0.0, 0.0), obj.layers, self._GetCustomProperties(obj),
+                               self._Uid(obj, 'lights'))
     
     def _WritePointLight(self, obj):
-        self._p("Writing point light %s" % obj.name)
+        self._log.Debug("Writing point light %s", obj.name)
         lamp = obj.data
         
-        id = quoteattr(unique_name(obj, obj.name, self._uuidCacheLights, clean_func=self._Clean, sep="_"))
+        name = self._UniqueName(obj, 'lights')
 
         intensity = min(lamp.energy / 1.75, 1.0)
-        location = obj.matrix_local.to_translation()[:]
+        location = self._LocalTransform(obj)[0]
     
-        self._fileWriter('<light type="Point" id=%s' % id)     
-        self._fileWriter(' intensity="%.4f"' % intensity)
-        self._fileWriter(' radius="%.4f"' % lamp.distance)        
-        self._fileWriter('>')
-        
-        self._fileWriter('<color>%.4f %.4f %.4f</color>' % self._ClampColor(lamp.color))
-        self._fileWriter('<location>%.4f %.4f %.4f</location>' % location)
-        
-        self._WriteLayers(obj.layers)
-        self._WriteCustomProperties(obj)
-        
-        self._fileWriter('</light>')
-        
-    def _WriteValueArray(self, values):
-        needSpace = False
-        for entry in values:
-            if needSpace:
-                self._fileWriter(' ')
-            self._fileWriter(str(entry))
-            needSpace = True
-            
-    def _WriteBoolValueArray(self, values):
-        needSpace = False
-        for entry in values:
-            if needSpace:
-                self._fileWriter(' ')
-            if entry:
-                self._fileWriter(str(1))
-            else:
-                self._fileWriter(str(0))
-            needSpace = True
-            
-    def _WriteBoundingBox(self, boundingBox):
-        self._fileWriter('<boundingBox>')
-        for element in boundingBox:
-            self._fileWriter('<point>')
-            self._WriteValueArray(element)
-            self._fileWriter('</point>')
-        self._fileWriter('</boundingBox>')
-            
-    def _WriteLayers(self, layerInfo):
-        self._fileWriter('<layers>')
-        self._WriteBoolValueArray(layerInfo)
-        self._fileWriter('</layers>')
-        
-    def _WriteCustomProperty(self, name, property):
-        self._fileWriter('<property id="%s"' % name)
-        if isinstance(property, float):
-            self._fileWriter(' type="Float" Value="%s"' % property.real)
-        elif isinstance(property, int):
-            self._fileWriter(' type="Int" Value="%s"' % property)
-        elif isinstance(property, str):
-            self._fileWriter(' type="String" Value="%s"' % property)
-        else:
-            self._p("Uknown type for custom property %s" % name)
-        self._fileWriter('/>')
+        self._stage.WriteLight('Point', name, self._ClampColor(lamp.color), intensity, lamp.distance, 0.0, 0.0,
+                               (0.0, 0.0, 0.0), location, obj.layers, self._GetCustomProperties(obj),
+                               self._Uid(obj, 'lights'))
         
-    def _WriteCustomProperties(self, hash):
-        self._fileWriter('<customproperties>')
-        for key in hash.keys():
-            if key[0] == "_":
-                continue
-            self._WriteCustomProperty(key, hash[key])
-        self._fileWriter('</customproperties>')
+    def _GetCustomProperties(self, hash):
+        return [(key, hash[key]) for key in hash.keys() if key[0] != "_"]
         
     def _GetCustomPropertyValue(self, hash, property):
         for key in hash.keys():
@@ -415,19 +494,63 @@ class XCDExporter:
             return hash[key]
         
     # -------------------------------------------------------------------------
-    # Export Object Hierarchy (recursively called)
+    # Export Object Hierarchy (called by WalkHierarchy, parents before children)
     # -------------------------------------------------------------------------
-    def _ExportObject(self, scene, object, children):        
-        self._p("-> Exporting %s" % object.name)
-        self._p(" ROT: %s" % object.rotation_quaternion)
+    def _ExportObject(self, scene, object, depth):
+        """Exports one object, returns False if its children should be skipped"""
+        self._log.indent = depth
+        if self._tileSize and self._IsWritten(object):
+            tile = self._SelectTile(self._TileOf(object))
+            tile['objects'] += 1
+            tile['bounds'] = MergeBounds(tile['bounds'], self._ownBounds.get(object))
+        
+        if self._log.debugEnabled:
+            self._log.Debug("-> Exporting %s", object.name)
+            self._log.Debug(" ROT: %s", object.rotation_quaternion)
+        
+        if self._log.traceEnabled:
+            start = time.perf_counter()
+        
+        # Mesh files are written as a side effect, the digest does not cover the geometry. Without
+        # mesh export a mesh writes nothing and, in tiled stages, has no tile to capture from
+        self._lastCached = False
+        if self._cache and object.type != 'MESH':
+            exported = self._ExportObjectCached(scene, object)
+        else:
+            exported = self._ExportObjectData(scene, object)
+            
+        if self._log.traceEnabled:
+            self._log.Trace(object=object.name, type=object.type,
+                            parent=object.parent.name if object.parent else None,
+                            exported=exported, cached=self._lastCached,
+                            seconds=time.perf_counter() - start)
+            
+        return exported
+
+    def _ExportObjectData(self, scene, object):
+        """Writes the object itself without its children, returns False if the object is skipped"""
         objectType = object.type
         
         if objectType == 'CAMERA':
             self._WriteCamera(object)
                 
         elif objectType == 'MESH':
-            self._p("Ignoring mesh %s, currently not supported by xcd" % object.name)
-            return
+            if not self._meshes:
+                self._log.Debug("Ignoring mesh %s, mesh export is disabled", object.name)
+                return False
+            
+            world = self._BakedTransform(object)
+            model = None
+            if self._batches is not None and self._CanBatch(object):
+                # Evaluated once, a mesh too large for a batch is written from the same model
+                model = self._EvaluateMesh(scene, object)
+            if model is not None and self._BatchMesh(object, model):
+                # The geometry is drawn by the batch, the element stays for picking and scene logic
+                self._BeginStageElement(object, None, self._bounds.get(object), world=world)
+            else:
+                link, lods = self._WriteMesh(scene, object, model)
+                self._BeginStageElement(object, link, self._bounds.get(object), lods, world)
+            self._EndStageElement()
 
         elif objectType == 'LAMP':
             data = object.data
@@ -440,89 +563,625 @@ class XCDExporter:
                 self._WriteDirectionalLight(object)
             else:
                 self._WriteDirectionalLight(object)
+        elif self._IsTransformOnly(object):
+            # Nothing but a placement, its derived elements take over the baked transform
+            self._log.Debug("Collapsing %s", object.name)
+            self._ExportDerived(scene, object)
         else:
-            self._BeginStageElement(object, None)
+            self._BeginStageElement(object, None, self._bounds.get(object), world=self._BakedTransform(object))
             self._ExportDerived(scene, object)
             self._EndStageElement()
-                           
-        for child, objectChildren in children:
-            self._p(" CHILD: %s" % child.name)
-            self._debugIndent = self._debugIndent + 1
-            self._ExportObject(scene, child, objectChildren)
-            self._debugIndent = self._debugIndent - 1
+            
+        return True
 
-    def _ExportDerived(self, scene, object):
-        free, derived = create_derived_objects(scene, object)
-        if derived:
-            prefabNodes = {}
-            meshNodes = {}
-                        
+    # -------------------------------------------------------------------------
+    # Flattening, static elements carry their world transform so the engine
+    # does not compose parent and child transforms. Static empties holding
+    # nothing but a placement are not written, the elements of their group
+    # move up a level. Dynamic objects and everything below them stay as is.
+    # -------------------------------------------------------------------------
+    def _IsDynamic(self, object):
+        dynamic = self._dynamic.get(object)
+        if dynamic is None:
+            dynamic = bool(object.get(DYNAMIC_PROPERTY)) or (object.parent is not None and self._IsDynamic(object.parent))
+            self._dynamic[object] = dynamic
+        return dynamic
+    
+    def _BakedTransform(self, object):
+        if not self._flatten:
+            return None
+        # A dynamic object below a collapsed empty has no parent element to be relative to
+        if self._IsDynamic(object) and not (object.parent is not None and self._IsTransformOnly(object.parent)):
+            return None
+        return self._WorldTransform(object)
+    
+    def _IsTransformOnly(self, object):
+        return (self._flatten and object.type == 'EMPTY' and not self._IsDynamic(object) and
+                not self._GetCustomProperties(object))
+    
+    def _IsWritten(self, object):
+        """Meshes are only written with mesh export enabled, their children are skipped together with them"""
+        return object.type != 'MESH' or self._meshes
+    
+    # -------------------------------------------------------------------------
+    # Native meshes, each mesh is written once into a .xcdm model next to the
+    # stage and linked from every element using it. Coarser levels of detail
+    # go into <name>.lod<n>.xcdm and are listed in the model and the element.
+    # -------------------------------------------------------------------------
+    def _WriteMesh(self, scene, object, model=None):
+        """Returns the link of the model holding the mesh of object and the (screen size, link) of its lods.
+           model is the evaluated mesh if the caller has it already"""
+        mesh = object.data
+        # Modifiers make the evaluated mesh specific to the object
+        key = (mesh.library.filepath if mesh.library else '', mesh.name, object.name if object.modifiers else None)
+        if key in self._meshFiles:
+            self._drawCalls += self._meshDrawCalls[key]
+            return self._MeshLink(self._meshFiles.Get(key)), self._meshLODs[key]
+        
+        name = self._meshFiles.Allocate(key, '%s.%s' % (object.name, mesh.name) if object.modifiers else mesh.name)
+        if model is None:
+            model = self._EvaluateMesh(scene, object)
+        self._meshDrawCalls[key] = len(model['submeshes'])
+        self._drawCalls += self._meshDrawCalls[key]
+        
+        if not os.path.isdir(self._meshDirectory):
+            os.makedirs(self._meshDirectory)
+        
+        # Levels are simplified from the unoptimized model, each level is optimized on its own
+        lods = []
+        if self._lodRatios:
+            for level, (ratio, screenSize, lodModel) in enumerate(BuildLODChain(model, self._lodRatios)):
+                lodName = '%s.lod%d' % (name, level + 1)
+                self._SaveMesh(lodName, lodModel)
+                lods.append((screenSize, lodName))
+        
+        self._SaveMesh(name, model, [(screenSize, lodName + '.xcdm') for screenSize, lodName in lods])
+        self._meshLODs[key] = [(screenSize, self._MeshLink(lodName)) for screenSize, lodName in lods]
+        return self._MeshLink(name), self._meshLODs[key]
+    
+    def _EvaluateMesh(self, scene, object):
+        evaluated = object.to_mesh(scene, True, 'PREVIEW')
+        try:
+            self._Triangulate(evaluated)
+            return self._ExtractMesh(evaluated)
+        finally:
+            bpy.data.meshes.remove(evaluated)
+    
+    def _Triangulate(self, mesh):
+        """Splits quads and n-gons with blender, a fan from the first corner breaks concave polygons"""
+        if all([polygon.loop_total == 3 for polygon in mesh.polygons]):
+            return
+        
+        bm = bmesh.new()
+        try:
+            bm.from_mesh(mesh)
+            bmesh.ops.triangulate(bm, faces=[face for face in bm.faces if len(face.verts) > 3])
+            bm.to_mesh(mesh)
+        finally:
+            bm.free()
+    
+    def _MeshLink(self, name):
+        return '%s/%s.xcdm' % (os.path.basename(self._meshDirectory), name)
+    
+    def _SaveMesh(self, name, model, lods=None):
+        if self._meshOptimize != 'NONE':
+            before, after = OptimizeMesh(model, overdraw=self._meshOptimize == 'OVERDRAW')
+            self._log.Info('optimized mesh %s, ACMR %.3f -> %.3f, ATVR %.3f -> %.3f', name, before[0], after[0], before[1], after[1])
+            if self._log.traceEnabled:
+                self._log.Trace(mesh=name, acmr=[before[0], after[0]], atvr=[before[1], after[1]])
+        
+        flags = 0
+        if self._quantization:
+            flags, report = QuantizeFormat(model, *self._quantization)
+            if self._log.infoEnabled:
+                uvFlag = FORMAT_UV if model['uvs'] is not None else 0
+                self._log.Info('quantized mesh %s to %d bytes per vertex (from %d): %s', name, VertexSize(flags | uvFlag), VertexSize(uvFlag),
+                               ', '.join(['%s %s max error %g' % (attribute, encoding, error) for attribute, (encoding, error) in sorted(report.items())]))
+            if self._log.traceEnabled:
+                self._log.Trace(mesh=name, quantization=report)
+        
+        SaveMesh(os.path.join(self._meshDirectory, name + '.xcdm'), model, flags, lods)
+        self._log.Info('wrote mesh %s, %d vertices, %d triangles', name, len(model['positions']), IndexCount(model) // 3)
+    
+    def _ExtractMesh(self, mesh):
+        """Reads the mesh with bulk foreach_get calls into flat arrays"""
+        vertexCount = len(mesh.vertices)
+        loopCount = len(mesh.loops)
+        polygonCount = len(mesh.polygons)
+        
+        positions = array('f', [0.0]) * (vertexCount * 3)
+        normals = array('f', [0.0]) * (vertexCount * 3)
+        mesh.vertices.foreach_get('co', positions)
+        mesh.vertices.foreach_get('normal', normals)
+        
+        loopVertices = array('i', [0]) * loopCount
+        mesh.loops.foreach_get('vertex_index', loopVertices)
+        
+        loopStarts = array('i', [0]) * polygonCount
+        loopTotals = array('i', [0]) * polygonCount
+        materials = array('i', [0]) * polygonCount
+        smooth = [False] * polygonCount
+        polygonNormals = array('f', [0.0]) * (polygonCount * 3)
+        mesh.polygons.foreach_get('loop_start', loopStarts)
+        mesh.polygons.foreach_get('loop_total', loopTotals)
+        mesh.polygons.foreach_get('material_index', materials)
+        mesh.polygons.foreach_get('use_smooth', smooth)
+        mesh.polygons.foreach_get('normal', polygonNormals)
+        
+        loopUVs = None
+        if mesh.uv_layers.active is not None:
+            loopUVs = array('f', [0.0]) * (loopCount * 2)
+            mesh.uv_layers.active.data.foreach_get('uv', loopUVs)
+        
+        materialNames = [material.name if material else None for material in mesh.materials]
+        return BuildMesh(positions, normals, loopVertices, loopUVs, loopStarts, loopTotals,
+                         materials, smooth, polygonNormals, materialNames)
+    
+    # -------------------------------------------------------------------------
+    # Static batching, small meshes sharing a material within a cell (x / y
+    # plane, inside the current tile) are merged in world space and written
+    # as one model per batch. The ranges map index ranges back to elements.
+    # Batched meshes get no levels of detail.
+    # -------------------------------------------------------------------------
+    def _CanBatch(self, object):
+        """Dynamic meshes move on their own, meshes without bounds have no cell"""
+        return not self._IsDynamic(object) and self._bounds.get(object) is not None
+    
+    def _BatchMesh(self, object, model):
+        """Adds model, the evaluated mesh of object, to the batches, returns False if it is written on its own"""
+        if not self._batches.IsSmall(model) or not model['submeshes']:
+            return False
+        
+        key = (self._tile['key'] if self._tile else None, CellOf(self._ownBounds[object][2], self._batchSize))
+        matrix = [tuple(row) for row in object.matrix_world]
+        drawCalls = self._batches.Add(key, self._UniqueName(object, 'objects'), model, matrix)
+        self._drawCalls += drawCalls
+        self._batchedDrawCalls += drawCalls
+        return True
+    
+    def _SaveBatches(self):
+        self._batchList = self._batches.Build()
+        if self._batchList and not os.path.isdir(self._meshDirectory):
+            os.makedirs(self._meshDirectory)
+        
+        for index, batch in enumerate(self._batchList):
+            batch['name'] = 'batch.%d' % index
+            self._SaveMesh(batch['name'], batch['model'])
+            if self._log.traceEnabled:
+                self._log.Trace(batch=batch['name'], cell=batch['key'][1], material=batch['material'], elements=len(batch['elements']))
+    
+    def _TileBatches(self):
+        """(link, cell, material, ranges) of the batches in the selected tile, or the whole stage"""
+        tileKey = self._tile['key'] if self._tile else None
+        batches = []
+        for batch in self._batchList:
+            if batch['key'][0] != tileKey:
+                continue
+            
+            link = self._MeshLink(batch['name'])
+            if self._tile:
+                self._AddTileLink(link)
+            batches.append((link, batch['key'][1], batch['material'], Ranges(batch)))
+        return batches
+    
+    # -------------------------------------------------------------------------
+    # Incremental export, objects with an unchanged digest reuse their cached
+    # fragment instead of being written again
+    # -------------------------------------------------------------------------
+    def _CacheSettings(self):
+        return ['xcd 1.0', self._instancing, self._compact, self._worldBounds, bool(self._tileSize), self._meshes,
+                self._rotationEncoding, self._flatten, self._linkRules, self._useLinkTable, self._integerIds]
+    
+    def _ExportObjectCached(self, scene, object):
+        key = '%s|%s' % self._ObjectKey(object)
+        digest = self._ObjectDigest(object)
+        
+        cached = self._cache.Get(key, digest)
+        self._lastCached = cached is not None and self._RegisterCachedNames(cached[1])
+        if self._lastCached:
+            self._log.Debug("Reusing cached %s", object.name)
+            self._stage.writer.Write(cached[0])
+            return self._IsWritten(object)
+        
+        self._cacheNames = []
+        self._stage.cacheNames = self._cacheNames
+        self._stage.writer.BeginCapture()
+        exported = self._ExportObjectData(scene, object)
+        self._cache.Store(key, digest, self._stage.writer.EndCapture(), self._cacheNames)
+        self._cacheNames = None
+        self._stage.cacheNames = None
+        return exported
+    
+    def _RegisterCachedNames(self, names):
+        """Re-allocates the names and prototypes of a cached fragment, fails if the allocation would differ now"""
+        added = []
+        linkTable = self._stage.linkTable
+        prototypeCount = self._stage.PrototypeCount()
+        linkCount = len(linkTable) if linkTable is not None else 0
+        for cacheName, key, name in names:
+            if cacheName == 'links':
+                self._AddTileLink(key)
+                valid = True
+            elif cacheName == 'linktable':
+                valid = linkTable is not None and linkTable.Index(key) == name
+            elif cacheName == 'prototypes':
+                valid = self._stage.RegisterPrototype(key, name)
+            elif cacheName == 'uid':
+                valid = self._ids[key[0]].Index(tuple(key[1:])) == name
+            else:
+                ids = self._ids[cacheName]
+                key = tuple(key)
+                if key not in ids:
+                    added.append((ids, key))
+                valid = ids.Allocate(key, key[1]) == name
+                
+            if not valid:
+                for ids, key in reversed(added):
+                    ids.Remove(key)
+                self._stage.TruncatePrototypes(prototypeCount)
+                if linkTable is not None:
+                    linkTable.Truncate(linkCount)
+                return False
+        return True
+    
+    def _ObjectDigest(self, obj):
+        location, rotation, scale = obj.matrix_local.decompose()
+        values = [obj.name, obj.type, obj.parent.name if obj.parent else None,
+                  location[:], rotation[:], scale[:],
+                  obj.rotation_mode, obj.rotation_euler[:], obj.rotation_quaternion[:], obj.rotation_axis_angle[:],
+                  obj.layers[:], [point[:] for point in obj.bound_box],
+                  self._GetCustomProperties(obj),
+                  self._DataDigestValues(obj),
+                  self._LibraryDigestValues(obj)]
+        if self._worldBounds or self._flatten:
+            # Bounds and baked transforms follow every parent, the local values above do not
+            values.append([row[:] for row in obj.matrix_world])
+        if self._worldBounds:
+            # Bounds cover the children as well
+            values.append(self._bounds.get(obj))
+        if self._flatten:
+            # Dynamic is inherited and decides about the static flag and the baking, as does a collapsed parent
+            values.extend([self._IsDynamic(obj), obj.parent is not None and self._IsTransformOnly(obj.parent)])
+        return hashlib.sha1(repr(values).encode('utf-8')).hexdigest()
+    
+    def _DataDigestValues(self, obj):
+        data = obj.data
+        if data is None:
+            return None
+        
+        if obj.type == 'LAMP':
+            return (data.name, data.type, data.energy, data.color[:], data.distance, getattr(data, 'spot_size', None))
+        
+        if obj.type == 'CAMERA':
+            return (data.name, data.angle)
+        
+        return data.name
+    
+    def _LibraryDigestValues(self, obj, visited=()):
+        """Linked group objects change with their library file, local ones only change in this file
+           and are covered by their own values, nested groups included"""
+        if obj.dupli_type != 'GROUP' or obj.dupli_group is None:
+            return None
+        
+        group = obj.dupli_group
+        if group in visited:
+            return group.name
+        
+        objects = []
+        for groupObject in group.objects:
+            if groupObject.library:
+                objects.append((groupObject.name, groupObject.library.filepath))
+                continue
+            
+            location, rotation, scale = groupObject.matrix_local.decompose()
+            objects.append((groupObject.name, '', groupObject.type, groupObject.parent.name if groupObject.parent else None,
+                            location[:], rotation[:], scale[:], groupObject.dupli_type,
+                            self._GetCustomProperties(groupObject),
+                            self._DataDigestValues(groupObject),
+                            self._LibraryDigestValues(groupObject, visited + (group,))))
+        libraries = sorted(set([entry[1] for entry in objects if entry[1]]))
+        return (group.name, objects, [(filepath, self._LibraryModifiedTime(filepath)) for filepath in libraries])
+    
+    def _LibraryModifiedTime(self, filepath):
+        if filepath not in self._libraryTimes:
+            try:
+                self._libraryTimes[filepath] = os.path.getmtime(bpy.path.abspath(filepath))
+            except OSError:
+                self._libraryTimes[filepath] = None
+        return self._libraryTimes[filepath]
+        
+    # -------------------------------------------------------------------------
+    # World space bounds, computed for the whole hierarchy up front since a
+    # parent is written before the children that extend its bounds
+    # -------------------------------------------------------------------------
+    def _ComputeWorldBounds(self, scene, hierarchy):
+        builder = BoundsBuilder()
+        order = []
+        parents = {}
+        path = []
+        
+        def visit(object, depth):
+            del path[depth:]
+            parents[object] = path[-1] if path else None
+            path.append(object)
+            order.append(object)
+            
+            if object.type == 'MESH' and self._meshes:
+                builder.Add(object, object.bound_box, object.matrix_world)
+                return True
+            
+            if object.type in ('CAMERA', 'LAMP', 'MESH'):
+                return self._IsWritten(object)
+            
+            derived = self._GetDerived(scene, object)
+            self._derivedLists[object] = derived
             for derivedObject, derivedMatrix in derived:
-                if derivedObject == object:
-                    self._p("Derived is same!")
+                if derivedObject == object or derivedObject.type != 'MESH':
                     continue
                 
-                self._p(" DERIV: %s %s %s" % (derivedObject.name, derivedObject.library.filepath, derivedObject.type))
-                
-                file = derivedObject.library.filepath
-                
-                # check if this file is already registered as a mesh container
-                isPotentialPrefab = meshNodes.get(file) is None                
-                if isPotentialPrefab and not prefabNodes.get(file):
-                    prefabNodes[file] = True
+                # Elements written for the derived objects are linked per library file
+                file = derivedObject.library.filepath if derivedObject.library else ''
+                builder.Add(object, derivedObject.bound_box, derivedMatrix)
+                builder.Add((object, file), derivedObject.bound_box, derivedMatrix)
+            return True
+        
+        WalkHierarchy(hierarchy, visit)
+        self._ownBounds = builder.Build()
+        self._bounds = dict(self._ownBounds)
+        
+        # Children come after their parents in walk order, merge them upwards in reverse
+        for object in reversed(order):
+            bounds = self._bounds.get(object)
+            parent = parents[object]
+            if bounds is not None and parent is not None:
+                self._bounds[parent] = MergeBounds(self._bounds.get(parent), bounds)
+        
+        self._log.Info('computed world bounds of %d objects', len([object for object in order if object in self._bounds]))
+    
+    # -------------------------------------------------------------------------
+    # Spatial order, elements with world bounds are written in the leaf order
+    # of a bvh over their bounds. Leaves index the top level elements that carry
+    # world bounds, in the order they appear in the scene.
+    # -------------------------------------------------------------------------
+    def _ExportSpatial(self, scene, hierarchy):
+        walked = []
+        def visit(object, depth):
+            walked.append((object, depth))
+            return self._IsWritten(object)
+        
+        WalkHierarchy(hierarchy, visit)
+        bounded = [(object, depth) for object, depth in walked
+                   if object.type not in ('CAMERA', 'LAMP') and self._IsWritten(object) and self._bounds.get(object) is not None]
+        self._bvhNodes, order = BuildBVH([self._bounds[object][:2] for object, depth in bounded])
+        
+        # Everything without bounds keeps the hierarchy order in front of the spatially ordered elements
+        boundedObjects = set([object for object, depth in bounded])
+        for object, depth in walked:
+            if object not in boundedObjects:
+                self._ExportObject(scene, object, depth)
+        
+        for index in order:
+            object, depth = bounded[index]
+            self._ExportObject(scene, object, depth)
+        
+        self._log.Info('built bvh of %d nodes over %d elements', len(self._bvhNodes), len(bounded))
+    
+    # -------------------------------------------------------------------------
+    # Tiled export, every object goes into the grid cell (x / y plane) holding
+    # the center of its own world bounds, or its origin if it has none. Each tile
+    # is a complete stage, the index lists them with bounds, size and links.
+    # -------------------------------------------------------------------------
+    def _TileOf(self, object):
+        bounds = self._ownBounds.get(object)
+        point = bounds[2] if bounds is not None else object.matrix_world.to_translation()[:]
+        return int(math.floor(point[0] / self._tileSize)), int(math.floor(point[1] / self._tileSize))
+    
+    def _SelectTile(self, key):
+        tile = self._tiles.get(key)
+        isNew = tile is None
+        if isNew:
+            path = '%s.%d_%d%s' % (self._tileStem, key[0], key[1], self._tileExtension)
+            tile = {'key': key, 'path': path, 'writer': XCDBufferedWriter(self._OpenStage(path), self._bufferSize),
+                    'links': set(), 'bounds': None, 'objects': 0,
+                    'linkTable': LinkTable() if self._useLinkTable else None}
+            self._tiles[key] = tile
+        
+        self._tile = tile
+        self._stage.linkTable = tile['linkTable']
+        self._stage.writer = tile['writer']
+        self._filePath = os.path.basename(tile['path'])
+        if isNew:
+            self._WriteHeader()
+            self._WriteFog(self._world)
+        return tile
+    
+    def _AddTileLink(self, link):
+        self._tile['links'].add(link)
+        if self._cacheNames is not None:
+            self._cacheNames.append(['links', link, None])
+    
+    def _WriteTileIndex(self):
+        parts = ['<?xml version="1.0" encoding="UTF-8"?><xcdtiles version="1.0" cellSize="%f">' % self._tileSize]
+        for key in sorted(self._tiles.keys()):
+            tile = self._tiles[key]
+            x, y = key
+            parts.append('<tile x="%d" y="%d" file=%s bytes="%d" objects="%d">' %
+                         (x, y, quoteattr(os.path.basename(tile['path'])), os.path.getsize(tile['path']), tile['objects']))
+            parts.append('<cell>%f %f %f %f</cell>' % (x * self._tileSize, y * self._tileSize,
+                                                      (x + 1) * self._tileSize, (y + 1) * self._tileSize))
+            if tile['bounds'] is not None:
+                parts.append('<bounds><min>%.6f %.6f %.6f</min><max>%.6f %.6f %.6f</max></bounds>' % (tile['bounds'][0] + tile['bounds'][1]))
+            parts.append('<links>%s</links>' % ''.join(['<link>%s</link>' % escape(link) for link in sorted(tile['links'])]))
+            parts.append('</tile>')
+        parts.append('</xcdtiles>')
+        
+        with open(self._fileName, 'w', encoding='utf-8') as file:
+            file.write(''.join(parts))
+        self._log.Info('wrote tile index to %r', self._fileName)
+    
+    # -------------------------------------------------------------------------
+    # Local transforms of every exported object, read with one foreach_get
+    # and decomposed in one vectorized pass instead of per object mathutils
+    # calls. Objects outside the pass (derived objects) fall back to those.
+    # -------------------------------------------------------------------------
+    def _GatherTransforms(self, scene, objects, attribute):
+        """Returns a dict object -> decomposed matrix attribute of the exported objects"""
+        sceneObjects = scene.objects
+        matrices = array('f', [0.0]) * (len(sceneObjects) * 16)
+        try:
+            sceneObjects.foreach_get(attribute, matrices)
+        except (TypeError, RuntimeError):
+            self._log.Debug('bulk matrix access is not supported, decomposing per object')
+            return {}
+        
+        decomposed = list(zip(*DecomposeMatrices(MatricesFromColumns(matrices))))
+        exported = set(objects)
+        transforms = {}
+        for index, obj in enumerate(sceneObjects):
+            if obj in exported:
+                transforms[obj] = decomposed[index]
+        self._log.Info('decomposed %d %s matrices', len(transforms), attribute)
+        return transforms
+    
+    # -------------------------------------------------------------------------
+    # Derived objects of group instances. The dupli list of a group is only
+    # built for its first instance, later instances apply their own world
+    # matrix to the stored relative matrices. Which derived objects become
+    # elements and what they link to is decided once per group as well.
+    # -------------------------------------------------------------------------
+    def _GroupKey(self, object):
+        """Key of the dupli group instanced by object, None if object does not instance a group"""
+        group = object.dupli_group
+        if object.dupli_type != 'GROUP' or group is None:
+            return None
+        if object.parent and object.parent.dupli_type in ('VERTS', 'FACES'):
+            return None
+        return (group.library.filepath if group.library else '', group.name)
+    
+    def _GetDerived(self, scene, object):
+        """Derived objects with their world matrices, the dupli list is freed right away"""
+        derived = self._derivedLists.pop(object, None)
+        if derived is not None:
+            return derived
+        
+        key = self._GroupKey(object)
+        template = self._groupTemplates.get(key) if key is not None else None
+        if template is not None:
+            self._groupHits += 1
+            matrix = object.matrix_world
+            return [(derivedObject, matrix * relativeMatrix) for derivedObject, relativeMatrix in template]
+        
+        free, derived = create_derived_objects(scene, object)
+        derived = [(derivedObject, derivedMatrix.copy()) for derivedObject, derivedMatrix in derived or []]
+        if free:
+            free_derived_objects(object)
+        
+        if key is not None:
+            try:
+                inverse = object.matrix_world.inverted()
+            except ValueError:
+                # A degenerate instance can not provide the relative matrices
+                return derived
+            self._groupTemplates[key] = [(derivedObject, inverse * derivedMatrix) for derivedObject, derivedMatrix in derived]
+        return derived
+    
+    def _PlanDerived(self, object, derived):
+        """Returns [(index into derived, link)] of the derived objects written as elements"""
+        prefabNodes = {}
+        meshNodes = {}
                     
-                # if we have a mesh then this node is not part of a prefab
-                if derivedObject.type == "MESH":
-                    meshNodes[file] = True
-                    prefabNodes[file] = False
-                   
-            lastObject = None
-            allNodes = []
-            for derivedObject, derivedMatrix in reversed(derived):
-                if derivedObject == object:
-                    self._p("Derived is same!")
-                    continue
+        for derivedObject, derivedMatrix in derived:
+            if derivedObject == object:
+                self._log.Debug("Derived is same!")
+                continue
+            
+            if self._log.debugEnabled:
+                self._log.Debug(" DERIV: %s %s %s", derivedObject.name, derivedObject.library.filepath, derivedObject.type)
+            
+            file = derivedObject.library.filepath
+            
+            # check if this file is already registered as a mesh container
+            isPotentialPrefab = meshNodes.get(file) is None                
+            if isPotentialPrefab and not prefabNodes.get(file):
+                prefabNodes[file] = True
                 
-                file = derivedObject.library.filepath
+            # if we have a mesh then this node is not part of a prefab
+            if derivedObject.type == "MESH":
+                meshNodes[file] = True
+                prefabNodes[file] = False
+               
+        lastIndex = None
+        allNodes = []
+        for index in range(len(derived) - 1, -1, -1):
+            derivedObject = derived[index][0]
+            if derivedObject == object:
+                self._log.Debug("Derived is same!")
+                continue
+            
+            file = derivedObject.library.filepath
+            
+            if derivedObject.type == "EMPTY" and prefabNodes.get(file):
+                link = derived[lastIndex][0].library.filepath
+                allNodes.append((index, link))
+                self._log.Debug("Writing content into prefab node: %s %s", file, link)
                 
-                if derivedObject.type == "EMPTY" and prefabNodes.get(file):
-                    node = {}
-                    node["Data"] = derivedObject
-                    node["File"] = lastObject.library.filepath
-                    allNodes.append(node)
-                    print("Writing content into prefab node: %s %s" % (file, node["File"]))
-                    
-                lastObject = derivedObject
-                                
-            self._p(" Prefabs: ")
-            self._p(prefabNodes)
+            lastIndex = index
+                            
+        if self._log.debugEnabled:
+            self._log.Debug(" Prefabs: ")
+            self._log.Debug("%s", prefabNodes)
             
-            self._p(" Meshes: ")
-            self._p(meshNodes)
+            self._log.Debug(" Meshes: ")
+            self._log.Debug("%s", meshNodes)
             
-            self._p(" Nodes: ")
-            self._p(allNodes)
+            self._log.Debug(" Nodes: ")
+            self._log.Debug("%s", allNodes)
+        
+        if len(allNodes) <= 0 and lastIndex is not None:
+            return [(lastIndex, derived[lastIndex][0].library.filepath)]
+        return allNodes
+    
+    def _ExportDerived(self, scene, object):
+        derived = self._GetDerived(scene, object)
+        if derived:
+            key = self._GroupKey(object)
+            plan = self._derivedPlans.get(key) if key is not None else None
+            if plan is None:
+                plan = self._PlanDerived(object, derived)
+                if key is not None:
+                    self._derivedPlans[key] = plan
             
-            if len(allNodes) <= 0:
-                if lastObject:
-                    self._BeginStageElement(lastObject, lastObject.library.filepath)
-                    self._EndStageElement()
-                else:
-                    self._p("Warning: Nothing to export and no child nodes!");
+            if not plan:
+                self._log.Warning("Nothing to export and no child nodes!")
                 return
             
-            for entry in allNodes:
-                self._BeginStageElement(entry["Data"], entry["File"])
+            # Without an element of object around them the derived elements are placed in world space
+            collapsed = self._IsTransformOnly(object)
+            static = not self._IsDynamic(object)
+            for index, link in plan:
+                derivedObject, derivedMatrix = derived[index]
+                world = self._WorldTransform(derivedObject, derivedMatrix) if collapsed else None
+                self._BeginStageElement(derivedObject, link, self._bounds.get((object, link)), world=world, static=static)
                 self._EndStageElement()
-        if free:
-            free_derived_objects(object)
         
 
 ##########################################################
 # Callbacks, needed before Main
 ##########################################################
-def save(operator, context, filepath="", use_selection=False, global_matrix=None):
-    bpy.path.ensure_ext(filepath, '.xcd')
+def save(operator, context, filepath="", use_selection=False, global_matrix=None, buffer_size=DEFAULT_BUFFER_SIZE,
+         use_compression=False, compression_level=6, use_binary=False, binary_sections=set(), use_cache=False,
+         log_level=DEFAULT_LOG_LEVEL, trace_path="", use_instancing=False,
+         use_compact=False, use_world_bounds=False, use_bvh=False, tile_size=0.0,
+         use_meshes=False, mesh_optimize='CACHE', use_quantize=False, max_position_error=0.001,
+         max_normal_error=1.0, max_uv_error=0.001, lod_ratios="", batch_size=0.0,
+         rotation_encoding='MODE', use_flatten=False,
+         link_rules=DEFAULT_LINK_RULES, use_link_table=False, use_integer_ids=False):
+    if filepath.lower().endswith('.xcd.gz'):
+        use_compression = True
+    else:
+        filepath = bpy.path.ensure_ext(filepath, '.xcd')
+        if use_compression:
+            filepath = filepath + '.gz'
 
     if bpy.ops.object.mode_set.poll():
         bpy.ops.object.mode_set(mode='OBJECT')
@@ -530,7 +1189,25 @@ def save(operator, context, filepath="", use_selection=False, global_matrix=None
     if global_matrix is None:
         global_matrix = mathutils.Matrix()
         
-    exporter = XCDExporter(filepath, global_matrix)
-    exporter.Export(context.scene, useSelection=use_selection)
+    binaryPath = None
+    if use_binary:
+        binaryPath = os.path.splitext(filepath[:-3] if use_compression else filepath)[0] + '.xcdb'
+        
+    exporter = XCDExporter(filepath, global_matrix, bufferSize=buffer_size,
+                           compressionLevel=compression_level if use_compression else None,
+                           binaryPath=binaryPath, binarySections=SectionsFromNames(binary_sections),
+                           cachePath=filepath + '.cache' if use_cache else None,
+                           logLevel=log_level, tracePath=bpy.path.abspath(trace_path) if trace_path else None,
+                           instancing=use_instancing, compact=use_compact, worldBounds=use_world_bounds,
+                           bvh=use_bvh, tileSize=tile_size,
+                           meshes=use_meshes, meshOptimize=mesh_optimize,
+                           quantization=(max_position_error, max_normal_error, max_uv_error) if use_quantize else None,
+                           lodRatios=ParseRatios(lod_ratios), batchSize=batch_size,
+                           rotationEncoding=rotation_encoding, flatten=use_flatten,
+                           linkRules=link_rules, linkTable=use_link_table, integerIds=use_integer_ids)
+    try:
+        exporter.Export(context.scene, useSelection=use_selection)
+    finally:
+        exporter.Close()
 
     return {'FINISHED'}
@@ -0,0 +1,46 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+def BuildHierarchy(objects):
+    """ returns parent child relationships, skipping parents that are not exported.
+        Every ancestor is resolved once, so the build is linear in the number of objects """
+    objectSet = set(objects)
+    resolved = {}
+    parentLookup = {}
+
+    def testParent(parent):
+        path = []
+        while (parent is not None) and (parent not in objectSet):
+            if parent in resolved:
+                parent = resolved[parent]
+                break
+            path.append(parent)
+            parent = parent.parent
+
+        for skipped in path:
+            resolved[skipped] = parent
+        return parent
+
+    for obj in objects:
+        parentLookup.setdefault(testParent(obj.parent), []).append((obj, []))
+
+    for parent, children in parentLookup.items():
+        for obj, subchildren in children:
+            subchildren[:] = parentLookup.get(obj, [])
+
+    return parentLookup.get(None, [])
+
+def WalkHierarchy(hierarchy, visit):
+    """ depth first walk with an explicit stack, visits parents before their children in hierarchy order.
+        visit(object, depth) returns False to skip the children of object """
+    stack = [(entry, 0) for entry in reversed(hierarchy)]
+    while stack:
+        (obj, children), depth = stack.pop()
+        if not visit(obj, depth):
+            continue
+
+        for entry in reversed(children):
+            stack.append((entry, depth + 1))
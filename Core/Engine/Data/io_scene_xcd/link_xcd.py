@@ -0,0 +1,75 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import sys
+
+# -------------------------------------------------------------------------
+# Library links, rewritten from the .blend path blender reports to the
+# asset the engine loads by an ordered list of (from, to) replacements.
+# Rules are given as text, 'from=to' pairs separated by ';'.
+# -------------------------------------------------------------------------
+DEFAULT_LINK_RULES = '//=;.blend=.dae;General.Source=General.Intermediate'
+
+def ParseLinkRules(text):
+    rules = []
+    for entry in text.split(';'):
+        if not entry.strip():
+            continue
+        if '=' not in entry:
+            raise ValueError("link rule %r is not 'from=to'" % entry)
+        source, target = entry.split('=', 1)
+        rules.append((source, target))
+    return rules
+
+class LinkResolver:
+    """Applies the rules once per distinct path, every result is interned"""
+
+    _rules = None
+    _links = None
+
+    def __init__(self, rules):
+        self._rules = rules
+        self._links = {}
+
+    def Resolve(self, path):
+        link = self._links.get(path)
+        if link is None:
+            link = path
+            for source, target in self._rules:
+                link = link.replace(source, target)
+            link = sys.intern(link)
+            self._links[path] = link
+        return link
+
+class LinkTable:
+    """Index of every link written into a stage, elements reference the index"""
+
+    links = None
+    _lookup = None
+
+    def __init__(self):
+        self.links = []
+        self._lookup = {}
+
+    def __len__(self):
+        return len(self.links)
+
+    def Index(self, link):
+        index = self._lookup.get(link)
+        if index is None:
+            index = len(self.links)
+            self._lookup[link] = index
+            self.links.append(link)
+        return index
+
+    def Truncate(self, count):
+        """Forgets the links added after the first count, used when a cached fragment is rejected"""
+        for link in self.links[count:]:
+            del self._lookup[link]
+        del self.links[count:]
@@ -0,0 +1,299 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import heapq
+import math
+import sys
+
+# -------------------------------------------------------------------------
+# Level of detail generation for mesh models built by mesh_xcd.BuildMesh,
+# quadric error half edge collapse. A position only ever collapses onto one
+# of its neighbours, so every level reuses the vertices of the full mesh.
+# Positions split into several vertices take them along: each vertex maps to
+# the target vertex on the same side of the collapsed edge, or with the same
+# uv and the closest normal. uv seams only collapse along themselves, mesh
+# borders and material borders never move. Ties are broken by vertex index,
+# the result only depends on the input.
+# -------------------------------------------------------------------------
+DEFAULT_RATIOS = (0.5, 0.25, 0.125)
+
+_FLIP_LIMIT = 0.2
+
+# Weight of the planes keeping uv seams in line, relative to the surface planes
+_SEAM_WEIGHT = 10.0
+
+def ScreenSize(ratio):
+    """Screen size (fraction of the view height) below which a level keeping ratio of the triangles is used,
+       triangle density follows the projected area"""
+    return math.sqrt(ratio)
+
+def _Subtract(a, b):
+    return a[0] - b[0], a[1] - b[1], a[2] - b[2]
+
+def _Cross(a, b):
+    return a[1] * b[2] - a[2] * b[1], a[2] * b[0] - a[0] * b[2], a[0] * b[1] - a[1] * b[0]
+
+def _Normal(a, b, c):
+    return _Cross(_Subtract(b, a), _Subtract(c, a))
+
+def _Dot(a, b):
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+def _PlaneQuadric(a, b, c):
+    normal = _Normal(a, b, c)
+    area = math.sqrt(_Dot(normal, normal))
+    if area <= 0.0:
+        return [0.0] * 10
+    x, y, z = [value / area for value in normal]
+    d = -_Dot((x, y, z), a)
+    return [area * value for value in (x * x, x * y, x * z, x * d, y * y, y * z, y * d, z * z, z * d, d * d)]
+
+def _EdgeQuadric(a, b, faceNormal, weight):
+    """Plane through the edge a b standing upright on the face, moving off the edge costs"""
+    normal = _Cross(_Subtract(b, a), faceNormal)
+    length = math.sqrt(_Dot(normal, normal))
+    if length <= 0.0:
+        return [0.0] * 10
+    x, y, z = [value / length for value in normal]
+    d = -_Dot((x, y, z), a)
+    weight = weight * _Dot(_Subtract(b, a), _Subtract(b, a))
+    return [weight * value for value in (x * x, x * y, x * z, x * d, y * y, y * z, y * d, z * z, z * d, d * d)]
+
+def _QuadricError(q, p):
+    x, y, z = p
+    return (q[0] * x * x + 2 * q[1] * x * y + 2 * q[2] * x * z + 2 * q[3] * x +
+            q[4] * y * y + 2 * q[5] * y * z + 2 * q[6] * y +
+            q[7] * z * z + 2 * q[8] * z + q[9])
+
+def SimplifyMesh(mesh, ratio):
+    """Returns a copy of mesh keeping about ratio of its triangles, sharing the vertex streams of mesh"""
+    positions = mesh['positions']
+    normals = mesh['normals']
+    uvs = mesh['uvs']
+
+    # Weld vertices split by attributes back to positions
+    pointLookup = {}
+    vertexPoints = []
+    pointVertices = []
+    for position in positions:
+        point = pointLookup.get(position)
+        if point is None:
+            point = len(pointVertices)
+            pointLookup[position] = point
+            pointVertices.append([])
+        vertexPoints.append(point)
+        pointVertices[point].append(len(vertexPoints) - 1)
+    pointPositions = [positions[vertices[0]] for vertices in pointVertices]
+
+    def uv(vertex):
+        return uvs[vertex] if uvs is not None else None
+
+    triangles = []
+    triangleSubmeshes = []
+    pointSubmeshes = [set() for point in pointVertices]
+    for submesh, entry in enumerate(mesh['submeshes']):
+        indices = entry['indices']
+        for i in range(0, len(indices) - 2, 3):
+            triangles.append(list(indices[i:i + 3]))
+            triangleSubmeshes.append(submesh)
+            for index in indices[i:i + 3]:
+                pointSubmeshes[vertexPoints[index]].add(submesh)
+
+    targetCount = int(len(triangles) * ratio)
+    alive = [True] * len(triangles)
+    aliveCount = len(triangles)
+
+    pointTriangles = [set() for point in pointVertices]
+    quadrics = [[0.0] * 10 for point in pointVertices]
+    edgeTriangles = {}
+    for triangle, vertices in enumerate(triangles):
+        points = [vertexPoints[vertex] for vertex in vertices]
+        quadric = _PlaneQuadric(*[pointPositions[point] for point in points])
+        for i, point in enumerate(points):
+            pointTriangles[point].add(triangle)
+            quadrics[point] = [a + b for a, b in zip(quadrics[point], quadric)]
+            edge = (min(point, points[(i + 1) % 3]), max(point, points[(i + 1) % 3]))
+            edgeTriangles.setdefault(edge, []).append(triangle)
+
+    def wedge(triangle, point):
+        for vertex in triangles[triangle]:
+            if vertexPoints[vertex] == point:
+                return vertex
+
+    # Borders and material borders stay in place, uv seams are held in line by planes along their edges
+    locked = [len(pointSubmeshes[point]) > 1 for point in range(len(pointVertices))]
+    for (a, b), edgeUsers in sorted(edgeTriangles.items()):
+        if len(edgeUsers) == 1:
+            locked[a] = True
+            locked[b] = True
+        elif len(edgeUsers) == 2:
+            first, second = edgeUsers
+            if uv(wedge(first, a)) == uv(wedge(second, a)) and uv(wedge(first, b)) == uv(wedge(second, b)):
+                continue
+            faceNormal = _Normal(*[pointPositions[vertexPoints[vertex]] for vertex in triangles[first]])
+            quadric = _EdgeQuadric(pointPositions[a], pointPositions[b], faceNormal, _SEAM_WEIGHT)
+            quadrics[a] = [x + y for x, y in zip(quadrics[a], quadric)]
+            quadrics[b] = [x + y for x, y in zip(quadrics[b], quadric)]
+
+    versions = [0] * len(pointVertices)
+    heap = []
+
+    def neighbours(point):
+        result = set()
+        for triangle in pointTriangles[point]:
+            result.update([vertexPoints[vertex] for vertex in triangles[triangle]])
+        result.discard(point)
+        return result
+
+    def push(source, target):
+        if locked[source]:
+            return
+        cost = _QuadricError([a + b for a, b in zip(quadrics[source], quadrics[target])], pointPositions[target])
+        heapq.heappush(heap, (cost, source, target, versions[source], versions[target]))
+
+    def remap(removed, moved, source, target):
+        """Target vertex for every source vertex used by the moved triangles, None if a uv side
+           of source has no removed triangle to carry it over the edge"""
+        mapping = {}
+        for triangle in removed:
+            sourceVertex, targetVertex = wedge(triangle, source), wedge(triangle, target)
+            if mapping.setdefault(sourceVertex, targetVertex) != targetVertex:
+                return None
+
+        # The uv of the source vertex picks the side, the closest normal on that side picks the vertex
+        sides = {}
+        for sourceVertex, targetVertex in sorted(mapping.items()):
+            if sides.setdefault(uv(sourceVertex), uv(targetVertex)) != uv(targetVertex):
+                return None
+        for triangle in moved:
+            sourceVertex = wedge(triangle, source)
+            if sourceVertex in mapping:
+                continue
+            if uv(sourceVertex) not in sides:
+                return None
+            side = sides[uv(sourceVertex)]
+            candidates = [vertex for vertex in pointVertices[target] if uv(vertex) == side]
+            mapping[sourceVertex] = max(candidates, key=lambda vertex: (_Dot(normals[sourceVertex], normals[vertex]), -vertex))
+        return mapping
+
+    for point in range(len(pointVertices)):
+        for neighbour in sorted(neighbours(point)):
+            push(point, neighbour)
+
+    dead = [False] * len(pointVertices)
+    while aliveCount > targetCount and heap:
+        cost, source, target, sourceVersion, targetVersion = heapq.heappop(heap)
+        if dead[source] or dead[target] or versions[source] != sourceVersion or versions[target] != targetVersion:
+            continue
+
+        removed = []
+        moved = []
+        for triangle in sorted(pointTriangles[source]):
+            points = [vertexPoints[vertex] for vertex in triangles[triangle]]
+            if target in points:
+                removed.append(triangle)
+            else:
+                moved.append(triangle)
+        if not removed:
+            continue
+
+        mapping = remap(removed, moved, source, target)
+        if mapping is None:
+            continue
+
+        # Reject collapses that fold a remaining triangle over
+        flipped = False
+        for triangle in moved:
+            before = [pointPositions[vertexPoints[vertex]] for vertex in triangles[triangle]]
+            after = [pointPositions[target] if vertexPoints[vertex] == source else before[i]
+                     for i, vertex in enumerate(triangles[triangle])]
+            normalBefore = _Normal(*before)
+            normalAfter = _Normal(*after)
+            lengths = math.sqrt(_Dot(normalBefore, normalBefore) * _Dot(normalAfter, normalAfter))
+            if lengths <= 0.0 or _Dot(normalBefore, normalAfter) < _FLIP_LIMIT * lengths:
+                flipped = True
+                break
+        if flipped:
+            continue
+
+        for triangle in removed:
+            alive[triangle] = False
+            aliveCount -= 1
+            for vertex in triangles[triangle]:
+                pointTriangles[vertexPoints[vertex]].discard(triangle)
+
+        for triangle in moved:
+            triangles[triangle] = [mapping.get(vertex, vertex) for vertex in triangles[triangle]]
+            pointTriangles[target].add(triangle)
+
+        pointTriangles[source] = set()
+        dead[source] = True
+        quadrics[target] = [a + b for a, b in zip(quadrics[source], quadrics[target])]
+        versions[target] += 1
+
+        # Only costs involving the merged quadric changed, the moved triangles may add new neighbours
+        for neighbour in sorted(neighbours(target)):
+            push(neighbour, target)
+            push(target, neighbour)
+
+    submeshes = [{'material': entry['material'], 'indices': []} for entry in mesh['submeshes']]
+    for triangle, vertices in enumerate(triangles):
+        if alive[triangle]:
+            submeshes[triangleSubmeshes[triangle]]['indices'].extend(vertices)
+
+    return {'positions': positions, 'normals': mesh['normals'], 'uvs': mesh['uvs'],
+            'submeshes': [entry for entry in submeshes if entry['indices']], 'bounds': mesh['bounds']}
+
+def BuildLODChain(mesh, ratios=DEFAULT_RATIOS):
+    """Returns [(ratio, screen size, mesh)] for every ratio, each level simplified from the previous one.
+       The chain ends at the first level that could not remove a triangle, it would only repeat its source"""
+    chain = []
+    source = mesh
+    triangleCount = sum([len(entry['indices']) for entry in mesh['submeshes']]) // 3
+    for ratio in sorted(ratios, reverse=True):
+        sourceCount = sum([len(entry['indices']) for entry in source['submeshes']]) // 3
+        if sourceCount == 0:
+            break
+        level = SimplifyMesh(source, float(triangleCount * ratio) / sourceCount)
+        if sum([len(entry['indices']) for entry in level['submeshes']]) // 3 >= sourceCount:
+            break
+        source = level
+        chain.append((ratio, ScreenSize(ratio), source))
+    return chain
+
+def ParseRatios(text):
+    """'0.5 0.25' or '0.5,0.25' to a tuple of ratios in (0, 1)"""
+    ratios = [float(value) for value in text.replace(',', ' ').split()]
+    return tuple([ratio for ratio in ratios if 0.0 < ratio < 1.0])
+
+def GridMesh(size):
+    """Bumpy size x size quad grid, a synthetic input for trying the simplifier without blender"""
+    positions = [(float(x), float(y), math.sin(x * 0.7) * math.cos(y * 0.5)) for y in range(size + 1) for x in range(size + 1)]
+    indices = []
+    for y in range(size):
+        for x in range(size):
+            a = y * (size + 1) + x
+            indices.extend((a, a + 1, a + size + 2, a, a + size + 2, a + size + 1))
+    return {'positions': positions, 'normals': [(0.0, 0.0, 1.0)] * len(positions), 'uvs': None,
+            'submeshes': [{'material': None, 'indices': indices}],
+            'bounds': ((0.0, 0.0, -1.0), (float(size), float(size), 1.0))}
+
+if __name__ == "__main__":
+    # python lod_xcd.py [model.xcdm] [ratios], without a model a synthetic grid is simplified
+    if len(sys.argv) > 1 and sys.argv[1].endswith('.xcdm'):
+        from mesh_xcd import ReadMesh
+        mesh = ReadMesh(sys.argv[1])
+        ratios = ParseRatios(' '.join(sys.argv[2:])) or DEFAULT_RATIOS
+    else:
+        mesh = GridMesh(40)
+        ratios = ParseRatios(' '.join(sys.argv[1:])) or DEFAULT_RATIOS
+
+    print("full: %d triangles" % (sum([len(entry['indices']) for entry in mesh['submeshes']]) // 3))
+    for ratio, screenSize, level in BuildLODChain(mesh, ratios):
+        print("%.3f: %d triangles, screen size %.3f" % (ratio, sum([len(entry['indices']) for entry in level['submeshes']]) // 3, screenSize))
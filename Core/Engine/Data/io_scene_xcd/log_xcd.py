@@ -0,0 +1,79 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import json
+import logging
+import sys
+
+LOG_LEVELS = {'ERROR': logging.ERROR,
+              'WARNING': logging.WARNING,
+              'INFO': logging.INFO,
+              'DEBUG': logging.DEBUG}
+
+DEFAULT_LOG_LEVEL = 'WARNING'
+
+class XCDLog:
+    """Leveled exporter output, messages are only formatted if their level is enabled.
+       Callers check debugEnabled / traceEnabled before building expensive arguments."""
+
+    _logger = None
+    _trace = None
+
+    debugEnabled = False
+    infoEnabled = False
+    traceEnabled = False
+    indent = 0
+
+    # -------------------------------------------------------------------------
+    # Constructor
+    # -------------------------------------------------------------------------
+    def __init__(self, level=DEFAULT_LOG_LEVEL, tracePath=None):
+        self._logger = logging.getLogger('io_scene_xcd')
+        if not self._logger.handlers:
+            handler = logging.StreamHandler(sys.stdout)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(handler)
+            self._logger.propagate = False
+
+        self._logger.setLevel(LOG_LEVELS[level])
+        self.debugEnabled = self._logger.isEnabledFor(logging.DEBUG)
+        self.infoEnabled = self._logger.isEnabledFor(logging.INFO)
+
+        if tracePath:
+            self._trace = open(tracePath, 'w', encoding='utf-8')
+            self.traceEnabled = True
+
+    # -------------------------------------------------------------------------
+    # Public
+    # -------------------------------------------------------------------------
+    def Debug(self, message, *args):
+        if self.debugEnabled:
+            self._logger.debug('%s ' + message, ' -- ' * self.indent, *args)
+
+    def Info(self, message, *args):
+        if self.infoEnabled:
+            self._logger.info('Info: ' + message, *args)
+
+    def Warning(self, message, *args):
+        self._logger.warning('Warning: ' + message, *args)
+
+    def Error(self, message, *args):
+        self._logger.error('ERROR: ' + message, *args)
+
+    def Trace(self, **fields):
+        """Writes one json line per call into the trace file"""
+        if self._trace:
+            self._trace.write(json.dumps(fields, sort_keys=True))
+            self._trace.write('\n')
+
+    def Close(self):
+        if self._trace:
+            self._trace.close()
+            self._trace = None
+            self.traceEnabled = False
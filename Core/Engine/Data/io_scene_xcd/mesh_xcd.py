@@ -0,0 +1,416 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import math
+import struct
+import sys
+
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# -------------------------------------------------------------------------
+# Format
+#
+#   header        magic, version, format flags, vertex / index / submesh / string counts
+#   strings       u32 length + utf-8 bytes each, referenced by index (-1 = none)
+#   bounds        min 3, max 3 as float32
+#   submeshes     material string, first index, index count
+#   vertices      interleaved, every attribute padded to 4 bytes
+#                   position  float32 3, or uint16 4 normalized to the bounds (FORMAT_POSITION16, 4th unused)
+#                   normal    float32 3, or octahedral int16 2 (FORMAT_NORMAL_OCT16) / int8 2 + 2 unused (FORMAT_NORMAL_OCT8)
+#                   uv        float32 2, or float16 2 (FORMAT_UV_HALF), only with FORMAT_UV
+#   indices       uint16, or uint32 with FORMAT_INDEX32
+#   lods          with FORMAT_LODS: u32 count, then screen size and model file string per level
+# -------------------------------------------------------------------------
+MAGIC = b'XCDM'
+VERSION = 1
+
+FORMAT_UV = 0x1
+FORMAT_INDEX32 = 0x2
+FORMAT_POSITION16 = 0x4
+FORMAT_NORMAL_OCT16 = 0x8
+FORMAT_NORMAL_OCT8 = 0x10
+FORMAT_UV_HALF = 0x20
+FORMAT_LODS = 0x40
+
+FORMAT_QUANTIZED = FORMAT_POSITION16 | FORMAT_NORMAL_OCT16 | FORMAT_NORMAL_OCT8 | FORMAT_UV_HALF
+
+_header = struct.Struct('<4sHHIIII')
+_string = struct.Struct('<I')
+_bounds = struct.Struct('<6f')
+_submesh = struct.Struct('<iII')
+_lod = struct.Struct('<fi')
+
+def _LittleEndian(data):
+    if sys.byteorder != 'little':
+        data.byteswap()
+    return data
+
+def _VertexStruct(flags):
+    layout = '<'
+    layout += '4H' if flags & FORMAT_POSITION16 else '3f'
+    if flags & FORMAT_NORMAL_OCT16:
+        layout += '2h'
+    elif flags & FORMAT_NORMAL_OCT8:
+        layout += '2b2x'
+    else:
+        layout += '3f'
+    if flags & FORMAT_UV:
+        layout += '2H' if flags & FORMAT_UV_HALF else '2f'
+    return struct.Struct(layout)
+
+# -------------------------------------------------------------------------
+# Mesh model, built from the flat arrays blender hands out through
+# foreach_get. Vertices are unique (position, normal, uv) combinations in
+# order of first use, submeshes hold triangle lists per material.
+#
+#   {'positions': [(x, y, z)], 'normals': [(x, y, z)], 'uvs': [(u, v)] or None,
+#    'submeshes': [{'material': name, 'indices': [...]}], 'bounds': (min, max)}
+# -------------------------------------------------------------------------
+def BuildMesh(positions, normals, loopVertices, loopUVs, loopStarts, loopTotals,
+              polygonMaterials, polygonSmooth, polygonNormals, materialNames):
+    """positions / normals are flat per vertex, loopUVs flat per loop or None, the polygon arrays per polygon.
+       Polygons with more than three corners are only split correctly if they are convex"""
+    loopCount = len(loopVertices)
+    loopSmooth = [True] * loopCount
+    loopPolygonNormals = [None] * loopCount
+    for polygon, start in enumerate(loopStarts):
+        if not polygonSmooth[polygon]:
+            normal = tuple(polygonNormals[polygon * 3:polygon * 3 + 3])
+            for loop in range(start, start + loopTotals[polygon]):
+                loopSmooth[loop] = False
+                loopPolygonNormals[loop] = normal
+
+    # One row per loop, flat polygons use their face normal
+    rows = []
+    for loop, vertex in enumerate(loopVertices):
+        row = tuple(positions[vertex * 3:vertex * 3 + 3])
+        row += tuple(normals[vertex * 3:vertex * 3 + 3]) if loopSmooth[loop] else loopPolygonNormals[loop]
+        if loopUVs is not None:
+            row += tuple(loopUVs[loop * 2:loop * 2 + 2])
+        rows.append(row)
+
+    uniqueRows, loopRemap = _Deduplicate(rows)
+
+    # Polygons arrive triangulated by blender, the fan only splits them if they were not.
+    # Triangles are grouped by material in material slot order
+    triangles = {}
+    for polygon, start in enumerate(loopStarts):
+        indices = triangles.setdefault(polygonMaterials[polygon], [])
+        first = loopRemap[start]
+        for loop in range(start + 1, start + loopTotals[polygon] - 1):
+            indices.extend((first, loopRemap[loop], loopRemap[loop + 1]))
+
+    submeshes = []
+    for material in sorted(triangles.keys()):
+        name = materialNames[material] if material < len(materialNames) else None
+        submeshes.append({'material': name, 'indices': triangles[material]})
+
+    mesh = {'positions': [row[0:3] for row in uniqueRows],
+            'normals': [row[3:6] for row in uniqueRows],
+            'uvs': [row[6:8] for row in uniqueRows] if loopUVs is not None else None,
+            'submeshes': submeshes}
+    mesh['bounds'] = MeshBounds(mesh['positions'])
+    return mesh
+
+def _Deduplicate(rows):
+    """Returns the unique rows in order of first use and the index of every row into them"""
+    if numpy is not None and rows:
+        data = numpy.array(rows, dtype=numpy.float32)
+        unique, first, inverse = numpy.unique(data, axis=0, return_index=True, return_inverse=True)
+        order = numpy.argsort(first)
+        rank = numpy.empty(len(order), dtype=numpy.int64)
+        rank[order] = numpy.arange(len(order))
+        return [tuple(row) for row in unique[order].tolist()], rank[inverse.reshape(-1)].tolist()
+
+    lookup = {}
+    unique = []
+    remap = []
+    for row in rows:
+        row = tuple(array('f', row))
+        index = lookup.get(row)
+        if index is None:
+            index = len(unique)
+            lookup[row] = index
+            unique.append(row)
+        remap.append(index)
+    return unique, remap
+
+def MeshBounds(positions):
+    if not positions:
+        return (0.0, 0.0, 0.0), (0.0, 0.0, 0.0)
+    return (tuple([min([position[i] for position in positions]) for i in range(3)]),
+            tuple([max([position[i] for position in positions]) for i in range(3)]))
+
+def IndexCount(mesh):
+    return sum([len(submesh['indices']) for submesh in mesh['submeshes']])
+
+# -------------------------------------------------------------------------
+# Attribute quantization, every encoding comes with its decoding so the
+# error of a mesh can be measured before choosing it
+# -------------------------------------------------------------------------
+def _StoredBounds(bounds):
+    """The bounds as read back from the float32 header, positions are quantized against these"""
+    values = _bounds.unpack(_bounds.pack(*(tuple(bounds[0]) + tuple(bounds[1]))))
+    return values[0:3], values[3:6]
+
+def _EncodePosition16(position, bounds):
+    return tuple([int(round((position[i] - bounds[0][i]) / (bounds[1][i] - bounds[0][i]) * 65535.0))
+                  if bounds[1][i] > bounds[0][i] else 0 for i in range(3)]) + (0,)
+
+def _DecodePosition16(values, bounds):
+    return tuple([bounds[0][i] + values[i] / 65535.0 * (bounds[1][i] - bounds[0][i]) for i in range(3)])
+
+def _EncodeOctahedral(normal, bits):
+    x, y, z = normal
+    length = abs(x) + abs(y) + abs(z)
+    if length <= 0.0:
+        return 0, 0
+    x, y, z = x / length, y / length, z / length
+    if z < 0.0:
+        x, y = (1.0 - abs(y)) * (1.0 if x >= 0.0 else -1.0), (1.0 - abs(x)) * (1.0 if y >= 0.0 else -1.0)
+    scale = (1 << (bits - 1)) - 1
+    return int(round(max(min(x, 1.0), -1.0) * scale)), int(round(max(min(y, 1.0), -1.0) * scale))
+
+def _DecodeOctahedral(values, bits):
+    scale = float((1 << (bits - 1)) - 1)
+    x, y = values[0] / scale, values[1] / scale
+    z = 1.0 - abs(x) - abs(y)
+    if z < 0.0:
+        x, y = (1.0 - abs(y)) * (1.0 if x >= 0.0 else -1.0), (1.0 - abs(x)) * (1.0 if y >= 0.0 else -1.0)
+    length = math.sqrt(x * x + y * y + z * z)
+    return x / length, y / length, z / length
+
+def _HalfBits(value):
+    """float16 bits of value, rounded to nearest, without relying on struct 'e'"""
+    bits, = struct.unpack('<I', struct.pack('<f', value))
+    sign = (bits >> 16) & 0x8000
+    exponent = ((bits >> 23) & 0xff) - 127 + 15
+    mantissa = bits & 0x7fffff
+    if exponent <= 0:
+        if exponent < -10:
+            return sign
+        mantissa = (mantissa | 0x800000) >> (1 - exponent)
+        return sign | ((mantissa + 0x1000) >> 13)
+    if exponent >= 31:
+        return sign | 0x7c00
+    return (sign | (exponent << 10) | (mantissa >> 13)) + ((mantissa >> 12) & 1)
+
+def _HalfValue(bits):
+    sign = -1.0 if bits & 0x8000 else 1.0
+    exponent = (bits >> 10) & 0x1f
+    mantissa = bits & 0x3ff
+    if exponent == 0:
+        return sign * mantissa * 2.0 ** -24
+    if exponent == 31:
+        return sign * float('inf')
+    return sign * (1.0 + mantissa / 1024.0) * 2.0 ** (exponent - 15)
+
+def _AngleDegrees(a, b):
+    length = math.sqrt(sum([value * value for value in a])) * math.sqrt(sum([value * value for value in b]))
+    if length <= 0.0:
+        return 0.0
+    return math.degrees(math.acos(max(min(sum([a[i] * b[i] for i in range(3)]) / length, 1.0), -1.0)))
+
+def QuantizeFormat(mesh, positionError, normalError, uvError):
+    """Picks the smallest encoding of every attribute whose maximum error stays within its bound
+       (position in units, normal in degrees, uv absolute). Returns the format flags and a report
+       {attribute: (encoding, maximum error)}"""
+    flags = 0
+    report = {}
+    bounds = _StoredBounds(mesh['bounds'])
+
+    error = max([0.0] + [max([abs(a - b) for a, b in zip(position, _DecodePosition16(_EncodePosition16(position, bounds), bounds))])
+                         for position in mesh['positions']])
+    if error <= positionError:
+        flags = flags | FORMAT_POSITION16
+        report['position'] = ('uint16', error)
+    else:
+        report['position'] = ('float32', 0.0)
+
+    report['normal'] = ('float32', 0.0)
+    for bits, flag in ((8, FORMAT_NORMAL_OCT8), (16, FORMAT_NORMAL_OCT16)):
+        error = max([0.0] + [_AngleDegrees(normal, _DecodeOctahedral(_EncodeOctahedral(normal, bits), bits)) for normal in mesh['normals']])
+        if error <= normalError:
+            flags = flags | flag
+            report['normal'] = ('octahedral%d' % bits, error)
+            break
+
+    if mesh['uvs'] is not None:
+        error = max([0.0] + [abs(value - _HalfValue(_HalfBits(value))) for uv in mesh['uvs'] for value in uv])
+        if error <= uvError:
+            flags = flags | FORMAT_UV_HALF
+            report['uv'] = ('float16', error)
+        else:
+            report['uv'] = ('float32', 0.0)
+
+    return flags, report
+
+def VertexSize(flags):
+    return _VertexStruct(flags).size
+
+# -------------------------------------------------------------------------
+# Writing and reading
+# -------------------------------------------------------------------------
+def SaveMesh(filePath, mesh, quantization=0, lods=None):
+    """quantization holds FORMAT_QUANTIZED flags, usually picked by QuantizeFormat.
+       lods lists (screen size, model file) of the coarser levels of the mesh"""
+    vertexCount = len(mesh['positions'])
+    flags = quantization & FORMAT_QUANTIZED
+    if lods:
+        flags = flags | FORMAT_LODS
+    if mesh['uvs'] is not None:
+        flags = flags | FORMAT_UV
+    else:
+        flags = flags & ~FORMAT_UV_HALF
+    if vertexCount > 0xFFFF:
+        flags = flags | FORMAT_INDEX32
+
+    strings = []
+    submeshes = []
+    start = 0
+    for submesh in mesh['submeshes']:
+        name = submesh['material']
+        if name is not None and name not in strings:
+            strings.append(name)
+        submeshes.append(_submesh.pack(strings.index(name) if name is not None else -1, start, len(submesh['indices'])))
+        start += len(submesh['indices'])
+
+    for screenSize, name in lods or []:
+        strings.append(name)
+
+    parts = [_header.pack(MAGIC, VERSION, flags, vertexCount, start, len(submeshes), len(strings))]
+    for text in strings:
+        data = text.encode('utf-8')
+        parts.append(_string.pack(len(data)))
+        parts.append(data)
+
+    minimum, maximum = mesh['bounds']
+    parts.append(_bounds.pack(*(minimum + maximum)))
+    parts.extend(submeshes)
+
+    vertex = _VertexStruct(flags)
+    bounds = _StoredBounds(mesh['bounds'])
+    for i in range(vertexCount):
+        values = []
+        if flags & FORMAT_POSITION16:
+            values.extend(_EncodePosition16(mesh['positions'][i], bounds))
+        else:
+            values.extend(mesh['positions'][i])
+
+        if flags & FORMAT_NORMAL_OCT16:
+            values.extend(_EncodeOctahedral(mesh['normals'][i], 16))
+        elif flags & FORMAT_NORMAL_OCT8:
+            values.extend(_EncodeOctahedral(mesh['normals'][i], 8))
+        else:
+            values.extend(mesh['normals'][i])
+
+        if flags & FORMAT_UV_HALF:
+            values.extend([_HalfBits(value) for value in mesh['uvs'][i]])
+        elif flags & FORMAT_UV:
+            values.extend(mesh['uvs'][i])
+        parts.append(vertex.pack(*values))
+
+    indices = array('I' if flags & FORMAT_INDEX32 else 'H')
+    for submesh in mesh['submeshes']:
+        indices.extend(submesh['indices'])
+    parts.append(_LittleEndian(indices).tobytes())
+
+    if lods:
+        parts.append(_string.pack(len(lods)))
+        parts.extend([_lod.pack(screenSize, strings.index(name)) for screenSize, name in lods])
+
+    with open(filePath, 'wb') as file:
+        file.write(b''.join(parts))
+
+def ReadMesh(filePath):
+    with open(filePath, 'rb') as file:
+        buffer = file.read()
+
+    magic, version, flags, vertexCount, indexCount, submeshCount, stringCount = _header.unpack_from(buffer, 0)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError('%s is not a version %d xcdm file' % (filePath, VERSION))
+    offset = _header.size
+
+    strings = []
+    for i in range(stringCount):
+        length, = _string.unpack_from(buffer, offset)
+        offset += _string.size
+        strings.append(buffer[offset:offset + length].decode('utf-8'))
+        offset += length
+
+    bounds = _bounds.unpack_from(buffer, offset)
+    offset += _bounds.size
+
+    ranges = []
+    for i in range(submeshCount):
+        ranges.append(_submesh.unpack_from(buffer, offset))
+        offset += _submesh.size
+
+    bounds = (tuple(bounds[0:3]), tuple(bounds[3:6]))
+    vertex = _VertexStruct(flags)
+    positions = []
+    normals = []
+    uvs = [] if flags & FORMAT_UV else None
+    for i in range(vertexCount):
+        values = vertex.unpack_from(buffer, offset + i * vertex.size)
+        if flags & FORMAT_POSITION16:
+            positions.append(_DecodePosition16(values[0:4], bounds))
+            values = values[4:]
+        else:
+            positions.append(values[0:3])
+            values = values[3:]
+
+        if flags & FORMAT_NORMAL_OCT16:
+            normals.append(_DecodeOctahedral(values[0:2], 16))
+            values = values[2:]
+        elif flags & FORMAT_NORMAL_OCT8:
+            normals.append(_DecodeOctahedral(values[0:2], 8))
+            values = values[2:]
+        else:
+            normals.append(values[0:3])
+            values = values[3:]
+
+        if flags & FORMAT_UV_HALF:
+            uvs.append(tuple([_HalfValue(value) for value in values[0:2]]))
+        elif flags & FORMAT_UV:
+            uvs.append(values[0:2])
+    offset += vertexCount * vertex.size
+
+    indices = array('I' if flags & FORMAT_INDEX32 else 'H')
+    indices.frombytes(buffer[offset:offset + indexCount * indices.itemsize])
+    offset += indexCount * indices.itemsize
+    indices = _LittleEndian(indices).tolist()
+
+    lods = []
+    if flags & FORMAT_LODS:
+        count, = _string.unpack_from(buffer, offset)
+        offset += _string.size
+        for i in range(count):
+            screenSize, name = _lod.unpack_from(buffer, offset)
+            offset += _lod.size
+            lods.append((screenSize, strings[name]))
+
+    return {'positions': positions, 'normals': normals, 'uvs': uvs,
+            'submeshes': [{'material': strings[material] if material >= 0 else None,
+                           'indices': indices[start:start + count]} for material, start, count in ranges],
+            'bounds': bounds, 'format': flags, 'lods': lods}
+
+if __name__ == "__main__":
+    # python mesh_xcd.py model.xcdm
+    mesh = ReadMesh(sys.argv[1])
+    print("%d vertices of %d bytes, %d triangles" % (len(mesh['positions']), VertexSize(mesh['format']), IndexCount(mesh) // 3))
+    for submesh in mesh['submeshes']:
+        print("  %-24s %d triangles" % (submesh['material'], len(submesh['indices']) // 3))
+    for screenSize, name in mesh['lods']:
+        print("  lod below %.3f: %s" % (screenSize, name))
@@ -0,0 +1,89 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Unique ids of one export. Names follow bpy_extras.io_utils.unique_name,
+# the cleaned name first and name<sep>001, name<sep>002, ... on collisions,
+# but lookups go through a set and a counter per name instead of scanning
+# every name handed out so far. Every key also gets a dense integer id.
+# -------------------------------------------------------------------------
+
+# Control characters, space and the characters the stage readers split on
+_CLEAN_TABLE = dict([(code, '_') for code in range(0x01, 0x20)] +
+                    [(ord(character), '_') for character in ' "\'#,.[]\\{}\x7f'])
+
+def CleanName(text):
+    if not text:
+        text = "None"
+
+    # no digit start
+    if text[0] in "1234567890+-":
+        text = "_" + text
+
+    return text.translate(_CLEAN_TABLE)
+
+class IdAllocator:
+    _clean = None
+    _sep = "_"
+    _names = None
+    _used = None
+    _next = None
+    _indices = None
+    _count = 0
+
+    def __init__(self, clean=CleanName, sep="_"):
+        self._clean = clean
+        self._sep = sep
+        self._names = {}
+        self._used = set()
+        self._next = {}
+        self._indices = {}
+        self._count = 0
+
+    def __contains__(self, key):
+        return key in self._names
+
+    def __len__(self):
+        return len(self._names)
+
+    def Get(self, key):
+        return self._names.get(key)
+
+    def Allocate(self, key, name):
+        """Returns the name of key, picking a free one from name on first use"""
+        existing = self._names.get(key)
+        if existing is not None:
+            return existing
+
+        base = self._clean(name)
+        candidate = base
+        if candidate in self._used:
+            # Numbers below the counter are known to be taken
+            count = self._next.get(base, 1)
+            candidate = "%s%s%03d" % (base, self._sep, count)
+            while candidate in self._used:
+                count += 1
+                candidate = "%s%s%03d" % (base, self._sep, count)
+            self._next[base] = count + 1
+
+        self._names[key] = candidate
+        self._used.add(candidate)
+        self._indices[key] = self._count
+        self._count += 1
+        return candidate
+
+    def Index(self, key):
+        """Integer id of an allocated key, in allocation order"""
+        return self._indices[key]
+
+    def Remove(self, key):
+        """Takes back the most recent allocations of a rejected cached fragment, last one first"""
+        name = self._names.pop(key)
+        self._used.discard(name)
+        if self._indices.pop(key) == self._count - 1:
+            self._count -= 1
+        # The freed name may sit below a counter, let the next collision scan from the start
+        self._next.clear()
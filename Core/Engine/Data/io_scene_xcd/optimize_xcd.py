@@ -0,0 +1,227 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import math
+import sys
+
+# -------------------------------------------------------------------------
+# Index buffer optimization of mesh models built by mesh_xcd.BuildMesh:
+# triangle order for the post transform vertex cache (Forsyth), optional
+# cluster order against overdraw and vertex order for fetch locality.
+# -------------------------------------------------------------------------
+CACHE_SIZE = 32
+OVERDRAW_THRESHOLD = 1.05
+
+_CACHE_DECAY_POWER = 1.5
+_LAST_TRIANGLE_SCORE = 0.75
+_VALENCE_BOOST_SCALE = 2.0
+_VALENCE_BOOST_POWER = 0.5
+_MAX_VALENCE = 64
+
+def _CacheScores(cacheSize):
+    scores = []
+    for position in range(cacheSize + 3):
+        if position < 3:
+            scores.append(_LAST_TRIANGLE_SCORE)
+        elif position < cacheSize:
+            scores.append((1.0 - float(position - 3) / (cacheSize - 3)) ** _CACHE_DECAY_POWER)
+        else:
+            scores.append(0.0)
+    return scores
+
+def _ValenceScores():
+    return [0.0] + [_VALENCE_BOOST_SCALE * remaining ** -_VALENCE_BOOST_POWER for remaining in range(1, _MAX_VALENCE + 1)]
+
+def CacheStatistics(indices, cacheSize=CACHE_SIZE):
+    """Simulates a fifo cache, returns (ACMR, ATVR): misses per triangle and per referenced vertex"""
+    triangleCount = len(indices) // 3
+    if triangleCount == 0:
+        return 0.0, 0.0
+
+    cache = []
+    cached = set()
+    misses = 0
+    for index in indices:
+        if index in cached:
+            continue
+        misses += 1
+        cache.append(index)
+        cached.add(index)
+        if len(cache) > cacheSize:
+            cached.discard(cache.pop(0))
+    return float(misses) / triangleCount, float(misses) / len(set(indices))
+
+def OptimizeVertexCache(indices, cacheSize=CACHE_SIZE):
+    """Returns the triangles of indices reordered with Tom Forsyth's linear speed vertex cache optimization"""
+    triangleCount = len(indices) // 3
+    if triangleCount == 0:
+        return list(indices)
+
+    cacheScores = _CacheScores(cacheSize)
+    valenceScores = _ValenceScores()
+
+    vertexTriangles = {}
+    for triangle in range(triangleCount):
+        for index in indices[triangle * 3:triangle * 3 + 3]:
+            vertexTriangles.setdefault(index, []).append(triangle)
+
+    positions = dict([(vertex, -1) for vertex in vertexTriangles])
+
+    def score(vertex):
+        remaining = len(vertexTriangles[vertex])
+        if remaining == 0:
+            return -1.0
+        position = positions[vertex]
+        return (cacheScores[position] if position >= 0 else 0.0) + valenceScores[min(remaining, _MAX_VALENCE)]
+
+    vertexScores = dict([(vertex, score(vertex)) for vertex in vertexTriangles])
+    triangleScores = [sum([vertexScores[index] for index in indices[triangle * 3:triangle * 3 + 3]])
+                      for triangle in range(triangleCount)]
+    added = [False] * triangleCount
+
+    result = []
+    cache = []
+    best = max(range(triangleCount), key=lambda triangle: triangleScores[triangle])
+    cursor = 0
+    while best is not None:
+        vertices = indices[best * 3:best * 3 + 3]
+        result.extend(vertices)
+        added[best] = True
+
+        for vertex in vertices:
+            vertexTriangles[vertex].remove(best)
+
+        # Most recent first, the triangle vertices move to the front
+        cache = list(vertices) + [vertex for vertex in cache if vertex not in vertices]
+        evicted = cache[cacheSize:]
+        del cache[cacheSize:]
+        for vertex in evicted:
+            positions[vertex] = -1
+            vertexScores[vertex] = score(vertex)
+
+        touched = set()
+        for position, vertex in enumerate(cache):
+            positions[vertex] = position
+            vertexScores[vertex] = score(vertex)
+            touched.update(vertexTriangles[vertex])
+        for vertex in evicted:
+            touched.update(vertexTriangles[vertex])
+
+        best = None
+        bestScore = -1.0
+        for triangle in touched:
+            triangleScores[triangle] = sum([vertexScores[index] for index in indices[triangle * 3:triangle * 3 + 3]])
+            if triangleScores[triangle] > bestScore:
+                best = triangle
+                bestScore = triangleScores[triangle]
+
+        if best is None:
+            # Dead end, continue with the next triangle in input order
+            while cursor < triangleCount and added[cursor]:
+                cursor += 1
+            best = cursor if cursor < triangleCount else None
+
+    return result
+
+def _TriangleClusters(indices, cacheSize):
+    """Splits the triangles where the simulated cache misses every vertex of a triangle"""
+    clusters = []
+    cache = []
+    for triangle in range(len(indices) // 3):
+        vertices = indices[triangle * 3:triangle * 3 + 3]
+        misses = len([vertex for vertex in vertices if vertex not in cache])
+        if misses == 3 or not clusters:
+            clusters.append([])
+        clusters[-1].append(triangle)
+
+        cache = list(vertices) + [vertex for vertex in cache if vertex not in vertices]
+        del cache[cacheSize:]
+    return clusters
+
+def OptimizeOverdraw(indices, positions, cacheSize=CACHE_SIZE, threshold=OVERDRAW_THRESHOLD):
+    """Sorts cache friendly triangle clusters so outward facing clusters far from the center are drawn first.
+       Keeps the input if the ACMR would grow by more than threshold"""
+    clusters = _TriangleClusters(indices, cacheSize)
+    if len(clusters) < 2:
+        return list(indices)
+
+    def corner(triangle, i):
+        return positions[indices[triangle * 3 + i]]
+
+    meshCenter = [sum([position[axis] for position in positions]) / len(positions) for axis in range(3)]
+    keys = []
+    for cluster in clusters:
+        center = [0.0, 0.0, 0.0]
+        normal = [0.0, 0.0, 0.0]
+        area = 0.0
+        for triangle in cluster:
+            a, b, c = corner(triangle, 0), corner(triangle, 1), corner(triangle, 2)
+            u = [b[axis] - a[axis] for axis in range(3)]
+            v = [c[axis] - a[axis] for axis in range(3)]
+            cross = [u[1] * v[2] - u[2] * v[1], u[2] * v[0] - u[0] * v[2], u[0] * v[1] - u[1] * v[0]]
+            weight = math.sqrt(sum([value * value for value in cross]))
+            for axis in range(3):
+                center[axis] += (a[axis] + b[axis] + c[axis]) / 3.0 * weight
+                normal[axis] += cross[axis]
+            area += weight
+
+        if area > 0.0:
+            center = [value / area for value in center]
+        length = math.sqrt(sum([value * value for value in normal]))
+        if length > 0.0:
+            normal = [value / length for value in normal]
+        keys.append(sum([(center[axis] - meshCenter[axis]) * normal[axis] for axis in range(3)]))
+
+    order = sorted(range(len(clusters)), key=lambda cluster: -keys[cluster])
+    result = []
+    for cluster in order:
+        for triangle in clusters[cluster]:
+            result.extend(indices[triangle * 3:triangle * 3 + 3])
+
+    if CacheStatistics(result, cacheSize)[0] > CacheStatistics(indices, cacheSize)[0] * threshold:
+        return list(indices)
+    return result
+
+def OptimizeVertexFetch(mesh):
+    """Renumbers the vertices in order of first use over all submeshes and drops unused ones"""
+    remap = {}
+    for submesh in mesh['submeshes']:
+        for index in submesh['indices']:
+            if index not in remap:
+                remap[index] = len(remap)
+        submesh['indices'] = [remap[index] for index in submesh['indices']]
+
+    order = sorted(remap.keys(), key=lambda index: remap[index])
+    for stream in ('positions', 'normals', 'uvs'):
+        if mesh[stream] is not None:
+            mesh[stream] = [mesh[stream][index] for index in order]
+
+def OptimizeMesh(mesh, overdraw=False, cacheSize=CACHE_SIZE):
+    """Optimizes the mesh in place, returns (ACMR, ATVR) before and after"""
+    def statistics():
+        indices = []
+        for submesh in mesh['submeshes']:
+            indices.extend(submesh['indices'])
+        return CacheStatistics(indices, cacheSize)
+
+    before = statistics()
+    for submesh in mesh['submeshes']:
+        submesh['indices'] = OptimizeVertexCache(submesh['indices'], cacheSize)
+        if overdraw:
+            submesh['indices'] = OptimizeOverdraw(submesh['indices'], mesh['positions'], cacheSize)
+    OptimizeVertexFetch(mesh)
+    return before, statistics()
+
+if __name__ == "__main__":
+    # python optimize_xcd.py model.xcdm [model.xcdm ...], reports the gain without writing
+    from mesh_xcd import ReadMesh
+
+    for filePath in sys.argv[1:]:
+        before, after = OptimizeMesh(ReadMesh(filePath), overdraw=True)
+        print("%s: ACMR %.3f -> %.3f, ATVR %.3f -> %.3f" % (filePath, before[0], after[0], before[1], after[1]))
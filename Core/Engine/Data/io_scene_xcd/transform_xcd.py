@@ -0,0 +1,163 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+# -------------------------------------------------------------------------
+# Imports
+# -------------------------------------------------------------------------
+import math
+import random
+import sys
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# -------------------------------------------------------------------------
+# Bulk decomposition of local matrices into what the stage writers format:
+# translation, rotation, scale, direction (the normalized -z axis lights
+# point along) and the upper 3x4 rows. Rotation and scale follow mathutils
+# Matrix.decompose, a mirrored matrix gets a negative scale on every axis.
+# Rotations are normalized (w, x, y, z) quaternions with w >= 0.
+# -------------------------------------------------------------------------
+HAS_NUMPY = numpy is not None
+
+def _QuaternionPython(r):
+    """Quaternion of the rotation matrix r (rows), largest component first for stability"""
+    trace = r[0][0] + r[1][1] + r[2][2]
+    if trace > 0.0:
+        s = math.sqrt(trace + 1.0) * 2.0
+        q = (0.25 * s, (r[2][1] - r[1][2]) / s, (r[0][2] - r[2][0]) / s, (r[1][0] - r[0][1]) / s)
+    elif r[0][0] > r[1][1] and r[0][0] > r[2][2]:
+        s = math.sqrt(max(1.0 + r[0][0] - r[1][1] - r[2][2], 0.0)) * 2.0
+        q = ((r[2][1] - r[1][2]) / s, 0.25 * s, (r[0][1] + r[1][0]) / s, (r[0][2] + r[2][0]) / s)
+    elif r[1][1] > r[2][2]:
+        s = math.sqrt(max(1.0 + r[1][1] - r[0][0] - r[2][2], 0.0)) * 2.0
+        q = ((r[0][2] - r[2][0]) / s, (r[0][1] + r[1][0]) / s, 0.25 * s, (r[1][2] + r[2][1]) / s)
+    else:
+        s = math.sqrt(max(1.0 + r[2][2] - r[0][0] - r[1][1], 0.0)) * 2.0
+        q = ((r[1][0] - r[0][1]) / s, (r[0][2] + r[2][0]) / s, (r[1][2] + r[2][1]) / s, 0.25 * s)
+
+    length = math.sqrt(sum([value * value for value in q]))
+    sign = -1.0 if q[0] < 0.0 else 1.0
+    return tuple([sign * value / length for value in q])
+
+def _DecomposePython(matrices):
+    translations = []
+    rotations = []
+    scales = []
+    directions = []
+    rows = []
+    for matrix in matrices:
+        translations.append((matrix[0][3], matrix[1][3], matrix[2][3]))
+
+        m = [row[:3] for row in matrix[:3]]
+        determinant = (m[0][0] * (m[1][1] * m[2][2] - m[1][2] * m[2][1]) -
+                       m[0][1] * (m[1][0] * m[2][2] - m[1][2] * m[2][0]) +
+                       m[0][2] * (m[1][0] * m[2][1] - m[1][1] * m[2][0]))
+        sign = -1.0 if determinant < 0.0 else 1.0
+        lengths = [math.sqrt(m[0][i] ** 2 + m[1][i] ** 2 + m[2][i] ** 2) for i in range(3)]
+        scales.append(tuple([sign * length for length in lengths]))
+        rotation = [[m[row][i] / (sign * lengths[i]) if lengths[i] > 0.0 else float(row == i) for i in range(3)] for row in range(3)]
+        rotations.append(_QuaternionPython(rotation))
+        rows.append(tuple(matrix[0][:4]) + tuple(matrix[1][:4]) + tuple(matrix[2][:4]))
+
+        direction = (-m[0][2], -m[1][2], -m[2][2])
+        length = math.sqrt(sum([value * value for value in direction]))
+        directions.append(tuple([value / length for value in direction]) if length > 0.0 else (0.0, 0.0, 0.0))
+    return translations, rotations, scales, directions, rows
+
+def _QuaternionNumpy(r):
+    """Quaternions of the (n, 3, 3) rotation matrices, every case of _QuaternionPython is computed and selected"""
+    r00, r11, r22 = r[:, 0, 0], r[:, 1, 1], r[:, 2, 2]
+    cases = numpy.select([r00 + r11 + r22 > 0.0, (r00 > r11) & (r00 > r22), r11 > r22], [0, 1, 2], 3)
+
+    diagonals = numpy.stack([r00 + r11 + r22 + 1.0, 1.0 + r00 - r11 - r22, 1.0 + r11 - r00 - r22, 1.0 + r22 - r00 - r11], axis=1)
+    s = numpy.sqrt(numpy.maximum(diagonals[numpy.arange(len(r)), cases], 1e-30)) * 2.0
+    wx, wy, wz = r[:, 2, 1] - r[:, 1, 2], r[:, 0, 2] - r[:, 2, 0], r[:, 1, 0] - r[:, 0, 1]
+    xy, xz, yz = r[:, 0, 1] + r[:, 1, 0], r[:, 0, 2] + r[:, 2, 0], r[:, 1, 2] + r[:, 2, 1]
+    quarter = 0.25 * s
+    candidates = numpy.stack([numpy.stack([quarter, wx / s, wy / s, wz / s], axis=1),
+                              numpy.stack([wx / s, quarter, xy / s, xz / s], axis=1),
+                              numpy.stack([wy / s, xy / s, quarter, yz / s], axis=1),
+                              numpy.stack([wz / s, xz / s, yz / s, quarter], axis=1)], axis=1)
+    q = candidates[numpy.arange(len(r)), cases]
+    q = q / numpy.sqrt((q * q).sum(axis=1))[:, numpy.newaxis]
+    return q * numpy.where(q[:, 0] < 0.0, -1.0, 1.0)[:, numpy.newaxis]
+
+def _DecomposeNumpy(matrices):
+    matrices = numpy.asarray(matrices, dtype=numpy.float64).reshape(-1, 4, 4)
+    axes = matrices[:, :3, :3]
+
+    signs = numpy.where(numpy.linalg.det(axes) < 0.0, -1.0, 1.0)
+    lengths = numpy.sqrt((axes * axes).sum(axis=1))
+    scales = lengths * signs[:, numpy.newaxis]
+    safeScales = numpy.where(lengths > 0.0, scales, 1.0)
+    rotations = _QuaternionNumpy(axes / safeScales[:, numpy.newaxis, :])
+
+    directions = -axes[:, :, 2]
+    lengths = numpy.sqrt((directions * directions).sum(axis=1))
+    directions = directions / numpy.where(lengths > 0.0, lengths, 1.0)[:, numpy.newaxis]
+
+    return ([tuple(entry) for entry in matrices[:, :3, 3].tolist()],
+            [tuple(entry) for entry in rotations.tolist()],
+            [tuple(entry) for entry in scales.tolist()],
+            [tuple(entry) for entry in directions.tolist()],
+            [tuple(entry) for entry in matrices[:, :3, :].reshape(-1, 12).tolist()])
+
+def MatricesFromColumns(values):
+    """Flat column major 4x4 matrices, as foreach_get returns them, to row major ones"""
+    if numpy is None:
+        return [[[values[offset + column * 4 + row] for column in range(4)] for row in range(4)]
+                for offset in range(0, len(values), 16)]
+    return numpy.frombuffer(values, dtype=numpy.float32).reshape(-1, 4, 4).transpose(0, 2, 1)
+
+def DecomposeMatrices(matrices):
+    """matrices are row major 4x4, nested sequences or an (n, 4, 4) array.
+       Returns lists of (translations, rotations, scales, directions, 3x4 rows)"""
+    if len(matrices) == 0:
+        return [], [], [], [], []
+
+    if numpy is None:
+        return _DecomposePython(matrices)
+    return _DecomposeNumpy(matrices)
+
+if __name__ == "__main__":
+    # python transform_xcd.py [count], compares the vectorized path against the reference
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    generator = random.Random(0)
+
+    matrices = []
+    for i in range(count):
+        # Rotation from a random unit quaternion, so every branch of the conversion is taken
+        w, x, y, z = [generator.gauss(0.0, 1.0) for axis in range(4)]
+        length = math.sqrt(w * w + x * x + y * y + z * z)
+        w, x, y, z = w / length, x / length, y / length, z / length
+        rotation = [(1 - 2 * (y * y + z * z), 2 * (x * y - w * z), 2 * (x * z + w * y)),
+                    (2 * (x * y + w * z), 1 - 2 * (x * x + z * z), 2 * (y * z - w * x)),
+                    (2 * (x * z - w * y), 2 * (y * z + w * x), 1 - 2 * (x * x + y * y))]
+        scale = [generator.uniform(0.1, 4.0) for axis in range(3)]
+        expected = (w, x, y, z) if w >= 0.0 else (-w, -x, -y, -z)
+        if max([abs(a - b) for a, b in zip(_QuaternionPython(rotation), expected)]) > 1e-9:
+            print("quaternion %r does not round trip" % (expected,))
+            sys.exit(1)
+
+        # Some mirrored ones as well, their rotation is negated as in Matrix.decompose
+        if i % 5 == 0:
+            scale[i % 3] = -scale[i % 3]
+        matrices.append([tuple([rotation[row][axis] * scale[axis] for axis in range(3)]) + (generator.uniform(-100.0, 100.0),)
+                         for row in range(3)] + [(0.0, 0.0, 0.0, 1.0)])
+
+    reference = _DecomposePython(matrices)
+    if numpy is None:
+        print("numpy is not available, only the reference path exists")
+        sys.exit(0)
+
+    result = _DecomposeNumpy(matrices)
+    worst = max([abs(a - b) for expected, actual in zip(reference, result)
+                 for rowA, rowB in zip(expected, actual) for a, b in zip(rowA, rowB)])
+    print("%d matrices, largest difference %g" % (count, worst))
+    sys.exit(0 if worst < 1e-9 else 1)
@@ -0,0 +1,65 @@
+# ##### BEGIN LICENSE BLOCK #####
+#
+#  @PG, Carbon
+#
+# ##### END LICENSE BLOCK #####
+
+DEFAULT_BUFFER_SIZE = 256 * 1024
+
+class XCDBufferedWriter:
+    """Collects output fragments in memory and flushes them to the target in large chunks"""
+
+    _target = None
+    _bufferSize = DEFAULT_BUFFER_SIZE
+    _buffer = None
+    _bufferLength = 0
+    _capture = None
+
+    writeCalls = 0
+
+    # -------------------------------------------------------------------------
+    # Constructor
+    # -------------------------------------------------------------------------
+    def __init__(self, target, bufferSize=DEFAULT_BUFFER_SIZE):
+        self._target = target
+        self._bufferSize = max(int(bufferSize), 1)
+        self._buffer = []
+        self._bufferLength = 0
+        self.writeCalls = 0
+
+    # -------------------------------------------------------------------------
+    # Public
+    # -------------------------------------------------------------------------
+    def Write(self, fragment):
+        if self._capture is not None:
+            self._capture.append(fragment)
+        self._buffer.append(fragment)
+        self._bufferLength += len(fragment)
+        if self._bufferLength >= self._bufferSize:
+            self.Flush()
+
+    def WriteParts(self, parts):
+        """Joins a list of fragments belonging to one element and queues them as one entry"""
+        self.Write(''.join(parts))
+
+    def BeginCapture(self):
+        """Records everything written until EndCapture, used to cache per object output"""
+        self._capture = []
+
+    def EndCapture(self):
+        fragment = ''.join(self._capture)
+        self._capture = None
+        return fragment
+
+    def Flush(self):
+        if not self._buffer:
+            return
+
+        self._target.write(''.join(self._buffer))
+        self.writeCalls = self.writeCalls + 1
+        self._buffer = []
+        self._bufferLength = 0
+
+    def Close(self):
+        self.Flush()
+        self._target.close()
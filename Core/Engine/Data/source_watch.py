@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# -------------------------------------------------------------------------
+# Watches directory trees for changed .blend files. Uses inotify where the
+# platform has it and falls back to comparing modification times every
+# poll interval. Wait() blocks until something changed and returns the
+# changed paths once no further change came in for the settle time, so a
+# save (blender writes file.blend@ and renames it) is reported once.
+#   python source_watch.py ROOT...     prints changes, for testing
+# -------------------------------------------------------------------------
+WATCH_EXTENSION = '.blend'
+
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO = 0x00000080
+_IN_CREATE = 0x00000100
+_IN_DELETE_SELF = 0x00000400
+_IN_Q_OVERFLOW = 0x00004000
+_IN_IGNORED = 0x00008000
+_IN_ISDIR = 0x40000000
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+_WATCH_MASK = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE | _IN_DELETE_SELF
+_EVENT_HEADER = struct.Struct('iIII')
+
+def _NormalizePath(path):
+    return os.path.normcase(os.path.abspath(path))
+
+def _IsWatched(path):
+    return path.lower().endswith(WATCH_EXTENSION)
+
+class _PollingBackend:
+    """Snapshot of (mtime, size) for every watched file, compared on each poll"""
+
+    _roots = None
+    _interval = 1.0
+    _snapshot = None
+
+    def __init__(self, roots, interval):
+        self._roots = roots
+        self._interval = interval
+        self._snapshot = self._Scan()
+
+    def Close(self):
+        pass
+
+    def Files(self):
+        return set(self._snapshot)
+
+    def Read(self, timeout):
+        time.sleep(self._interval if timeout is None else min(timeout, self._interval))
+
+        snapshot = self._Scan()
+        changed = set([path for path, state in snapshot.items() if self._snapshot.get(path) != state])
+        self._snapshot = snapshot
+        return changed
+
+    def _Scan(self):
+        snapshot = {}
+        for root in self._roots:
+            for directory, directories, files in os.walk(root):
+                for fileName in files:
+                    if not _IsWatched(fileName):
+                        continue
+
+                    path = _NormalizePath(os.path.join(directory, fileName))
+                    try:
+                        info = os.stat(path)
+                    except OSError:
+                        continue
+                    snapshot[path] = (info.st_mtime, info.st_size)
+        return snapshot
+
+class _InotifyBackend:
+    """One inotify watch per directory, directories created later are added as they show up"""
+
+    _libc = None
+    _fd = -1
+    _directories = None
+
+    def __init__(self, roots):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, "inotify is only available on linux")
+
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        self._fd = self._libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self._fd < 0:
+            code = ctypes.get_errno()
+            raise OSError(code, os.strerror(code))
+
+        self._directories = {}
+        try:
+            for root in roots:
+                self._AddTree(root)
+        except OSError:
+            self.Close()
+            raise
+
+    def Close(self):
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def Read(self, timeout):
+        readable, writable, failed = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return set()
+            raise
+
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            descriptor, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(sys.getfilesystemencoding())
+            offset += length
+
+            if mask & _IN_Q_OVERFLOW:
+                raise OverflowError("inotify queue overflowed, events were lost")
+
+            directory = self._directories.get(descriptor)
+            if directory is None:
+                continue
+
+            if mask & (_IN_IGNORED | _IN_DELETE_SELF):
+                del self._directories[descriptor]
+                continue
+
+            path = os.path.join(directory, name)
+            if mask & _IN_ISDIR:
+                if mask & (_IN_CREATE | _IN_MOVED_TO):
+                    # Files may land in it before the watch exists, report those right away
+                    self._AddTree(path)
+                    for subDirectory, directories, files in os.walk(path):
+                        changed.update([_NormalizePath(os.path.join(subDirectory, fileName))
+                                        for fileName in files if _IsWatched(fileName)])
+                continue
+
+            # A create alone is an empty file, the close or rename that completes it follows
+            if mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO) and _IsWatched(name):
+                changed.add(_NormalizePath(path))
+        return changed
+
+    def _AddTree(self, root):
+        for directory, directories, files in os.walk(root):
+            descriptor = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _WATCH_MASK)
+            if descriptor < 0:
+                code = ctypes.get_errno()
+                raise OSError(code, "%s: %s" % (directory, os.strerror(code)))
+            self._directories[descriptor] = directory
+
+class SourceWatcher:
+    roots = None
+    backend = None
+    pollInterval = 1.0
+    settleTime = 0.25
+
+    _backend = None
+
+    def __init__(self, roots, pollInterval=1.0, settleTime=0.25, usePolling=False):
+        self.roots = [os.path.abspath(root) for root in roots if os.path.isdir(root)]
+        self.pollInterval = pollInterval
+        self.settleTime = settleTime
+
+        if not usePolling:
+            try:
+                self._backend = _InotifyBackend(self.roots)
+                self.backend = 'inotify'
+            except (OSError, AttributeError) as e:
+                print("Warning: inotify is not available (%s), polling every %.2fs" % (e, pollInterval))
+
+        if self._backend is None:
+            self._backend = _PollingBackend(self.roots, pollInterval)
+            self.backend = 'polling'
+
+    def Close(self):
+        self._backend.Close()
+
+    def Wait(self, timeout=None):
+        """Returns the changed .blend paths, normalized, or an empty set once timeout (seconds) passed"""
+        end = None if timeout is None else time.time() + timeout
+        changed = set()
+        while not changed:
+            remaining = None if end is None else end - time.time()
+            if remaining is not None and remaining <= 0.0:
+                return changed
+            changed = self._Read(remaining)
+
+        # Collect whatever belongs to the same save before handing the batch out
+        while True:
+            more = self._Read(self.settleTime)
+            if not more:
+                return changed
+            changed.update(more)
+
+    def _Read(self, timeout):
+        try:
+            return self._backend.Read(timeout)
+        except OverflowError as e:
+            # Events were dropped, every file may have changed and only polling can tell from here on
+            print("Warning: %s, switching to polling" % e)
+            self._backend.Close()
+            self._backend = _PollingBackend(self.roots, self.pollInterval)
+            self.backend = 'polling'
+            return self._backend.Files()
+
+if __name__ == "__main__":
+    watcher = SourceWatcher(sys.argv[1:] or ['.'])
+    print("Watching %s (%s)" % (", ".join(watcher.roots), watcher.backend))
+    try:
+        while True:
+            for path in sorted(watcher.Wait()):
+                print("changed %s" % path)
+    except KeyboardInterrupt:
+        watcher.Close()
@@ -0,0 +1,221 @@
+import os
+import sys
+import gzip
+import math
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_scene_xcd'))
+
+from binary_xcd import XCDBinaryWriter, XCDStageWriter, ReadBinary, ReadXml, Compare, SECTION_ALL, SECTION_TRANSFORMS
+from writer_xcd import XCDBufferedWriter
+from link_xcd import LinkTable
+
+# -------------------------------------------------------------------------
+# Round trip of the binary stage against the xml written for the same
+# scene. One record list goes through XCDStageWriter, the calls the exporter
+# makes, into both files. The xml is written in the plain form (1.0) and in
+# the compact form (1.1) with instances, a link table, a bvh and batches.
+# -------------------------------------------------------------------------
+FIRST_LAYER = [True] + [False] * 19
+BOX = [(-1.0, -1.0, -1.0), (-1.0, -1.0, 1.0), (-1.0, 1.0, 1.0), (-1.0, 1.0, -1.0),
+       (1.0, -1.0, -1.0), (1.0, -1.0, 1.0), (1.0, 1.0, 1.0), (1.0, 1.0, -1.0)]
+ZERO_BOX = [(0.0, 0.0, 0.0)] * 8
+
+# id, link, parent, rotation, translation, scale, bounds, layers, properties
+ELEMENTS = [('Root', None, -1, (2, 0.1, 0.2, 0.3, 1.0), (1.0, 2.0, 3.0), (1.0, 1.0, 1.0), ZERO_BOX, FIRST_LAYER,
+             [('Kind', 'Root'), ('Weight', 2.5), ('Count', 3)]),
+            ('Tree', 'Assets/Tree.dae', 0, (3, 1.0, 0.0, 0.0, 0.0), (4.0, 5.0, 6.0), (2.0, 2.0, 2.0), BOX, FIRST_LAYER, []),
+            ('Tree_001', 'Assets/Tree.dae', 0, (3, 1.0, 0.0, 0.0, 0.0), (7.0, 8.0, 9.0), (2.0, 2.0, 2.0), BOX, FIRST_LAYER, []),
+            ('Rock', 'Assets/Rock.dae', -1, (3, 0.5, 0.5, 0.5, 0.5), (-3.0, 0.0, 1.5), (1.0, 1.0, 1.0), BOX,
+             [False, True] + [False] * 18, [])]
+
+# type, id, color, intensity, radius, spotsize, angle, direction, location, layers, properties
+LIGHTS = [('Point', 'Lamp', (1.0, 0.9, 0.8), 0.5714, 30.0, 0.0, 0.0, (0.0, 0.0, 0.0), (0.0, 0.0, 10.0), FIRST_LAYER, []),
+          ('Spot', 'Spot', (0.2, 0.4, 0.6), 1.0, 12.5, 0.29, 0.377, (0.0, 0.0, -1.0), (1.0, 2.0, 8.0), FIRST_LAYER,
+           [('Flicker', 1)]),
+          ('Directional', 'Sun', (1.0, 1.0, 0.9), 0.8, 0.0, 0.0, 0.0, (0.3, -0.3, -0.9), (0.0, 0.0, 0.0), FIRST_LAYER, [])]
+
+# id, fov, position, rotation, layers, properties
+CAMERA = ('Camera', 0.857, (10.0, -10.0, 5.0), (2, 1.1, 0.0, 0.785, 1.0), FIRST_LAYER, [])
+
+BVH = [((-4.0, -1.0, -1.0), (9.0, 9.0, 11.0), 0, 2),
+       ((-4.0, -1.0, 0.5), (-2.0, 1.0, 2.5), 0, 1)]
+
+BATCHES = [('stage_models/batch.0.xcdm', (0, 1), 'Bark', [('Tree', 0, 36), ('Tree_001', 36, 36)])]
+
+# Written with --world-bounds and --lods, the binary has no place for them
+EXTRAS = {'Tree': {'worldBounds': ((2.0, 3.0, 4.0), (6.0, 7.0, 8.0), (4.0, 5.0, 6.0), 3.5),
+                   'lods': [(0.707, 'stage_models/Tree.lod1.xcdm')]}}
+
+def WriteStage(directory, fileName='stage.xcd', compact=False, sections=SECTION_ALL, elements=ELEMENTS,
+               extras={}, integerIds=False):
+    """Writes the records into directory, returns the paths of the xml and the binary"""
+    xmlPath = os.path.join(directory, fileName)
+    binaryPath = os.path.join(directory, 'stage.xcdb')
+    file = gzip.open(xmlPath, 'wt', encoding='utf-8') if fileName.endswith('.gz') else open(xmlPath, 'w', encoding='utf-8')
+
+    stage = XCDStageWriter(XCDBufferedWriter(file), XCDBinaryWriter(sections), instancing=compact, compact=compact,
+                           linkTable=LinkTable() if compact else None)
+    stage.WriteHeader(fileName, 'test')
+    stage.WriteFog('LINEAR', 25.0, (0.5, 0.6, 0.7))
+
+    path = []
+    for index, (id, link, parent, rotation, translation, scale, bounds, layers, properties) in enumerate(elements):
+        while path and path[-1] != parent:
+            stage.EndElement()
+            path.pop()
+        extra = extras.get(id, {})
+        stage.BeginElement(id, link, translation, rotation, scale, bounds, layers, properties,
+                           extra.get('worldBounds'), extra.get('lods'), uid=index if integerIds else None)
+        path.append(index)
+    for index in path:
+        stage.EndElement()
+
+    for light in LIGHTS:
+        stage.WriteLight(*light)
+    stage.WriteCamera(*CAMERA)
+    stage.WriteFooter(BATCHES if compact else None, BVH if compact else None)
+
+    stage.writer.Close()
+    stage.binary.Save(binaryPath)
+    return xmlPath, binaryPath
+
+class BinaryRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def Models(self, **arguments):
+        xmlPath, binaryPath = WriteStage(self.directory, **arguments)
+        return ReadBinary(binaryPath), ReadXml(xmlPath)
+
+    def testPlain(self):
+        binaryModel, xmlModel = self.Models()
+
+        self.assertEqual(Compare(binaryModel, xmlModel), [])
+        self.assertEqual([element['parent'] for element in xmlModel['elements']], [-1, 0, 0, -1])
+        self.assertEqual(binaryModel['elements'][0]['properties'], [('Kind', 'Root'), ('Weight', 2.5), ('Count', 3)])
+        self.assertEqual(binaryModel['elements'][3]['layers'], 2)
+        self.assertEqual([light['type'] for light in xmlModel['lights']], ['Point', 'Spot', 'Directional'])
+        self.assertEqual(xmlModel['lights'][1]['properties'], [('Flicker', 1)])
+
+    def testCompact(self):
+        binaryModel, xmlModel = self.Models(compact=True)
+
+        self.assertEqual(Compare(binaryModel, xmlModel), [])
+        self.assertEqual([(element['id'], element['link'], element['parent']) for element in xmlModel['elements']],
+                         [('Root', None, -1), ('Tree', 'Assets/Tree.dae', 0), ('Tree_001', 'Assets/Tree.dae', 0),
+                          ('Rock', 'Assets/Rock.dae', -1)])
+        self.assertEqual(xmlModel['elements'][2]['translation'], [7.0, 8.0, 9.0])
+        self.assertEqual(xmlModel['elements'][2]['scale'], [2.0, 2.0, 2.0])
+
+        # The second tree is an instance of the first, only id and translation differ
+        with open(os.path.join(self.directory, 'stage.xcd'), encoding='utf-8') as file:
+            text = file.read()
+        self.assertIn('<instance prototype="0" id="Tree_001"><translation>7.000000 8.000000 9.000000</translation></instance>', text)
+        self.assertIn('<links><link index="0">Assets/Tree.dae</link><link index="1">Assets/Rock.dae</link></links>', text)
+
+    def testCompactBVHAndBatches(self):
+        binaryModel, xmlModel = self.Models(compact=True)
+
+        self.assertEqual(xmlModel['bvh'], [list(node) for node in BVH])
+        link, cell, material, ranges = BATCHES[0]
+        self.assertEqual(xmlModel['batches'], [{'link': link, 'cell': list(cell), 'material': material, 'ranges': ranges}])
+
+    def testCompressed(self):
+        binaryModel, xmlModel = self.Models(fileName='stage.xcd.gz', compact=True)
+        self.assertEqual(Compare(binaryModel, xmlModel), [])
+
+    def testSections(self):
+        # Only the transforms are stored, bounds, lights and cameras are not compared
+        binaryModel, xmlModel = self.Models(sections=SECTION_TRANSFORMS)
+        self.assertEqual(binaryModel['lights'], [])
+        self.assertNotIn('bounds', binaryModel['elements'][0])
+        self.assertEqual(Compare(binaryModel, xmlModel), [])
+
+    def testDifferences(self):
+        moved = list(ELEMENTS)
+        moved[3] = moved[3][:4] + ((-3.0, 0.5, 1.5),) + moved[3][5:]
+        xmlPath, binaryPath = WriteStage(self.directory, compact=True)
+        movedDirectory = os.path.join(self.directory, 'moved')
+        os.makedirs(movedDirectory)
+        movedXmlPath, movedBinaryPath = WriteStage(movedDirectory, compact=True, elements=moved)
+
+        differences = Compare(ReadBinary(movedBinaryPath), ReadXml(xmlPath))
+        self.assertEqual(len(differences), 1)
+        self.assertTrue(differences[0].startswith('elements Rock.translation'))
+
+    def testXmlOnlyKeys(self):
+        # World bounds, lods and uids are dropped by the binary, they show up instead of being skipped
+        binaryModel, xmlModel = self.Models(extras=EXTRAS, integerIds=True)
+        self.assertEqual(xmlModel['elements'][1]['lods'], [(0.707, 'stage_models/Tree.lod1.xcdm')])
+
+        differences = Compare(binaryModel, xmlModel)
+        self.assertTrue(all(['only in the xml' in difference for difference in differences]), differences)
+        self.assertEqual(sorted([difference.split(':')[0] for difference in differences]),
+                         ['elements Rock.uid', 'elements Root.uid', 'elements Tree.lods', 'elements Tree.uid',
+                          'elements Tree.worldBounds', 'elements Tree_001.uid'])
+
+class MatrixRotationTest(unittest.TestCase):
+    """Stage written with rotation_encoding MATRIX, the xml holds the 3x4 rows of tag 4
+       where the binary keeps a quaternion"""
+
+    ELEMENTS = [('Plain', (1.0, 2.0, 3.0), (1.0, 1.0, 1.0)),
+                ('Scaled', (-4.0, 0.5, 8.0), (2.0, 0.5, 3.0)),
+                ('Mirrored', (0.0, 0.0, 0.0), (-1.0, -1.0, -1.0))]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def WriteStage(self, name, angle):
+        """Rotation about z, as the exporter hands rows and quaternion to the stage writer"""
+        c, s = math.cos(angle), math.sin(angle)
+        quaternion = (math.cos(angle * 0.5), 0.0, 0.0, math.sin(angle * 0.5))
+        directory = os.path.join(self.directory, name)
+        os.makedirs(directory)
+        xmlPath = os.path.join(directory, 'stage.xcd')
+        binaryPath = os.path.join(directory, 'stage.xcdb')
+
+        stage = XCDStageWriter(XCDBufferedWriter(open(xmlPath, 'w', encoding='utf-8')), XCDBinaryWriter(SECTION_ALL),
+                               rotationEncoding='MATRIX')
+        stage.WriteHeader('stage.xcd', 'test')
+        for id, translation, scale in self.ELEMENTS:
+            rows = (c * scale[0], -s * scale[1], 0.0, translation[0],
+                    s * scale[0], c * scale[1], 0.0, translation[1],
+                    0.0, 0.0, scale[2], translation[2])
+            stage.BeginElement(id, None, translation, (4,) + rows, scale, ZERO_BOX, FIRST_LAYER, [], quaternion=quaternion)
+            stage.EndElement()
+        stage.WriteCamera('Camera', 0.857, (10.0, -10.0, 5.0), (4, c, -s, 0.0, 10.0, s, c, 0.0, -10.0, 0.0, 0.0, 1.0, 5.0),
+                          FIRST_LAYER, [], quaternion=quaternion)
+        stage.WriteFooter()
+        stage.writer.Close()
+        stage.binary.Save(binaryPath)
+        return xmlPath, binaryPath
+
+    def Models(self, binaryAngle, xmlAngle):
+        binaryPath = self.WriteStage('binary', binaryAngle)[1]
+        xmlPath = self.WriteStage('xml', xmlAngle)[0]
+        return ReadBinary(binaryPath), ReadXml(xmlPath)
+
+    def testMatrixRows(self):
+        binaryModel, xmlModel = self.Models(0.7, 0.7)
+        self.assertEqual([len(element['rotation']) for element in xmlModel['elements']], [13, 13, 13])
+        self.assertEqual(xmlModel['elements'][0]['rotation'][0], 4)
+        self.assertEqual(binaryModel['elements'][0]['rotation'][0], 3)
+        self.assertEqual(Compare(binaryModel, xmlModel), [])
+
+    def testMatrixDifferences(self):
+        binaryModel, xmlModel = self.Models(0.7, 0.9)
+        differences = Compare(binaryModel, xmlModel)
+        self.assertEqual(len(differences), 4)
+        self.assertTrue(all(['.rotation' in difference for difference in differences]))
+
+if __name__ == "__main__":
+    unittest.main()
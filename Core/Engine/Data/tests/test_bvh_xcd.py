@@ -0,0 +1,158 @@
+import os
+import sys
+import math
+import random
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_scene_xcd'))
+
+from bvh_xcd import BuildBVH, QueryFrustum, QueryRay, Validate, LEAF_SIZE
+
+# -------------------------------------------------------------------------
+# Trees over synthetic boxes, queries are checked against testing every box
+# -------------------------------------------------------------------------
+def RandomBoxes(generator, count, extent=100.0, size=5.0):
+    boxes = []
+    for i in range(count):
+        center = [generator.uniform(-extent, extent) for axis in range(3)]
+        half = [generator.uniform(0.0, size) for axis in range(3)]
+        boxes.append((tuple([center[axis] - half[axis] for axis in range(3)]),
+                      tuple([center[axis] + half[axis] for axis in range(3)])))
+    return boxes
+
+def ClusteredBoxes(generator, count):
+    """Dense clusters far apart, plus flat boxes lying in one plane"""
+    boxes = []
+    for i in range(count):
+        cluster = (i % 4) * 1000.0
+        x, y = generator.uniform(-1.0, 1.0) + cluster, generator.uniform(-1.0, 1.0)
+        boxes.append(((x, y, 0.0), (x + 0.5, y + 0.5, 0.0 if i % 3 == 0 else 0.5)))
+    return boxes
+
+def BoxPlanes(minimum, maximum):
+    """Frustum planes of an axis aligned box, inside is a * x + b * y + c * z + d >= 0"""
+    planes = []
+    for axis in range(3):
+        normal = [0.0, 0.0, 0.0]
+        normal[axis] = 1.0
+        planes.append(tuple(normal) + (-minimum[axis],))
+        normal[axis] = -1.0
+        planes.append(tuple(normal) + (maximum[axis],))
+    return planes
+
+def PerspectivePlanes(origin, angle):
+    """Four side planes of a frustum looking along +x from origin plus near and far planes"""
+    s, c = math.sin(angle), math.cos(angle)
+    ox, oy, oz = origin
+    planes = [(s, c, 0.0), (s, -c, 0.0), (s, 0.0, c), (s, 0.0, -c)]
+    planes = [(a, b, d, -(a * ox + b * oy + d * oz)) for a, b, d in planes]
+    return planes + [(1.0, 0.0, 0.0, -(ox + 1.0)), (-1.0, 0.0, 0.0, ox + 150.0)]
+
+def BruteForceFrustum(boxes, planes):
+    result = []
+    for position, (minimum, maximum) in enumerate(boxes):
+        inside = True
+        for a, b, c, d in planes:
+            corner = [maximum[i] if value >= 0 else minimum[i] for i, value in enumerate((a, b, c))]
+            if a * corner[0] + b * corner[1] + c * corner[2] + d < 0:
+                inside = False
+        if inside:
+            result.append(position)
+    return result
+
+def BruteForceRay(boxes, origin, direction, maxDistance):
+    result = []
+    for position, (minimum, maximum) in enumerate(boxes):
+        near, far = 0.0, maxDistance
+        for i in range(3):
+            if direction[i] == 0.0:
+                if origin[i] < minimum[i] or origin[i] > maximum[i]:
+                    near, far = 1.0, 0.0
+                continue
+            t0 = (minimum[i] - origin[i]) / direction[i]
+            t1 = (maximum[i] - origin[i]) / direction[i]
+            near, far = max(near, min(t0, t1)), min(far, max(t0, t1))
+        if near <= far:
+            result.append((near, position))
+    return sorted(result)
+
+class BVHTest(unittest.TestCase):
+    def Build(self, boxes):
+        nodes, order = BuildBVH(boxes)
+        self.assertEqual(sorted(order), list(range(len(boxes))))
+        return nodes, [boxes[index] for index in order]
+
+    def AssertHits(self, hits, expected):
+        # The tree multiplies by the inverse direction, distances differ in the last digits
+        self.assertEqual([position for distance, position in hits], [position for distance, position in expected])
+        for (distance, position), (expectedDistance, expectedPosition) in zip(hits, expected):
+            self.assertAlmostEqual(distance, expectedDistance, places=9)
+
+    def CheckQueries(self, nodes, boxes, generator, count=100):
+        for i in range(count):
+            origin = [generator.uniform(-120.0, 120.0) for axis in range(3)]
+            direction = [generator.uniform(-1.0, 1.0) for axis in range(3)]
+            if i % 3 == 0:
+                # Aimed at a box, random rays rarely hit the small boxes
+                minimum, maximum = boxes[generator.randrange(len(boxes))]
+                direction = [(minimum[axis] + maximum[axis]) * 0.5 - origin[axis] for axis in range(3)]
+            if i % 10 == 0:
+                # Axis parallel rays take the zero direction branch
+                direction[i % 3] = 0.0
+            maxDistance = float('inf') if i % 2 else generator.uniform(1.0, 200.0)
+            self.AssertHits(QueryRay(nodes, boxes, origin, direction, maxDistance),
+                            BruteForceRay(boxes, origin, direction, maxDistance))
+
+            center = [generator.uniform(-100.0, 100.0) for axis in range(3)]
+            half = generator.uniform(1.0, 60.0)
+            planes = BoxPlanes([value - half for value in center], [value + half for value in center])
+            self.assertEqual(QueryFrustum(nodes, boxes, planes), BruteForceFrustum(boxes, planes))
+
+            planes = PerspectivePlanes(origin, generator.uniform(0.2, 1.2))
+            self.assertEqual(QueryFrustum(nodes, boxes, planes), BruteForceFrustum(boxes, planes))
+
+    def testRandomBoxes(self):
+        generator = random.Random(1)
+        for count in (1, 3, 17, 500):
+            nodes, boxes = self.Build(RandomBoxes(generator, count))
+            self.assertEqual(Validate(nodes, boxes), [])
+            self.CheckQueries(nodes, boxes, generator)
+
+    def testClusteredBoxes(self):
+        generator = random.Random(2)
+        nodes, boxes = self.Build(ClusteredBoxes(generator, 300))
+        self.assertEqual(Validate(nodes, boxes), [])
+        self.CheckQueries(nodes, boxes, generator, 30)
+
+    def testLeafSize(self):
+        nodes, boxes = self.Build(RandomBoxes(random.Random(3), 257))
+        leaves = [node for node in nodes if node[3]]
+        self.assertTrue(all([count <= LEAF_SIZE for minimum, maximum, first, count in leaves]))
+        self.assertEqual(sum([node[3] for node in leaves]), 257)
+
+    def testCoincidentCenters(self):
+        # No axis spreads the centers, the ranges are halved until the leaves are small
+        boxes = [((-1.0 - i, -1.0, -1.0), (1.0 + i, 1.0, 1.0)) for i in range(20)]
+        nodes, ordered = self.Build(boxes)
+        self.assertEqual(Validate(nodes, ordered), [])
+        self.assertTrue(all([node[3] <= LEAF_SIZE for node in nodes]))
+
+    def testEmpty(self):
+        self.assertEqual(BuildBVH([]), ([], []))
+        self.assertEqual(Validate([], []), [])
+        self.assertEqual(QueryRay([], [], (0.0, 0.0, 0.0), (1.0, 0.0, 0.0)), [])
+
+    def testValidateReportsProblems(self):
+        nodes, boxes = self.Build(RandomBoxes(random.Random(4), 50))
+        leaf = [index for index, node in enumerate(nodes) if node[3]][0]
+        nodes[leaf][1] = tuple([value - 1000.0 for value in nodes[leaf][1]])
+        problems = Validate(nodes, boxes)
+        self.assertTrue(any(['is not inside leaf %d' % leaf in problem for problem in problems]), problems)
+
+        nodes, boxes = self.Build(RandomBoxes(random.Random(5), 50))
+        leaf = [node for node in nodes if node[3]][0]
+        leaf[3] += 1
+        self.assertTrue(any(['in 2 leaves' in problem for problem in Validate(nodes, boxes)]))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+import os
+import sys
+import shlex
+import shutil
+import tempfile
+import subprocess
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from export_parallel import ExportJob, ExportScheduler, main
+
+# -------------------------------------------------------------------------
+# Scheduler and driver, with python one-liners standing in for Blender
+# -------------------------------------------------------------------------
+def PythonCommand(script, *arguments):
+    return [sys.executable, "-c", script] + list(arguments)
+
+class ExportSchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.logDirectory = os.path.join(self.directory, 'logs')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def Source(self, name, size):
+        path = os.path.join(self.directory, name + '.blend')
+        with open(path, 'wb') as file:
+            file.write(b'\0' * size)
+        return path
+
+    def Job(self, name, size, script):
+        source = self.Source(name, size)
+        job = ExportJob(source, os.path.join(self.directory, name + '.xcd'))
+        job.command = PythonCommand(script, source, job.target)
+        return job
+
+    def testLongestFirst(self):
+        orderPath = os.path.join(self.directory, 'order')
+        script = "import sys; open(%r, 'a').write(sys.argv[1] + '\\n')" % orderPath
+        jobs = [self.Job(name, size, script) for name, size in (('small', 10), ('large', 3000), ('medium', 500))]
+
+        ExportScheduler(jobs, 1, self.logDirectory).Run()
+
+        with open(orderPath) as file:
+            order = [os.path.basename(line.strip()) for line in file]
+        self.assertEqual(order, ['large.blend', 'medium.blend', 'small.blend'])
+        self.assertEqual([job.exitCode for job in jobs], [0, 0, 0])
+
+    def testFailures(self):
+        succeeding = self.Job('good', 10, "print('exported ' + __import__('sys').argv[2])")
+        failing = self.Job('bad', 20, "import sys; print('broken'); sys.exit(3)")
+        missing = ExportJob(self.Source('missing', 30), os.path.join(self.directory, 'missing.xcd'))
+        missing.command = [os.path.join(self.directory, 'no-such-blender')]
+        jobs = [succeeding, failing, missing]
+
+        self.assertIs(ExportScheduler(jobs, 3, self.logDirectory).Run(), jobs)
+        self.assertEqual([job.exitCode for job in jobs], [0, 3, -1])
+
+        # One log per job, named after the target and its position, starting with the command line
+        self.assertEqual(sorted(os.listdir(self.logDirectory)), ['bad_1.log', 'good_0.log', 'missing_2.log'])
+        for job, expected in zip(jobs, ['exported ' + succeeding.target, 'broken', 'could not start worker']):
+            self.assertEqual(job.logPath, os.path.join(self.logDirectory, os.path.basename(job.logPath)))
+            with open(job.logPath) as file:
+                log = file.read()
+            self.assertTrue(log.startswith(subprocess.list2cmdline(job.command)), log)
+            self.assertIn(expected, log)
+            self.assertGreaterEqual(job.duration, 0.0)
+
+class ExportParallelMainTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifestPath = os.path.join(self.directory, 'stages.txt')
+        with open(self.manifestPath, 'w') as file:
+            for name in ('First', 'Second'):
+                open(os.path.join(self.directory, name + '.blend'), 'w').close()
+                file.write('%s.blend -> out/%s.xcd\n' % (name, name))
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def Run(self, script, *exportArguments):
+        worker = '%s -c "%s" {source} {target}' % (shlex.quote(sys.executable), script)
+        arguments = ['--manifest', self.manifestPath, '--worker', worker, '--jobs', '2',
+                     '--logs', os.path.join(self.directory, 'logs')]
+        if exportArguments:
+            arguments = arguments + ['--'] + list(exportArguments)
+        return main(arguments)
+
+    def testExportArguments(self):
+        script = "import sys; open(sys.argv[2], 'w').write(repr(sys.argv[3:]))"
+        self.assertEqual(self.Run(script, '--meshes', '--lods', '0.5 0.25', '--compress', '--compression-level', '9'), 0)
+
+        for name in ('First', 'Second'):
+            with open(os.path.join(self.directory, 'out', name + '.xcd')) as file:
+                self.assertEqual(file.read(), repr(['--meshes', '--lods', '0.5 0.25', '--compress', '--compression-level', '9']))
+
+    def testCompress(self):
+        script = "import sys; open(sys.argv[2], 'w').write(repr(sys.argv[3:]))"
+        worker = '%s -c "%s" {source} {target}' % (shlex.quote(sys.executable), script)
+        self.assertEqual(main(['--manifest', self.manifestPath, '--worker', worker, '--compress',
+                               '--logs', os.path.join(self.directory, 'logs')]), 0)
+
+        with open(os.path.join(self.directory, 'out', 'First.xcd')) as file:
+            self.assertEqual(file.read(), repr(['--compress', '--compression-level', '6']))
+
+        with self.assertRaises(SystemExit):
+            main(['--manifest', self.manifestPath, '--compress', '--compression-level', '12'])
+
+    def testExitCode(self):
+        script = "import sys; sys.exit(1 if 'Second' in sys.argv[1] else 0)"
+        self.assertEqual(self.Run(script), 1)
+
+    def testStageArgumentsRejected(self):
+        with self.assertRaises(SystemExit):
+            self.Run("pass", '--config', 'other.conf')
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import os
+import sys
+import math
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'io_scene_xcd'))
+
+from lod_xcd import BuildLODChain, SimplifyMesh, GridMesh, ParseRatios, ScreenSize, DEFAULT_RATIOS
+
+# -------------------------------------------------------------------------
+# Simplification of synthetic grids, triangle counts per level and the
+# positions that have to stay: borders, uv seams and material borders
+# -------------------------------------------------------------------------
+def TriangleCount(mesh):
+    return sum([len(entry['indices']) for entry in mesh['submeshes']]) // 3
+
+def UsedPositions(mesh, submesh=None):
+    entries = mesh['submeshes'] if submesh is None else [entry for entry in mesh['submeshes'] if entry['material'] == submesh]
+    return set([mesh['positions'][index] for entry in entries for index in entry['indices']])
+
+def BorderEdges(mesh):
+    """Edges used by a single triangle, as position pairs"""
+    uses = {}
+    for entry in mesh['submeshes']:
+        indices = entry['indices']
+        for i in range(0, len(indices), 3):
+            corners = [mesh['positions'][index] for index in indices[i:i + 3]]
+            for a, b in zip(corners, corners[1:] + corners[:1]):
+                edge = (min(a, b), max(a, b))
+                uses[edge] = uses.get(edge, 0) + 1
+    return set([edge for edge, count in uses.items() if count == 1])
+
+def SeamGrid(size):
+    """Grid whose middle column is split into two vertices with different uvs, left and right
+       halves use different materials"""
+    mesh = GridMesh(size)
+    positions = list(mesh['positions'])
+    uvs = [(position[0] / size, position[1] / size) for position in positions]
+    seam = size // 2
+
+    # Right half triangles use copies of the seam column vertices
+    copies = {}
+    for y in range(size + 1):
+        vertex = y * (size + 1) + seam
+        copies[vertex] = len(positions)
+        positions.append(positions[vertex])
+        uvs.append((1.0, uvs[vertex][1]))
+
+    left = []
+    right = []
+    indices = mesh['submeshes'][0]['indices']
+    for i in range(0, len(indices), 3):
+        triangle = indices[i:i + 3]
+        if min([positions[index][0] for index in triangle]) >= seam:
+            right.extend([copies.get(index, index) for index in triangle])
+        else:
+            left.extend(triangle)
+
+    return {'positions': positions, 'normals': [(0.0, 0.0, 1.0)] * len(positions), 'uvs': uvs,
+            'submeshes': [{'material': 'Left', 'indices': left}, {'material': 'Right', 'indices': right}],
+            'bounds': mesh['bounds']}
+
+def FlatGrid(size):
+    """Flat shaded grid, every triangle has vertices of its own carrying the face normal"""
+    mesh = GridMesh(size)
+    positions = []
+    normals = []
+    indices = []
+    source = mesh['submeshes'][0]['indices']
+    for i in range(0, len(source), 3):
+        corners = [mesh['positions'][index] for index in source[i:i + 3]]
+        (ax, ay, az), (bx, by, bz), (cx, cy, cz) = corners
+        normal = ((by - ay) * (cz - az) - (bz - az) * (cy - ay),
+                  (bz - az) * (cx - ax) - (bx - ax) * (cz - az),
+                  (bx - ax) * (cy - ay) - (by - ay) * (cx - ax))
+        length = math.sqrt(sum([value * value for value in normal]))
+        for corner in corners:
+            indices.append(len(positions))
+            positions.append(corner)
+            normals.append(tuple([value / length for value in normal]))
+    return {'positions': positions, 'normals': normals, 'uvs': None,
+            'submeshes': [{'material': None, 'indices': indices}], 'bounds': mesh['bounds']}
+
+class LODTest(unittest.TestCase):
+    def testTriangleCounts(self):
+        mesh = GridMesh(40)
+        total = TriangleCount(mesh)
+        chain = BuildLODChain(mesh, DEFAULT_RATIOS)
+
+        self.assertEqual([ratio for ratio, screenSize, level in chain], sorted(DEFAULT_RATIOS, reverse=True))
+        for ratio, screenSize, level in chain:
+            # A collapse removes two triangles, the target is met within one collapse
+            target = int(total * ratio)
+            self.assertLessEqual(TriangleCount(level), target)
+            self.assertGreaterEqual(TriangleCount(level), target - 2)
+            self.assertAlmostEqual(screenSize, math.sqrt(ratio))
+
+    def testMonotonic(self):
+        # The small grid runs out of free vertices, levels that remove nothing are left out
+        for mesh in (GridMesh(40), GridMesh(12), SeamGrid(20)):
+            chain = BuildLODChain(mesh, (0.5, 0.25, 0.125, 0.05, 0.01))
+            counts = [TriangleCount(mesh)] + [TriangleCount(level) for ratio, screenSize, level in chain]
+            screenSizes = [screenSize for ratio, screenSize, level in chain]
+            self.assertEqual(counts, sorted(counts, reverse=True))
+            self.assertLess(counts[-1], counts[0])
+            self.assertEqual(screenSizes, sorted(screenSizes, reverse=True))
+
+    def testSharedVertices(self):
+        mesh = GridMesh(20)
+        for ratio, screenSize, level in BuildLODChain(mesh):
+            self.assertIs(level['positions'], mesh['positions'])
+            self.assertIs(level['normals'], mesh['normals'])
+            self.assertEqual(level['bounds'], mesh['bounds'])
+
+    def testBorderKept(self):
+        mesh = GridMesh(24)
+        border = BorderEdges(mesh)
+        borderPositions = set([position for edge in border for position in edge])
+        for ratio, screenSize, level in BuildLODChain(mesh, (0.5, 0.25, 0.125, 0.05)):
+            self.assertEqual(BorderEdges(level), border)
+            self.assertTrue(borderPositions <= UsedPositions(level))
+
+    def testSeamsKept(self):
+        mesh = SeamGrid(24)
+        seam = set([position for position in mesh['positions'] if position[0] == 12.0])
+        for ratio, screenSize, level in BuildLODChain(mesh, (0.5, 0.25, 0.125)):
+            self.assertLess(TriangleCount(level), TriangleCount(mesh))
+            # The seam column stays in place on both sides of the uv and material border
+            self.assertTrue(seam <= UsedPositions(level, 'Left'))
+            self.assertTrue(seam <= UsedPositions(level, 'Right'))
+            self.assertEqual([entry['material'] for entry in level['submeshes']], ['Left', 'Right'])
+
+            # Triangles keep to their side, the uv copies are only used on the right
+            copies = set(range(25 * 25, len(mesh['positions'])))
+            self.assertFalse(copies & set(level['submeshes'][0]['indices']))
+            self.assertFalse(any([mesh['positions'][index][0] < 12.0 for index in level['submeshes'][1]['indices']]))
+
+    def testFlatShaded(self):
+        # Every position is split, the vertices follow the collapse onto the closest normal
+        mesh = FlatGrid(20)
+        total = TriangleCount(mesh)
+        border = BorderEdges(mesh)
+        chain = BuildLODChain(mesh, DEFAULT_RATIOS)
+        self.assertEqual(len(chain), len(DEFAULT_RATIOS))
+        for ratio, screenSize, level in chain:
+            target = int(total * ratio)
+            self.assertLessEqual(TriangleCount(level), target)
+            self.assertGreaterEqual(TriangleCount(level), target - 2)
+            self.assertEqual(BorderEdges(level), border)
+            self.assertIs(level['normals'], mesh['normals'])
+
+    def testUVSeamCollapses(self):
+        # Without the material border the seam column collapses along itself, the sides stay apart
+        mesh = SeamGrid(24)
+        mesh['submeshes'] = [{'material': None, 'indices': mesh['submeshes'][0]['indices'] + mesh['submeshes'][1]['indices']}]
+        copies = set(range(25 * 25, len(mesh['positions'])))
+        seamCounts = []
+        for ratio, screenSize, level in BuildLODChain(mesh, (0.5, 0.25, 0.125)):
+            self.assertEqual(TriangleCount(level), int(TriangleCount(mesh) * ratio))
+            indices = level['submeshes'][0]['indices']
+            for i in range(0, len(indices), 3):
+                xs = [mesh['positions'][index][0] for index in indices[i:i + 3]]
+                if copies & set(indices[i:i + 3]):
+                    self.assertGreaterEqual(min(xs), 12.0)
+                elif 12.0 in xs:
+                    self.assertLessEqual(max(xs), 12.0)
+            seamCounts.append(len(set([mesh['positions'][index] for index in indices if index in copies])))
+        self.assertEqual(seamCounts, sorted(seamCounts, reverse=True))
+        self.assertLess(seamCounts[-1], 25)
+
+    def testNoProgress(self):
+        # A single quad is all border, a level that removes nothing is not part of the chain
+        mesh = {'positions': [(0.0, 0.0, 0.0), (1.0, 0.0, 0.0), (1.0, 1.0, 0.0), (0.0, 1.0, 0.0)],
+                'normals': [(0.0, 0.0, 1.0)] * 4, 'uvs': None,
+                'submeshes': [{'material': None, 'indices': [0, 1, 2, 0, 2, 3]}],
+                'bounds': ((0.0, 0.0, 0.0), (1.0, 1.0, 0.0))}
+        self.assertEqual(BuildLODChain(mesh, DEFAULT_RATIOS), [])
+
+        # The small grid runs out of interior positions before the last ratios
+        mesh = GridMesh(4)
+        chain = BuildLODChain(mesh, (0.5, 0.25, 0.125, 0.05, 0.01))
+        counts = [TriangleCount(mesh)] + [TriangleCount(level) for ratio, screenSize, level in chain]
+        self.assertLess(len(chain), 5)
+        self.assertTrue(all([a > b for a, b in zip(counts, counts[1:])]), counts)
+
+    def testDeterministic(self):
+        first = SimplifyMesh(SeamGrid(16), 0.3)
+        second = SimplifyMesh(SeamGrid(16), 0.3)
+        self.assertEqual(first['submeshes'], second['submeshes'])
+
+    def testParseRatios(self):
+        self.assertEqual(ParseRatios('0.5 0.25,0.125'), (0.5, 0.25, 0.125))
+        self.assertEqual(ParseRatios('1.0 0 0.5 -2'), (0.5,))
+        self.assertEqual(ParseRatios(''), ())
+        self.assertEqual(ScreenSize(0.25), 0.5)
+
+if __name__ == "__main__":
+    unittest.main()
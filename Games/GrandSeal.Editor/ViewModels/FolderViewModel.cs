@@ -504,6 +504,17 @@ private IResourceViewModel GetResourceViewModelForFile(CarbonFile file)
                         return this.logic.AddResourceStage();
                     }
 
+                case ".gz":
+                    {
+                        // Compressed stages are exported as .xcd.gz
+                        if (file.FileName.EndsWith(".xcd.gz", StringComparison.OrdinalIgnoreCase))
+                        {
+                            return this.logic.AddResourceStage();
+                        }
+
+                        return this.logic.AddResourceRaw();
+                    }
+
                 case ".lua":
                     {
                         return this.logic.AddResourceScript();